@@ -89,6 +89,46 @@ DATABASES = {
 }
 
 
+# Cache
+# يُستخدم لمشاركة أختام إصدار الكاشات المحلية بين كل العمليات (workers)،
+# لذلك يجب أن يكون كاشاً مشتركاً (ملفات، Redis، Memcached) وليس LocMemCache.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', str(BASE_DIR / '.cache')),
+    }
+}
+
+# أقصى مدة (بالثواني) تستخدم فيها العملية كاشها المحلي قبل التحقق من ختم الإصدار المشترك
+PROCESS_CACHE_CHECK_INTERVAL = float(os.getenv('PROCESS_CACHE_CHECK_INTERVAL', '1.0'))
+
+
+# Logging
+# سجل تفاصيل التسعير (management.pricing) يُكتب فقط عند تفعيل PRICING_TRACE
+# أو لعيّنة من الطلبات بنسبة PRICING_TRACE_SAMPLE_RATE (0.0 - 1.0).
+
+PRICING_TRACE = os.getenv('PRICING_TRACE', '') == '1'
+PRICING_TRACE_SAMPLE_RATE = float(os.getenv('PRICING_TRACE_SAMPLE_RATE', '0'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'management': {
+            'handlers': ['console'],
+            'level': os.getenv('MANAGEMENT_LOG_LEVEL', 'INFO'),
+        },
+        'management.pricing': {
+            'level': os.getenv('PRICING_LOG_LEVEL', 'DEBUG'),
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -131,7 +171,36 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# نموذج Gemini المستخدم في كل التحليلات، وتسخين الاتصال به عند بدء التشغيل (1 للتفعيل)
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash-latest")
+GEMINI_WARMUP = os.getenv("GEMINI_WARMUP", "0") == "1"
 
 # core/settings.py
 ULTRAMSG_INSTANCE_ID = os.getenv("ULTRAMSG_INSTANCE_ID")
-ULTRAMSG_TOKEN = os.getenv("ULTRAMSG_TOKEN")
\ No newline at end of file
+ULTRAMSG_TOKEN = os.getenv("ULTRAMSG_TOKEN")
+# يمكن توجيهه إلى الخادم المحلي البديل (manage.py ultramsg_standin) لاختبارات الحمل
+ULTRAMSG_BASE_URL = os.getenv("ULTRAMSG_BASE_URL", "https://api.ultramsg.com")
+# أقصى عدد رسائل تُرسل بالتوازي في كل عملية (لكل مهام التوزيع معاً)، ومهلة كل طلب بالثواني
+ULTRAMSG_MAX_CONCURRENCY = int(os.getenv("ULTRAMSG_MAX_CONCURRENCY", "8"))
+ULTRAMSG_TIMEOUT = float(os.getenv("ULTRAMSG_TIMEOUT", "20"))
+
+# صندوق الرسائل الصادرة: عدد المحاولات، والتأخير بين المحاولات (ثوانٍ: BASE * 2^n بحد أقصى MAX)،
+# ومدة حجز الصف قبل أن يعود متاحاً لعامل آخر (0 = تُحسب من أسوأ زمن للإرسال، انظر outbox.claim_timeout)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_BACKOFF_BASE = int(os.getenv("OUTBOX_BACKOFF_BASE", "30"))
+OUTBOX_BACKOFF_MAX = int(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))
+OUTBOX_CLAIM_TIMEOUT = int(os.getenv("OUTBOX_CLAIM_TIMEOUT", "0"))
+
+# أقصى طول لرسالة واتساب واحدة (رسائل التجميع تُقسَّم عنده)
+WHATSAPP_MAX_MESSAGE_LENGTH = int(os.getenv("WHATSAPP_MAX_MESSAGE_LENGTH", "4096"))
+
+# كاش نتائج تحليل النصوص بالذكاء الاصطناعي: مدة الصلاحية (ثوانٍ)، وأقصى عدد نتائج في ذاكرة كل عملية
+PARSE_CACHE_TTL = int(os.getenv("PARSE_CACHE_TTL", str(7 * 24 * 3600)))
+PARSE_CACHE_MAX_ENTRIES = int(os.getenv("PARSE_CACHE_MAX_ENTRIES", "256"))
+# النصوص الطويلة تُقسَّم إلى أجزاء بهذا العدد من الأسطر تُحلَّل بالتوازي، مع إعادة محاولة كل جزء فاشل
+PARSE_CHUNK_LINES = int(os.getenv("PARSE_CHUNK_LINES", "40"))
+PARSE_MAX_CONCURRENCY = int(os.getenv("PARSE_MAX_CONCURRENCY", "4"))
+PARSE_CHUNK_RETRIES = int(os.getenv("PARSE_CHUNK_RETRIES", "2"))
+
+# عدد خيوط التوزيع في الخلفية لكل عملية
+DISTRIBUTION_WORKERS = int(os.getenv("DISTRIBUTION_WORKERS", "4"))
\ No newline at end of file
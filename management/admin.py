@@ -3,7 +3,8 @@
 from django.contrib import admin
 from .models import (
     Brand, Category, Preference, Supplier, CurrencyRate, ShippingRate,
-    Subscriber, SubscriberDeviceFee, Offer
+    Subscriber, SubscriberDeviceFee, Offer, SubscriberOfferPrice, NotificationOutbox,
+    PendingDigestOffer, ParsedOfferCache, ShippingKeywordAlias
 )
 
 # 1. تخصيص عرض النماذج البسيطة
@@ -46,6 +47,47 @@ class OfferAdmin(admin.ModelAdmin):
     readonly_fields = ('code', 'created_at')
 
 
+@admin.register(SubscriberOfferPrice)
+class SubscriberOfferPriceAdmin(admin.ModelAdmin):
+    list_display = ('offer', 'subscriber', 'price', 'currency', 'no_charge', 'error', 'updated_at')
+    list_filter = ('subscriber', 'currency', 'no_charge')
+    search_fields = ('offer__name', 'offer__code', 'subscriber__name')
+    list_select_related = ('offer__supplier', 'subscriber')
+    raw_id_fields = ('offer', 'subscriber', 'device_fee')
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ('subscriber', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('subscriber__name', 'subscriber__whatsapp_number', 'last_error')
+    list_select_related = ('subscriber',)
+    raw_id_fields = ('subscriber',)
+    readonly_fields = ('dedupe_key', 'claimed_at', 'sent_at', 'created_at')
+
+
+@admin.register(PendingDigestOffer)
+class PendingDigestOfferAdmin(admin.ModelAdmin):
+    list_display = ('subscriber', 'offer', 'created_at')
+    list_select_related = ('subscriber', 'offer')
+    raw_id_fields = ('subscriber', 'offer')
+
+
+@admin.register(ShippingKeywordAlias)
+class ShippingKeywordAliasAdmin(admin.ModelAdmin):
+    list_display = ('name', 'shipping_rate', 'created_at')
+    search_fields = ('name', 'shipping_rate__product_keyword_en')
+    list_select_related = ('shipping_rate',)
+    raw_id_fields = ('shipping_rate',)
+
+
+@admin.register(ParsedOfferCache)
+class ParsedOfferCacheAdmin(admin.ModelAdmin):
+    list_display = ('key', 'prompt_version', 'created_at', 'expires_at')
+    list_filter = ('prompt_version',)
+    readonly_fields = ('key', 'prompt_version', 'created_at')
+
+
 class PreferenceInline(admin.StackedInline):
     model = Preference
     can_delete = False
@@ -59,7 +101,7 @@ class SubscriberDeviceFeeInline(admin.TabularInline):
 
 @admin.register(Subscriber)
 class SubscriberAdmin(admin.ModelAdmin):
-    list_display = ('name', 'whatsapp_number', 'subscriber_type', 'target_currency', 'is_active')
+    list_display = ('name', 'whatsapp_number', 'subscriber_type', 'target_currency', 'digest_window_minutes', 'is_active')
     list_filter = ('subscriber_type', 'is_active')
     search_fields = ('name', 'whatsapp_number')
     # إضافة واجهة التفضيلات المضمنة
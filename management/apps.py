@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ManagementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'management'
+
+    def ready(self):
+        # تسجيل إشارات إبطال الكاشات
+        from . import signals  # noqa: F401
+
+        # فتح الاتصال بـ Gemini مسبقاً حتى لا يتأخر أول تحليل
+        from django.conf import settings
+        if getattr(settings, 'GEMINI_WARMUP', False):
+            from .gemini import warm_up_in_background
+            warm_up_in_background()
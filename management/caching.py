@@ -0,0 +1,140 @@
+# management/caching.py
+"""
+كاشات محلية داخل العملية (process-local) تُعاد بناؤها عند تغيّر البيانات.
+
+كل كاش يرتبط بـ "ختم إصدار" (version stamp) محفوظ في كاش Django المشترك،
+لذلك عندما تُغيّر عملية ما البيانات (عبر الإشارات signals) فإن بقية العمليات
+تلاحظ تغيّر الختم وتعيد تحميل نسختها المحلية عند أول استخدام.
+"""
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _check_interval():
+    return getattr(settings, 'PROCESS_CACHE_CHECK_INTERVAL', 1.0)
+
+
+class SharedVersion:
+    """ختم إصدار مشترك بين كل العمليات، محفوظ في كاش Django."""
+
+    def __init__(self, name):
+        self.key = f"management:version:{name}"
+
+    def current(self):
+        version = cache.get(self.key)
+        if version is None:
+            cache.add(self.key, uuid.uuid4().hex, timeout=None)
+            version = cache.get(self.key)
+        return version
+
+    def bump(self):
+        version = uuid.uuid4().hex
+        cache.set(self.key, version, timeout=None)
+        return version
+
+
+class ProcessCache:
+    """
+    قيمة واحدة تُحمَّل مرة واحدة لكل عملية عبر loader()، وتُعاد بناؤها
+    فقط عند استدعاء invalidate() أو عند تغيّر الختم المشترك.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.version = SharedVersion(name)
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded_version = None
+        self._checked_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if self._loaded_version is not None and now - self._checked_at < _check_interval():
+            return self._value
+        with self._lock:
+            current = self.version.current()
+            if current != self._loaded_version:
+                self._value = self.loader()
+                self._loaded_version = current
+            self._checked_at = now
+            return self._value
+
+    def update(self, apply):
+        """
+        تحديث تزايدي: يطبّق apply(value) على النسخة المحلية إن كانت محمّلة وحديثة (بدلاً من إعادة البناء)،
+        ثم يغيّر الختم المشترك لتعيد باقي العمليات بناء نسخها.
+        إذا كانت النسخة المحلية قديمة (غيّرت عملية أخرى البيانات) فلا فائدة من تعديلها: تُسقط وتُعاد بناؤها.
+        """
+        with self._lock:
+            if self._loaded_version is not None and self.version.current() == self._loaded_version:
+                apply(self._value)
+                self._loaded_version = self.version.bump()
+                self._checked_at = time.monotonic()
+            else:
+                self.version.bump()
+                self._value = None
+                self._loaded_version = None
+
+    def invalidate(self):
+        """يُسقط النسخة المحلية ويُعلم باقي العمليات بتغيّر البيانات."""
+        with self._lock:
+            self.version.bump()
+            self._value = None
+            self._loaded_version = None
+
+
+class KeyedProcessCache:
+    """
+    مثل ProcessCache لكن لقيم متعددة بمفتاح (مثلاً: قيمة لكل مشترك).
+    أي تغيير يُسقط القيمة المعنية محلياً، ويُسقط كل القيم في العمليات الأخرى.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.version = SharedVersion(name)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._loaded_version = None
+        self._checked_at = 0.0
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._loaded_version is not None and now - self._checked_at < _check_interval():
+            return
+        current = self.version.current()
+        if current != self._loaded_version:
+            self._values = {}
+            self._loaded_version = current
+        self._checked_at = now
+
+    def get(self, key, load=None):
+        """load (اختياري): دالة بديلة عن loader(key) لبناء القيمة من بيانات متوفرة مسبقاً."""
+        with self._lock:
+            self._sync()
+            if key in self._values:
+                return self._values[key]
+            loaded_version = self._loaded_version
+        value = load() if load is not None else self.loader(key)
+        with self._lock:
+            # لا نخزّن قيمة حُمّلت قبل إبطال حدث أثناء التحميل
+            if self._loaded_version == loaded_version:
+                self._values[key] = value
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is not None and self._loaded_version != self.version.current():
+                # النسخة المحلية قديمة (غيّرت عملية أخرى البيانات)، فلا نكتفي بإسقاط المفتاح المعني
+                key = None
+            self._loaded_version = self.version.bump()
+            self._checked_at = time.monotonic()
+            if key is None:
+                self._values = {}
+            else:
+                self._values.pop(key, None)
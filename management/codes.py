@@ -0,0 +1,87 @@
+# management/codes.py
+"""
+توزيع أكواد العروض والموردين (OFF-xxxxx / SUP-xxxx) من عدّاد في قاعدة البيانات.
+
+كل عملية تحجز كتلة أرقام (block) من جدول CodeSequence بتحديث ذري واحد، ثم توزعها من الذاكرة،
+فلا نحتاج لحفظ الصف مرتين (مرة للحصول على pk ومرة للكود)، ويمكن إنشاء العروض بـ bulk_create.
+العمليات المتزامنة تحجز كتلاً مختلفة، فالأكواد فريدة دائماً (لكن قد توجد فجوات في الترقيم).
+
+الحجز يتم على اتصال مستقل بقاعدة البيانات ويُثبَّت فوراً، حتى لا يبقى صف العدّاد مقفلاً
+طوال معاملة الحفظ (إلا في SQLite، حيث لا يوجد إلا كاتب واحد في كل الأحوال).
+"""
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, router, transaction
+
+
+class CodeAllocator:
+    def __init__(self, name, template, block_size=None):
+        self.name = name
+        self.template = template
+        self.block_size = block_size
+        self._next = self._limit = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        return self.allocate(1)[0]
+
+    def allocate(self, count):
+        """قائمة بـ count كوداً جديداً."""
+        numbers = []
+        with self._lock:
+            while len(numbers) < count:
+                if self._next >= self._limit:
+                    self._next, self._limit = self._reserve(count - len(numbers))
+                take = min(count - len(numbers), self._limit - self._next)
+                numbers.extend(range(self._next, self._next + take))
+                self._next += take
+        return [self.template.format(number) for number in numbers]
+
+    def _reserve(self, needed):
+        """يحجز كتلة لا تقل عن needed رقماً من العدّاد ويُرجع (البداية، النهاية)."""
+        model = apps.get_model('management', 'CodeSequence')
+        alias = router.db_for_write(model)
+        shared = connections[alias]
+        size = max(self.block_size or getattr(settings, 'CODE_BLOCK_SIZE', 100), needed)
+        if not shared.in_atomic_block:
+            with transaction.atomic(using=alias):
+                return self._reserve_on(shared, model, size)
+        if shared.vendor == 'sqlite':
+            # الحجز جزء من معاملة الحفظ وقد يُتراجع عنه معها، لذلك لا نحتفظ بأرقام زائدة في الذاكرة
+            return self._reserve_on(shared, model, needed)
+
+        connection = connections.create_connection(alias)
+        try:
+            connection.set_autocommit(False)
+            try:
+                reserved = self._reserve_on(connection, model, size)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            return reserved
+        finally:
+            connection.close()
+
+    def _reserve_on(self, connection, model, size):
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        name_column = quote(model._meta.get_field('name').column)
+        value_column = quote(model._meta.get_field('next_value').column)
+        with connection.cursor() as cursor:
+            # التحديث يقفل صف العدّاد حتى نهاية المعاملة، فلا تحجز عمليتان نفس الكتلة
+            cursor.execute(
+                f"UPDATE {table} SET {value_column} = {value_column} + %s WHERE {name_column} = %s",
+                [size, self.name],
+            )
+            if cursor.rowcount == 0:
+                cursor.execute(f"INSERT INTO {table} ({name_column}, {value_column}) VALUES (%s, %s)", [self.name, 1 + size])
+            cursor.execute(f"SELECT {value_column} FROM {table} WHERE {name_column} = %s", [self.name])
+            end = cursor.fetchone()[0]
+        return end - size, end
+
+
+offer_codes = CodeAllocator('offer', 'OFF-{:05d}')
+supplier_codes = CodeAllocator('supplier', 'SUP-{:04d}', block_size=1)
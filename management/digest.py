@@ -0,0 +1,85 @@
+# management/digest.py
+"""
+رسائل التجميع (Digest).
+
+المشترك الذي ضبط digest_window_minutes لا تصله رسالة مع كل دفعة عروض؛ بل تُحفظ عروضه
+في PendingDigestOffer (أثناء DistributionEngine.distribute)، وبعد انقضاء المدة من أقدم عرض
+مؤجل تُرسل كل عروضه من كل الموردين في رسالة واحدة (أو أكثر فقط إذا تجاوزت حد طول واتساب).
+
+flush_due_digests يستدعيها عامل صندوق الرسائل (manage.py send_outbox) دورياً.
+"""
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from . import outbox
+from .engine import NotificationEngine, OfferFragment
+from .models import PendingDigestOffer, Subscriber
+from .price_store import get_price_matrix
+
+
+def due_subscriber_ids(now=None):
+    """المشتركون الذين انقضت مدة التجميع لأقدم عرض مؤجل لديهم."""
+    now = now or timezone.now()
+    rows = (
+        PendingDigestOffer.objects.values('subscriber_id', 'subscriber__digest_window_minutes')
+        .annotate(oldest=Min('created_at'))
+    )
+    return [
+        row['subscriber_id'] for row in rows
+        if row['oldest'] + timedelta(minutes=row['subscriber__digest_window_minutes']) <= now
+    ]
+
+
+def flush_due_digests(now=None, on_result=None):
+    """
+    يبني رسائل التجميع المستحقة ويضعها في صندوق الرسائل الصادرة ثم يرسلها.
+    الصفوف المؤجلة تُحجز بـ select_for_update(skip_locked=True) وتُحذف في نفس المعاملة
+    التي تُنشئ الرسائل، فلا يرسل عاملان نفس التجميع مرتين.
+    تُرجع عدد الرسائل.
+    """
+    subscriber_ids = due_subscriber_ids(now)
+    if not subscriber_ids:
+        return 0
+
+    with transaction.atomic():
+        pending_ids = list(
+            PendingDigestOffer.objects.filter(subscriber_id__in=subscriber_ids)
+            .select_for_update(skip_locked=True).values_list('pk', flat=True)
+        )
+        pending = list(
+            PendingDigestOffer.objects.filter(pk__in=pending_ids)
+            .select_related('offer__supplier', 'offer__brand')
+            .order_by('offer__supplier_id', 'offer_id')
+        )
+        if not pending:
+            return 0
+        # المشتركون غير النشطين تُحذف عروضهم المؤجلة بدون إرسال
+        subscribers = list(
+            Subscriber.objects.filter(pk__in={row.subscriber_id for row in pending}, is_active=True)
+            .prefetch_related('device_fees').order_by('pk')
+        )
+        offers_by_subscriber = {}
+        offers = {}
+        for row in pending:
+            offers_by_subscriber.setdefault(row.subscriber_id, []).append(row.offer)
+            offers[row.offer_id] = row.offer
+        offers = list(offers.values())
+        columns = {offer.pk: j for j, offer in enumerate(offers)}
+        fragments = {offer.pk: OfferFragment.render(offer) for offer in offers}
+
+        messages = []
+        for subscriber, price_row in zip(subscribers, get_price_matrix(offers, subscribers)):
+            subscriber_offers = offers_by_subscriber[subscriber.pk]
+            prices = {offer.pk: price_row[columns[offer.pk]] for offer in subscriber_offers}
+            for body in NotificationEngine.build_digest_messages(subscriber, subscriber_offers, prices, fragments):
+                messages.append((subscriber, body))
+
+        outbox_ids = outbox.enqueue(messages, f"digest:{uuid.uuid4().hex}")
+        PendingDigestOffer.objects.filter(pk__in=pending_ids).delete()
+
+    outbox.drain(ids=outbox_ids, on_result=on_result)
+    return len(messages)
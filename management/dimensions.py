@@ -0,0 +1,62 @@
+# management/dimensions.py
+"""
+تحويل أسماء الماركات والفئات إلى IDs دفعة واحدة أثناء حفظ العروض.
+
+كل الأسماء المعروفة محفوظة في كاش العملية (الاسم -> id، مع بحث بدون تمييز حالة الأحرف
+كما في MySQL)، والأسماء الجديدة فقط تُنشأ بـ bulk_create(ignore_conflicts=True) واحد
+ثم تُقرأ IDs الخاصة بها، فلا يوجد أي get_or_create لكل مجموعة.
+"""
+from django.db import transaction
+
+from .caching import ProcessCache
+from .models import Brand, Category
+
+
+class DimensionIndex:
+    def __init__(self, rows=()):
+        self.by_name = {}
+        self.by_lower = {}
+        self.add(rows)
+
+    @classmethod
+    def loader(cls, model):
+        return lambda: cls(model.objects.values_list('name', 'pk'))
+
+    def add(self, rows):
+        for name, pk in rows:
+            self.by_name[name] = pk
+            self.by_lower.setdefault(name.lower(), pk)
+
+    def lookup(self, name):
+        pk = self.by_name.get(name)
+        return pk if pk is not None else self.by_lower.get(name.lower())
+
+
+brand_index = ProcessCache('brand_index', DimensionIndex.loader(Brand))
+category_index = ProcessCache('category_index', DimensionIndex.loader(Category))
+
+
+def _resolve(model, cache, names):
+    """{الاسم: id} لكل الأسماء، مع إنشاء الناقص منها دفعة واحدة."""
+    index = cache.get()
+    resolved = {name: index.lookup(name) for name in set(names)}
+    missing = sorted(name for name, pk in resolved.items() if pk is None)
+    if not missing:
+        return resolved
+
+    model.objects.bulk_create([model(name=name) for name in missing], ignore_conflicts=True)
+    created = DimensionIndex(model.objects.filter(name__in=missing).values_list('name', 'pk'))
+    for name in missing:
+        resolved[name] = created.lookup(name)
+    # الكاش يُحدَّث فقط بعد تثبيت المعاملة، حتى لا يحتفظ بـ IDs لصفوف تم التراجع عنها
+    rows = list(created.by_name.items())
+    transaction.on_commit(lambda: cache.update(lambda value: value.add(rows)))
+    return resolved
+
+
+def resolve_brands(names):
+    return _resolve(Brand, brand_index, names)
+
+
+def resolve_categories(names):
+    return _resolve(Category, category_index, names)
@@ -1,8 +1,18 @@
-import requests
-import json
+import functools
+import logging
+import random
+import uuid
 from django.conf import settings
-from decimal import Decimal, InvalidOperation
-from .models import CurrencyRate, Subscriber, SubscriberDeviceFee, Preference, Offer
+from django.db.models import prefetch_related_objects
+from decimal import Decimal
+from .models import Subscriber, PendingDigestOffer
+from .fees import get_device_fee_matcher
+from .rates import currency_rates
+from .routing import get_compiled_preference, routing_index
+from .ultramsg import get_client as get_ultramsg_client
+from . import outbox
+
+pricing_logger = logging.getLogger('management.pricing')
 
 REGION_FLAGS = {
     "USA": "🇺🇸", "JAPAN": "🇯🇵", "VIETNAM": "🇻🇳",
@@ -11,6 +21,10 @@ REGION_FLAGS = {
     "GLOBAL": "🌍", "INTERNATIONAL": "🌍",
 }
 
+_REGION_FLAGS_LOWER = tuple((country.lower(), flag) for country, flag in REGION_FLAGS.items())
+
+
+@functools.lru_cache(maxsize=1024)
 def get_country_flag(region_string):
     """
     يبحث عن علم مطابق في نص المواصفة.
@@ -18,83 +32,230 @@ def get_country_flag(region_string):
     if not region_string:
         return ""
     # البحث عن أول كلمة مفتاحية مطابقة في نص المواصفة
-    for country, flag in REGION_FLAGS.items():
-        if country.lower() in region_string.lower():
+    region_lower = region_string.lower()
+    for country, flag in _REGION_FLAGS_LOWER:
+        if country in region_lower:
             return flag + " "  # نضيف مسافة بعد العلم
     return ""  # إرجاع سلسلة فارغة إذا لم يتم العثور على تطابق
 
 
+class OfferFragment:
+    """
+    الجزء الثابت من كتلة العرض داخل الرسالة (كل شيء عدا سطر السعر)، للقراءة فقط.
+    يُبنى مرة واحدة لكل عرض في التوزيع، ثم تُركَّب منه رسالة كل مشترك مع سعره.
+    """
+    __slots__ = ('head', 'tail')
+
+    def __init__(self, head, tail):
+        self.head = head
+        self.tail = tail
+
+    @classmethod
+    def render(cls, offer):
+        flag = get_country_flag(offer.spec_region)
+        head = [
+            f"📱 {offer.brand.name if offer.brand else 'عام'} - {offer.name}",
+            f"💾 {offer.storage}" if offer.storage else "",
+            f"🎨 {offer.color}" if offer.color else "",
+            f"{flag} الدولة: {offer.spec_region}",
+        ]
+        tail = [
+            f"🛒 الكمية: {offer.quantity}" if offer.quantity else "",
+            f"🆔 كود العرض: {offer.code}",
+            "-" * 30
+        ]
+        return cls("\n".join(line for line in head if line), "\n".join(line for line in tail if line))
+
+    def with_price(self, price_str):
+        return f"{self.head}\n💰 السعر: {price_str}\n{self.tail}"
+
+
+class PriceBreakdown:
+    """
+    نتيجة تسعير عرض واحد لمشترك واحد (للقراءة فقط).
+    المبالغ (base/shipping/fee) محوّلة إلى العملة المستهدفة، والمعاملات (*_rate) هي معاملات التحويل المستخدمة.
+    """
+    __slots__ = (
+        'currency', 'base', 'shipping', 'fee', 'price_rate', 'shipping_rate', 'fee_rate',
+        'fee_id', 'subtotal', 'final', 'no_charge', 'error',
+    )
+
+    def __init__(self, currency=None, base=None, shipping=None, fee=None, price_rate=None, shipping_rate=None,
+                 fee_rate=None, fee_id=None, subtotal=None, no_charge=False, error=None):
+        self.currency = currency
+        self.base = base
+        self.shipping = shipping
+        self.fee = fee
+        self.price_rate = price_rate
+        self.shipping_rate = shipping_rate
+        self.fee_rate = fee_rate
+        self.fee_id = fee_id
+        # المجموع قبل التقريب، والسعر النهائي مقرّباً لمنزلتين
+        self.subtotal = subtotal
+        self.final = round(subtotal, 2) if subtotal is not None else (0 if no_charge else None)
+        self.no_charge = no_charge
+        self.error = error
+
+    def with_fee(self, fee, fee_rate, converted_fee):
+        """نسخة جديدة مع إضافة رسم الجهاز."""
+        return PriceBreakdown(
+            self.currency, self.base, self.shipping, converted_fee, self.price_rate, self.shipping_rate,
+            fee_rate, fee.pk, self.subtotal + converted_fee,
+        )
+
+    def as_dict(self):
+        """الصيغة القديمة (dict) التي كانت تُرجعها calculate_final_price."""
+        if self.error:
+            return {"error": self.error}
+        if self.no_charge:
+            return {"price": 0, "currency": self.currency, "no_charge": True}
+        return {"price": self.final, "currency": self.currency}
+
+    def __repr__(self):
+        if self.error:
+            return f"<PriceBreakdown error={self.error!r}>"
+        if self.no_charge:
+            return f"<PriceBreakdown no_charge {self.currency}>"
+        return (
+            f"<PriceBreakdown base={self.base:.2f} (x{self.price_rate}) shipping={self.shipping or 0:.2f} "
+            f"(x{self.shipping_rate}) fee={self.fee or 0:.2f} (#{self.fee_id}, x{self.fee_rate}) "
+            f"final={self.final} {self.currency}>"
+        )
+
+
 class PricingEngine:
     """محرك احترافي مسؤول عن كل حسابات التسعير وتحويل العملات."""
     @staticmethod
     def get_conversion_rate(from_currency, to_currency):
         if not from_currency or not to_currency or from_currency.upper() == to_currency.upper():
             return Decimal('1.0')
-        try:
-            rate = CurrencyRate.objects.get(from_currency__iexact=from_currency, to_currency__iexact=to_currency).rate
-            return Decimal(rate)
-        except CurrencyRate.DoesNotExist:
-            try:
-                inverse_rate = CurrencyRate.objects.get(from_currency__iexact=to_currency, to_currency__iexact=from_currency).rate
-                return Decimal(1) / Decimal(inverse_rate)
-            except (CurrencyRate.DoesNotExist, ZeroDivisionError):
-                return None
+        # البحث في جدول الأسعار المحمّل في الذاكرة بدلاً من استعلام لكل تحويل
+        return currency_rates.get().get_rate(from_currency, to_currency)
 
     @staticmethod
-    def calculate_final_price(offer, subscriber):
+    def should_trace():
+        """
+        هل نسجّل تفاصيل الحساب لهذا الطلب؟ (PRICING_TRACE أو عيّنة عشوائية بنسبة PRICING_TRACE_SAMPLE_RATE)
+        السجل يمر عبر logging (management.pricing) ويمكن إيقافه من إعدادات LOGGING.
+        """
+        if not pricing_logger.isEnabledFor(logging.DEBUG):
+            return False
+        if getattr(settings, 'PRICING_TRACE', False):
+            return True
+        return random.random() < getattr(settings, 'PRICING_TRACE_SAMPLE_RATE', 0.0)
+
+    @staticmethod
+    def calculate_final_price(offer, subscriber, trace=None):
         """
         محرك التسعير الاحترافي: إذا كان السعر الأساسي صفراً، يتوقف عن الحساب.
+        يُرجع PriceBreakdown.
         """
-        print(f"\n--- Calculating price for Offer '{offer.name}' (ID: {offer.id}) for Subscriber '{subscriber.name}' ---")
+        if trace is None:
+            trace = PricingEngine.should_trace()
         target_currency = subscriber.target_currency
-        if not target_currency: return {"error": "Subscriber has no target currency."}
-        
+        if not target_currency:
+            breakdown = PriceBreakdown(error="Subscriber has no target currency.")
+        else:
+            breakdown = PricingEngine._price_offer(offer, target_currency)
+            if subscriber.subscriber_type == 'EXTERNAL' and breakdown.subtotal is not None:
+                # البحث عن الكلمة المفتاحية الأطول (الأكثر تحديدًا) التي تطابق اسم العرض
+                best_match_fee = get_device_fee_matcher(subscriber).longest(offer.name)
+                if best_match_fee:
+                    breakdown = PricingEngine._add_fee(breakdown, best_match_fee, target_currency)
+        if trace:
+            pricing_logger.debug("Offer %s (%s) -> subscriber %s (%s): %r", offer.pk, offer.name, subscriber.pk, subscriber.name, breakdown)
+        return breakdown
+
+    @staticmethod
+    def calculate_batch(offers, subscribers, trace=None):
+        """
+        تسعير دفعة كاملة مرة واحدة: يُرجع مصفوفة matrix[i][j] (PriceBreakdown) لسعر العرض offers[j]
+        للمشترك subscribers[i]، بنفس نتائج calculate_final_price تماماً.
+
+        السعر الأساسي + الشحن يُحسبان مرة واحدة لكل عملة مستهدفة (عمود لكل عملة)،
+        ولا يتبقى لكل مشترك إلا إضافة رسم الجهاز الخاص به.
+        """
+        if trace is None:
+            trace = PricingEngine.should_trace()
+        offers = list(offers)
+        subscribers = list(subscribers)
+        prefetch_related_objects(
+            [s for s in subscribers if s.subscriber_type == 'EXTERNAL'], 'device_fees'
+        )
+
+        subtotal_columns = {}
+        matrix = []
+        for subscriber in subscribers:
+            target_currency = subscriber.target_currency
+            if not target_currency:
+                matrix.append([PriceBreakdown(error="Subscriber has no target currency.")] * len(offers))
+                continue
+            if target_currency not in subtotal_columns:
+                subtotal_columns[target_currency] = [PricingEngine._price_offer(offer, target_currency) for offer in offers]
+            row = subtotal_columns[target_currency]
+
+            if subscriber.subscriber_type == 'EXTERNAL':
+                fee_matcher = get_device_fee_matcher(subscriber)
+                fee_rows = {}
+                row = list(row)
+                for j, (breakdown, offer) in enumerate(zip(row, offers)):
+                    if breakdown.subtotal is None:
+                        continue
+                    best_match_fee = fee_matcher.longest(offer.name)
+                    if best_match_fee:
+                        row[j] = PricingEngine._add_fee(breakdown, best_match_fee, target_currency, fee_rows)
+            matrix.append(row)
+
+            if trace:
+                for offer, breakdown in zip(offers, row):
+                    pricing_logger.debug("Offer %s (%s) -> subscriber %s (%s): %r", offer.pk, offer.name, subscriber.pk, subscriber.name, breakdown)
+        return matrix
+
+    @staticmethod
+    def _price_offer(offer, target_currency):
+        """السعر الأساسي المحوّل + الشحن المحوّل لعرض واحد (بدون رسوم المشترك)."""
         base_price = Decimal(offer.price or '0.0')
-        
         if base_price <= 0:
-            print(f"--- Offer '{offer.name}' has no base price. Skipping fee calculations. ---")
-            return {"price": 0, "currency": target_currency, "no_charge": True}
-        
-        final_price = base_price
-        
+            return PriceBreakdown(target_currency, no_charge=True)
+
         # 1. Base Price Conversion
         price_rate = PricingEngine.get_conversion_rate(offer.currency, target_currency)
-        if price_rate is None: return {"error": f"Missing rate: {offer.currency} -> {target_currency}"}
-        final_price *= price_rate
-        print(f"1. Base Price: {offer.price} {offer.currency} -> {final_price:.2f} {target_currency}")
+        if price_rate is None:
+            return PriceBreakdown(error=f"Missing rate: {offer.currency} -> {target_currency}")
+        converted_base = base_price * price_rate
+        subtotal = converted_base
 
         # 2. Add Shipping Cost
+        converted_shipping = shipping_rate = None
         shipping_cost = Decimal(offer.shipping_cost or '0.0')
         if shipping_cost > 0 and offer.shipping_currency and offer.shipping_currency != 'N/A':
             shipping_rate = PricingEngine.get_conversion_rate(offer.shipping_currency, target_currency)
             if shipping_rate:
                 converted_shipping = shipping_cost * shipping_rate
-                final_price += converted_shipping
-                print(f"2. + Shipping: {shipping_cost} {offer.shipping_currency} -> {converted_shipping:.2f} {target_currency}. Subtotal: {final_price:.2f}")
+                subtotal += converted_shipping
+        return PriceBreakdown(
+            target_currency, converted_base, converted_shipping, price_rate=price_rate,
+            shipping_rate=shipping_rate, subtotal=subtotal,
+        )
+
+    @staticmethod
+    def _add_fee(breakdown, fee, target_currency, cache=None):
+        """3. إضافة رسم الجهاز المطابق (cache: نتائج سابقة لنفس المشترك حسب fee.pk)."""
+        if cache is not None and fee.pk in cache:
+            fee_rate, converted_fee = cache[fee.pk]
+        else:
+            fee_rate = converted_fee = None
+            fee_cost = Decimal(fee.fee or '0.0')
+            if fee_cost > 0:
+                fee_rate = PricingEngine.get_conversion_rate(fee.currency, target_currency)
+                if fee_rate:
+                    converted_fee = fee_cost * fee_rate
+            if cache is not None:
+                cache[fee.pk] = (fee_rate, converted_fee)
+        if converted_fee is None:
+            return breakdown
+        return breakdown.with_fee(fee, fee_rate, converted_fee)
 
-        # --- بداية الإصلاح: منطق ذكي للبحث عن الرسوم الإجبارية ---
-        if subscriber.subscriber_type == 'EXTERNAL':
-            all_fees_for_sub = subscriber.device_fees.all()
-            best_match_fee = None
-            
-            # البحث عن الكلمة المفتاحية الأطول (الأكثر تحديدًا) التي تطابق اسم العرض
-            for fee in all_fees_for_sub:
-                if fee.device_keyword.lower() in offer.name.lower():
-                    if best_match_fee is None or len(fee.device_keyword) > len(best_match_fee.device_keyword):
-                        best_match_fee = fee
-            
-            if best_match_fee:
-                fee_cost = Decimal(best_match_fee.fee or '0.0')
-                if fee_cost > 0:
-                    fee_rate = PricingEngine.get_conversion_rate(best_match_fee.currency, target_currency)
-                    if fee_rate:
-                        converted_fee = fee_cost * fee_rate
-                        final_price += converted_fee
-                        print(f"3. + Device Fee '{best_match_fee.device_keyword}': {fee_cost} {best_match_fee.currency} -> {converted_fee:.2f} {target_currency}. Subtotal: {final_price:.2f}")
-        # --- نهاية الإصلاح ---
-        
-        print(f"--- Final Price for '{subscriber.name}': {final_price:.2f} {target_currency} ---")
-        return {"price": round(final_price, 2), "currency": target_currency}
 
 class NotificationEngine:
     """
@@ -103,57 +264,22 @@ class NotificationEngine:
     
     @staticmethod
     def send_whatsapp_message(recipient_number, message_body):
-        """Sends message via WhatsApp API"""
-        if not hasattr(settings, 'ULTRAMSG_INSTANCE_ID') or not hasattr(settings, 'ULTRAMSG_TOKEN'):
-            print("ERROR: WhatsApp credentials not configured")
-            return False, "WhatsApp credentials not configured"
-        
-        # Clean and validate phone number
-        formatted_number = ''.join(c for c in recipient_number if c.isdigit())
-        if not formatted_number:
-            return False, "Invalid phone number"
-        
-        # Add country code if missing (default +966 for KSA)
-        if not formatted_number.startswith('966') and len(formatted_number) < 10:
-            formatted_number = '966' + formatted_number.lstrip('0')
-        
-        url = f"https://api.ultramsg.com/{settings.ULTRAMSG_INSTANCE_ID}/messages/chat"
-        payload = {
-            "token": settings.ULTRAMSG_TOKEN,
-            "to": formatted_number,
-            "body": message_body
-        }
-        headers = {'content-type': 'application/x-www-form-urlencoded'}
-        
-        try:
-            response = requests.post(url, data=payload, headers=headers, timeout=20)
-            response.raise_for_status()
-            response_data = response.json()
-            
-            if response_data.get('sent') == 'true':
-                print(f"SUCCESS: Message sent to {formatted_number}")
-                return True, response_data
-            
-            error_msg = response_data.get('error', 'Unknown error')
-            print(f"ERROR: Failed to send to {formatted_number} - {error_msg}")
-            return False, error_msg
-        
-        except requests.exceptions.RequestException as e:
-            error_msg = f"HTTP error: {str(e)}"
-            print(f"EXCEPTION: Failed to send to {formatted_number} - {error_msg}")
-            return False, error_msg
-        except json.JSONDecodeError:
-            error_msg = "Invalid response from WhatsApp API"
-            print(f"EXCEPTION: Failed to parse response for {formatted_number}")
-            return False, error_msg
-        except Exception as e:
-            error_msg = f"Unexpected error: {str(e)}"
-            print(f"EXCEPTION: Failed to send to {formatted_number} - {error_msg}")
-            return False, error_msg
+        """Sends message via WhatsApp API (through the shared pooled UltraMsg client)"""
+        result = get_ultramsg_client().send(recipient_number, message_body)
+        return result.success, result.detail
 
     @staticmethod
-    def build_offer_message(subscriber, offers, supplier):
-        """Builds personalized offer message"""
+    def send_many(messages, on_result=None):
+        """Sends (recipient_number, message_body) pairs concurrently; returns a list of SendResult"""
+        return get_ultramsg_client().send_many(messages, on_result=on_result)
+
+    @staticmethod
+    def build_offer_message(subscriber, offers, supplier, prices=None, fragments=None):
+        """
+        Builds personalized offer message.
+        `prices` (optional) maps offer.pk -> PriceBreakdown already computed by PricingEngine.calculate_batch.
+        `fragments` (optional) maps offer.pk -> OfferFragment rendered once per distribution.
+        """
         message_lines = [
             f"عزيزي {subscriber.name}،",
             f"لدينا عروض جديدة من {supplier.code} تناسب اهتماماتك:",
@@ -161,31 +287,59 @@ class NotificationEngine:
         ]
         
         for offer in offers:
-            price_data = PricingEngine.calculate_final_price(offer, subscriber)
-            price_str = f"{price_data['price']} {price_data['currency']}" if 'price' in price_data else "السعر غير متوفر"
-            flag = get_country_flag(offer.spec_region)
-
-            # التحقق من وجود سعر قبل عرضه
-            if price_data.get("no_charge"):
-                price_str = "عند الطلب"
+            if prices is not None:
+                price_data = prices[offer.pk]
             else:
-                price_str = f"*{price_data['price']} {price_data['currency']}*"
-
-            offer_details = [
-                f"📱 {offer.brand.name if offer.brand else 'عام'} - {offer.name}",
-                f"💾 {offer.storage}" if offer.storage else "",
-                f"🎨 {offer.color}" if offer.color else "",
-                f"{flag} الدولة: {offer.spec_region}",
-                f"💰 السعر: {price_str}",
-                f"🛒 الكمية: {offer.quantity}" if offer.quantity else "",
-                f"🆔 كود العرض: {offer.code}",
-                "-" * 30
-            ]
-            message_lines.extend([line for line in offer_details if line])
+                price_data = PricingEngine.calculate_final_price(offer, subscriber)
+            fragment = fragments[offer.pk] if fragments is not None else OfferFragment.render(offer)
+            message_lines.append(fragment.with_price(NotificationEngine.format_price(price_data)))
         
         message_lines.append("للاستفسار أو الطلب، راسلنا على هذا الرقم")
         return "\n".join(message_lines)
 
+    @staticmethod
+    def build_digest_messages(subscriber, offers, prices, fragments=None, max_length=None):
+        """
+        رسالة تجميع لعروض من عدة موردين (مرتبة حسب المورد كما هي في offers).
+        تُقسَّم إلى أكثر من رسالة فقط إذا تجاوزت حد طول رسالة واتساب، وبين كتل العروض فقط.
+        تُرجع قائمة نصوص الرسائل.
+        """
+        max_length = max_length or getattr(settings, 'WHATSAPP_MAX_MESSAGE_LENGTH', 4096)
+        footer = "للاستفسار أو الطلب، راسلنا على هذا الرقم"
+        messages = []
+        lines = [f"عزيزي {subscriber.name}،", "لدينا عروض جديدة تناسب اهتماماتك:"]
+        length = sum(len(line) + 1 for line in lines)
+        current_supplier = None
+        has_offers = False
+
+        for offer in offers:
+            fragment = fragments[offer.pk] if fragments is not None else OfferFragment.render(offer)
+            block = fragment.with_price(NotificationEngine.format_price(prices[offer.pk]))
+            section = f"{'=' * 40}\nمن {offer.supplier.code}:\n"
+            piece = block if offer.supplier_id == current_supplier else section + block
+            if has_offers and length + len(piece) + 1 + len(footer) > max_length:
+                # رسالة جديدة تبدأ دائماً بعنوان المورد الحالي
+                messages.append("\n".join(lines))
+                lines, length = [], 0
+                piece = section + block
+            lines.append(piece)
+            length += len(piece) + 1
+            current_supplier = offer.supplier_id
+            has_offers = True
+
+        lines.append(footer)
+        messages.append("\n".join(lines))
+        return messages
+
+    @staticmethod
+    def format_price(price_data):
+        # التحقق من وجود سعر قبل عرضه
+        if price_data.error:
+            return "السعر غير متوفر"
+        if price_data.no_charge:
+            return "عند الطلب"
+        return f"*{price_data.final} {price_data.currency}*"
+
 
 class DistributionEngine:
     """
@@ -196,77 +350,83 @@ class DistributionEngine:
     def _filter_offers_for_subscriber(offers, subscriber):
         """
         دالة مساعدة خاصة تقوم بتصفية العروض بناءً على تفضيلات مشترك معين.
+        التفضيلات مترجمة مسبقاً إلى مجموعات IDs، فلا يتم أي استعلام لكل عرض.
         """
-        try:
-            preferences = subscriber.preferences
-        except Preference.DoesNotExist:
-            # إذا لم يكن للمشترك ملف تفضيلات، فإنه يرى كل شيء (لا يتم تطبيق أي فلتر)
-            print(f"WARNING: No preference profile for {subscriber.name}. Sending all offers.")
-            return offers
-        
-        # جلب قوائم التفضيلات مرة واحدة لتحسين الأداء
-        allowed_suppliers = preferences.allowed_suppliers.all()
-        interested_brands = preferences.interested_brands.all()
-        interested_categories = preferences.interested_categories.all()
-        
-        # إذا كانت كل قوائم التفضيلات فارغة، فالمشترك مهتم بكل شيء
-        if not allowed_suppliers.exists() and not interested_brands.exists() and not interested_categories.exists():
-            return offers
-
-        filtered_offers = []
-        for offer in offers:
-            # التحقق من المورد المسموح به
-            if allowed_suppliers.exists() and offer.supplier not in allowed_suppliers:
-                continue
-                
-            # التحقق من الماركة المهتم بها
-            if interested_brands.exists() and offer.brand not in interested_brands:
-                continue
-                
-            # التحقق من الفئة المهتم بها
-            if interested_categories.exists() and offer.category not in interested_categories:
-                continue
-                
-            # إذا مر العرض من كل الفلاتر، قم بإضافته
-            filtered_offers.append(offer)
-        
-        return filtered_offers
+        return get_compiled_preference(subscriber).filter(offers)
 
     @staticmethod
-    def distribute(saved_offers, supplier_obj, single_subscriber=None):
+    def distribute(saved_offers, supplier_obj, single_subscriber=None, progress=None, batch_key=None):
         """
         الدالة الرئيسية للتوزيع: ترسل العروض للكل، أو لمشترك واحد محدد.
+        الرسائل تُكتب أولاً في صندوق الرسائل الصادرة ثم تُرسل منه، والفاشل منها يعيد العامل
+        (manage.py send_outbox) محاولته لاحقاً. batch_key يمنع تكرار الرسائل إذا أُعيد تشغيل نفس الدفعة.
+        المشتركون الذين فعّلوا التجميع (digest_window_minutes) تُؤجَّل عروضهم إلى رسالة التجميع (digest.py).
+        progress (اختياري): دالة تُستدعى (عدد المعالَجين، الإجمالي، المرسَل بنجاح، الفاشل) أثناء الإرسال.
+        تُرجع (المرسَل بنجاح، الفاشل في المحاولة الأولى).
         """
         if single_subscriber:
             # إذا تم تحديد مشترك واحد، ضعه في قائمة للمعالجة
             subscribers_to_process = [single_subscriber]
+            routed_offers = {single_subscriber.pk: DistributionEngine._filter_offers_for_subscriber(saved_offers, single_subscriber)}
         else:
-            # وإلا، احصل على كل المشتركين النشطين
+            # وإلا، نحدد مستلمي كل عرض من الفهرس العكسي (مورد/ماركة/فئة -> مشتركون)
+            routed_offers = routing_index.get().route(saved_offers)
             subscribers_to_process = Subscriber.objects.filter(
-                is_active=True
-            ).prefetch_related(
-                'preferences__allowed_suppliers',
-                'preferences__interested_brands', 
-                'preferences__interested_categories'
-            )
+                pk__in=list(routed_offers), is_active=True
+            ).prefetch_related('device_fees').order_by('pk')
+        subscribers_to_process = list(subscribers_to_process)
+
+        # تسعير كل العروض لكل المشتركين دفعة واحدة، مع حفظها في جدول الأسعار المحسوبة
+        from .price_store import refresh_offer_prices
+        price_matrix = refresh_offer_prices(saved_offers, subscribers_to_process)
         
-        for subscriber in subscribers_to_process:
-            # فلترة العروض لهذا المشترك المحدد
-            filtered_offers = DistributionEngine._filter_offers_for_subscriber(saved_offers, subscriber)
+        # الجزء الثابت من كل عرض يُبنى مرة واحدة لكل المشتركين
+        prefetch_related_objects([offer for offer in saved_offers if offer.brand_id], 'brand')
+        fragments = {offer.pk: OfferFragment.render(offer) for offer in saved_offers}
+        columns = {offer.pk: j for j, offer in enumerate(saved_offers)}
+
+        # بناء كل الرسائل أولاً وحفظها في صندوق الرسائل الصادرة، ثم إرسالها بالتوازي
+        outgoing = []
+        deferred = []
+        for subscriber, price_row in zip(subscribers_to_process, price_matrix):
+            # العروض التي تناسب تفضيلات هذا المشترك
+            filtered_offers = routed_offers.get(subscriber.pk)
             
-            # إذا كانت هناك عروض متبقية بعد الفلترة، قم ببناء وإرسال الرسالة
-            if filtered_offers:
-                # Build the message
-                message = NotificationEngine.build_offer_message(subscriber, filtered_offers, supplier_obj)
-                # Send the message
-                NotificationEngine.send_whatsapp_message(subscriber.whatsapp_number, message)
+            # المشترك الذي فعّل التجميع تُؤجَّل عروضه لرسالة واحدة لاحقاً (إلا عند الإرسال له مباشرة)
+            if filtered_offers and subscriber.digest_window_minutes and not single_subscriber:
+                deferred.extend(
+                    PendingDigestOffer(subscriber_id=subscriber.pk, offer_id=offer.pk) for offer in filtered_offers
+                )
+            # إذا كانت هناك عروض متبقية بعد الفلترة، قم ببناء الرسالة
+            elif filtered_offers:
+                prices = {offer.pk: price_row[columns[offer.pk]] for offer in filtered_offers}
+                message = NotificationEngine.build_offer_message(
+                    subscriber, filtered_offers, supplier_obj, prices=prices, fragments=fragments
+                )
+                outgoing.append((subscriber, message))
+
+        PendingDigestOffer.objects.bulk_create(deferred, batch_size=1000, ignore_conflicts=True)
+        outbox_ids = outbox.enqueue(outgoing, batch_key or uuid.uuid4().hex)
+
+        counts = {'processed': 0, 'sent': 0, 'failed': 0}
+        total = len(outgoing)
+
+        def on_result(result):
+            counts['processed'] += 1
+            counts['sent' if result.success else 'failed'] += 1
+            if progress:
+                progress(counts['processed'], total, counts['sent'], counts['failed'])
+
+        outbox.drain(ids=outbox_ids, on_result=on_result)
+        sent, failed = counts['sent'], counts['failed']
+        return sent, failed
 
 # Legacy functions for backward compatibility
 def get_conversion_rate(from_currency, to_currency):
     return PricingEngine.get_conversion_rate(from_currency, to_currency)
 
 def calculate_final_price(offer, subscriber):
-    return PricingEngine.calculate_final_price(offer, subscriber)
+    return PricingEngine.calculate_final_price(offer, subscriber).as_dict()
 
 def send_whatsapp_message(recipient_number, message_body):
     return NotificationEngine.send_whatsapp_message(recipient_number, message_body)
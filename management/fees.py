@@ -0,0 +1,50 @@
+# management/fees.py
+"""
+رسوم الأجهزة الإجبارية للمشتركين الخارجيين.
+"""
+from .caching import KeyedProcessCache
+from .matching import KeywordMatcher
+from .models import Subscriber, SubscriberDeviceFee
+
+
+def _build_device_fee_matcher(fees):
+    return KeywordMatcher((fee.device_keyword, fee) for fee in fees)
+
+
+device_fee_matchers = KeyedProcessCache(
+    'device_fee_matchers',
+    lambda subscriber_id: _build_device_fee_matcher(SubscriberDeviceFee.objects.filter(subscriber_id=subscriber_id)),
+)
+
+
+def get_device_fee_matcher(subscriber):
+    """آلة مطابقة رسوم المشترك، مبنية مرة واحدة ومحفوظة حتى تتغير رسومه."""
+    return device_fee_matchers.get(subscriber.pk, lambda: _build_device_fee_matcher(subscriber.device_fees.all()))
+
+
+def find_missing_fees(device_names):
+    """
+    الرسوم الإجبارية الناقصة: لكل مشترك خارجي نشط، أسماء الأجهزة التي ليس لها رسم مسجل لديه.
+    استعلامان فقط مهما كان عدد المشتركين (المشتركون، ثم كل أزواج (مشترك، جهاز) الموجودة).
+    تُرجع قائمة [{subscriber_id, subscriber_name, missing_devices}].
+    """
+    device_names = set(device_names)
+    if not device_names:
+        return []
+    external_subscribers = Subscriber.objects.filter(is_active=True, subscriber_type=Subscriber.SubscriberType.EXTERNAL)
+    covered = {}
+    for subscriber_id, device_keyword in SubscriberDeviceFee.objects.filter(
+        subscriber__in=external_subscribers, device_keyword__in=device_names
+    ).values_list('subscriber_id', 'device_keyword'):
+        covered.setdefault(subscriber_id, set()).add(device_keyword)
+
+    missing_fees_data = []
+    for subscriber_id, subscriber_name in external_subscribers.order_by('pk').values_list('pk', 'name'):
+        missing_for_this_sub = sorted(device_names - covered.get(subscriber_id, set()))
+        if missing_for_this_sub:
+            missing_fees_data.append({
+                "subscriber_id": subscriber_id,
+                "subscriber_name": subscriber_name,
+                "missing_devices": missing_for_this_sub
+            })
+    return missing_fees_data
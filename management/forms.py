@@ -1,7 +1,8 @@
 # management/forms.py
 
 from django import forms
-from .models import Preference, Supplier, Subscriber, ShippingRate, CurrencyRate
+from .ingestion import offer_name
+from .models import Brand, Category, Offer, Preference, Supplier, Subscriber, ShippingRate, CurrencyRate
 
 class SupplierForm(forms.ModelForm):
     class Meta:
@@ -19,12 +20,13 @@ class SupplierForm(forms.ModelForm):
 class SubscriberForm(forms.ModelForm):
     class Meta:
         model = Subscriber
-        fields = ['name', 'whatsapp_number', 'subscriber_type', 'target_currency', 'is_active']
+        fields = ['name', 'whatsapp_number', 'subscriber_type', 'target_currency', 'digest_window_minutes', 'is_active']
         widgets = {
             'name': forms.TextInput(attrs={'class': 'mt-1 block w-full p-2 border border-gray-300 rounded-md shadow-sm'}),
             'whatsapp_number': forms.TextInput(attrs={'class': 'mt-1 block w-full p-2 border border-gray-300 rounded-md shadow-sm', 'placeholder': '+201001234567'}),
             'subscriber_type': forms.Select(attrs={'class': 'mt-1 block w-full p-2 border border-gray-300 rounded-md shadow-sm'}),
             'target_currency': forms.TextInput(attrs={'class': 'mt-1 block w-full p-2 border border-gray-300 rounded-md shadow-sm', 'placeholder': 'SAR'}),
+            'digest_window_minutes': forms.NumberInput(attrs={'class': 'mt-1 block w-full p-2 border border-gray-300 rounded-md shadow-sm', 'min': 0}),
             'is_active': forms.CheckboxInput(attrs={'class': 'h-4 w-4 text-indigo-600 border-gray-300 rounded'}),
         }
         labels = {
@@ -32,6 +34,7 @@ class SubscriberForm(forms.ModelForm):
             'whatsapp_number': 'رقم الواتساب (بالصيغة الدولية)',
             'subscriber_type': 'نوع المشترك',
             'target_currency': 'عملة التسعير النهائية',
+            'digest_window_minutes': 'تجميع العروض في رسالة واحدة كل (دقيقة، 0 = فوراً)',
             'is_active': 'نشط؟',
         }
 
@@ -83,3 +86,93 @@ class PreferenceForm(forms.ModelForm):
             'interested_brands': 'الماركات المهتم بها',
             'interested_categories': 'الفئات المهتم بها',
         }
+
+
+# --- التحقق من دفعة العروض المرسلة كـ JSON (offer_batch_api) ---
+
+OFFER_NAME_MAX_LENGTH = Offer._meta.get_field('name').max_length
+
+class OfferBatchForm(forms.Form):
+    supplier_id = forms.ModelChoiceField(queryset=Supplier.objects.all())
+    subscriber_id = forms.ModelChoiceField(queryset=Subscriber.objects.filter(is_active=True), required=False)
+
+
+class OfferGroupForm(forms.Form):
+    grouping_name = forms.CharField(max_length=OFFER_NAME_MAX_LENGTH, required=False)
+    brand_name = forms.CharField(max_length=Brand._meta.get_field('name').max_length, required=False)
+    category_name = forms.CharField(max_length=Category._meta.get_field('name').max_length, required=False)
+
+
+class OfferVariantForm(forms.ModelForm):
+    class Meta:
+        model = Offer
+        fields = ['name', 'color', 'storage', 'spec_region', 'condition', 'quantity',
+                  'price', 'currency', 'shipping_cost', 'shipping_currency']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # كل الحقول اختيارية: القيم الفارغة تأخذ القيم الافتراضية عند الحفظ (انظر ingestion.py)
+        for field in self.fields.values():
+            field.required = False
+
+
+def validate_offer_batch(document):
+    """
+    يتحقق من مستند JSON بالشكل:
+        {"supplier_id": 1, "subscriber_id": 2 (اختياري),
+         "offer_groups": [{"grouping_name", "brand_name", "category_name", "variants": [{...}, ...]}, ...]}
+    تُرجع (البيانات المنظفة، الأخطاء)؛ الأخطاء dict بمسار الحقل مثل "offer_groups.0.variants.2.price".
+    """
+    errors = {}
+    if not isinstance(document, dict):
+        return None, {'__all__': ["Expected a JSON object."]}
+
+    batch_form = OfferBatchForm(document)
+    if not batch_form.is_valid():
+        errors.update({field: list(e) for field, e in batch_form.errors.items()})
+
+    groups = document.get('offer_groups')
+    if not isinstance(groups, list) or not groups:
+        errors['offer_groups'] = ["Expected a non-empty list."]
+        return None, errors
+
+    cleaned_groups = []
+    for g, group in enumerate(groups):
+        if not isinstance(group, dict):
+            errors[f"offer_groups.{g}"] = ["Expected an object."]
+            continue
+        group_form = OfferGroupForm(group)
+        if not group_form.is_valid():
+            errors.update({f"offer_groups.{g}.{field}": list(e) for field, e in group_form.errors.items()})
+        variants = group.get('variants') or []
+        if not isinstance(variants, list):
+            errors[f"offer_groups.{g}.variants"] = ["Expected a list."]
+            continue
+        cleaned_variants = []
+        for v, variant in enumerate(variants):
+            prefix = f"offer_groups.{g}.variants.{v}"
+            if not isinstance(variant, dict):
+                errors[prefix] = ["Expected an object."]
+                continue
+            variant_form = OfferVariantForm(variant)
+            if variant_form.is_valid():
+                cleaned_variants.append(variant_form.cleaned_data)
+                # الاسم المحفوظ هو "المجموعة - المتغير"، فيجب أن يتسع له Offer.name وليس كل جزء وحده
+                full_name = offer_name(group_form.cleaned_data.get('grouping_name', ''), variant_form.cleaned_data['name'])
+                if len(full_name) > OFFER_NAME_MAX_LENGTH:
+                    errors[f"{prefix}.name"] = [
+                        f"Ensure the offer name (grouping_name - name) has at most {OFFER_NAME_MAX_LENGTH} characters "
+                        f"(it has {len(full_name)})."
+                    ]
+            else:
+                errors.update({f"{prefix}.{field}": list(e) for field, e in variant_form.errors.items()})
+        if group_form.is_valid():
+            cleaned_groups.append({**group_form.cleaned_data, 'variants': cleaned_variants})
+
+    if errors:
+        return None, errors
+    return {
+        'supplier': batch_form.cleaned_data['supplier_id'],
+        'subscriber': batch_form.cleaned_data.get('subscriber_id'),
+        'offer_groups': cleaned_groups,
+    }, {}
@@ -0,0 +1,86 @@
+# management/gemini.py
+"""
+عميل Gemini مشترك لكل العملية.
+
+يُضبط المفتاح (genai.configure) ويُنشأ النموذج مرة واحدة فقط، فتبقى قناة gRPC نفسها
+(واتصال TLS المفتوح) مستخدمة في كل الطلبات، بدل إنشاء قناة جديدة مع كل تحليل.
+يمكن تسخين الاتصال عند بدء التشغيل (GEMINI_WARMUP) من AppConfig.ready.
+"""
+import logging
+import threading
+import time
+
+import google.generativeai as genai
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = 'gemini-1.5-flash-latest'
+
+
+class GeminiBackend:
+    def __init__(self, api_key, model_name=DEFAULT_MODEL_NAME):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            getattr(settings, 'GOOGLE_API_KEY', None),
+            model_name=getattr(settings, 'GEMINI_MODEL_NAME', DEFAULT_MODEL_NAME),
+        )
+
+    @property
+    def configured(self):
+        return bool(self.api_key)
+
+    @property
+    def model(self):
+        """النموذج المشترك (يُنشأ عند أول استخدام). genai.configure عام للعملية، لذلك يُستدعى هنا فقط."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, contents, **kwargs):
+        return self.model.generate_content(contents, **kwargs)
+
+    def warm_up(self):
+        """
+        ينشئ النموذج ويفتح الاتصال بطلب count_tokens صغير (مجاني)، حتى لا يدفع أول تحليل
+        تكلفة إنشاء القناة ومصافحة TLS. يُرجع المدة بالثواني، أو None إذا لم يُضبط المفتاح أو فشل الطلب.
+        """
+        if not self.configured:
+            return None
+        started = time.perf_counter()
+        try:
+            self.model.count_tokens("ping")
+        except Exception as e:
+            logger.warning("Gemini warm-up failed: %s", e)
+            return None
+        elapsed = time.perf_counter() - started
+        logger.info("Gemini client warmed up in %.3fs", elapsed)
+        return elapsed
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """عميل مشترك لكل العملية (تُقرأ الإعدادات عند أول استخدام)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = GeminiBackend.from_settings()
+    return _backend
+
+
+def warm_up_in_background():
+    """تسخين بدون تأخير بدء التشغيل."""
+    threading.Thread(target=lambda: get_backend().warm_up(), name='gemini-warmup', daemon=True).start()
@@ -0,0 +1,82 @@
+# management/ingestion.py
+"""
+حفظ مجموعات العروض (offer groups) دفعة واحدة.
+
+تستخدمه كل واجهات الحفظ: تُبنى كل كائنات Offer في الذاكرة ثم تُحفظ بـ bulk_create،
+ويُعطى كل عرض كوده (OFF-xxxxx) مسبقاً من عدّاد الأكواد (codes.py) بدون أي UPDATE.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+
+from .codes import offer_codes
+from .dimensions import resolve_brands, resolve_categories
+from .models import Offer
+
+BATCH_SIZE = 500
+
+
+def _variants_of(group):
+    """المتغيرات إما قائمة، أو dict {الترتيب: متغير} كما يُعاد بناؤها من النموذج."""
+    variants = group.get('variants') or []
+    if isinstance(variants, dict):
+        return [variant for _, variant in sorted(variants.items())]
+    return list(variants)
+
+
+def offer_name(group_name, variant_name):
+    """اسم العرض المحفوظ: اسم المجموعة، ثم اسم المتغير إن وجد."""
+    return f"{group_name} - {variant_name}" if variant_name else group_name
+
+
+def build_offers(supplier, offer_groups):
+    """يبني كائنات Offer (غير محفوظة) لكل متغيرات المجموعات التي لها اسم."""
+    groups = []
+    for group_data in offer_groups:
+        group_name = (group_data.get('grouping_name') or '').strip()
+        if group_name:
+            brand_name = (group_data.get('brand_name') or 'Unknown').strip()
+            category_name = (group_data.get('category_name') or 'Uncategorized').strip()
+            groups.append((group_name, brand_name, category_name, group_data))
+    # كل الماركات والفئات في الدفعة تُحوَّل إلى IDs مرة واحدة
+    brand_ids = resolve_brands(brand for _, brand, _, _ in groups)
+    category_ids = resolve_categories(category for _, _, category, _ in groups)
+
+    offers = []
+    for group_name, brand_name, category_name, group_data in groups:
+        for variant_data in _variants_of(group_data):
+            offers.append(Offer(
+                supplier=supplier, brand_id=brand_ids[brand_name], category_id=category_ids[category_name],
+                name=offer_name(group_name, variant_data.get('name', '')),
+                price=Decimal(variant_data.get('price') or '0.0'),
+                currency=variant_data.get('currency') or 'USD',
+                quantity=int(variant_data.get('quantity') or 0),
+                storage=variant_data.get('storage') or '',
+                condition=variant_data.get('condition') or 'New',
+                spec_region=variant_data.get('spec_region') or '',
+                color=variant_data.get('color') or '',
+                shipping_cost=Decimal(variant_data.get('shipping_cost') or '0.0'),
+                shipping_currency=variant_data.get('shipping_currency') or 'N/A'
+            ))
+    return offers
+
+
+@transaction.atomic
+def ingest_offer_groups(supplier, offer_groups):
+    """
+    يحفظ كل عروض المجموعات ويُرجعها محفوظة (مع pk و code).
+    الأكواد تُحجز مسبقاً من عدّاد الأكواد، فيكفي INSERT واحد لكل دفعة.
+    إذا لم تُرجع قاعدة البيانات المفاتيح من bulk_create (مثل MySQL) نقرؤها باستعلام واحد عبر الكود.
+    """
+    offers = build_offers(supplier, offer_groups)
+    if not offers:
+        return []
+    for offer, code in zip(offers, offer_codes.allocate(len(offers))):
+        offer.code = code
+    Offer.objects.bulk_create(offers, batch_size=BATCH_SIZE)
+    if offers[0].pk is None:
+        pks = dict(Offer.objects.filter(code__in=[offer.code for offer in offers]).values_list('code', 'pk'))
+        for offer in offers:
+            offer.pk = pks[offer.code]
+            offer._state.adding = False
+    return offers
@@ -0,0 +1,114 @@
+# management/jobs.py
+"""
+تشغيل التوزيع في الخلفية بدلاً من حجز طلب HTTP حتى تنتهي كل الرسائل.
+
+المهام تُنفَّذ في مجموعة خيوط (thread pool) داخل العملية، وحالتها تُحفظ في كاش Django
+المشترك حتى تتمكن أي عملية ويب من الرد على طلب متابعة التقدم.
+"""
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from .engine import DistributionEngine
+from .models import Offer, Subscriber, Supplier
+
+logger = logging.getLogger(__name__)
+
+JOB_TTL = 60 * 60 * 24
+PROGRESS_EVERY = 25
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'DISTRIBUTION_WORKERS', 4),
+    thread_name_prefix='distribution',
+)
+
+
+def _job_key(job_id):
+    return f"management:distribution-job:{job_id}"
+
+
+def get_job(job_id):
+    """حالة المهمة كـ dict أو None إذا لم توجد (أو انتهت صلاحيتها)."""
+    return cache.get(_job_key(job_id))
+
+
+def _save_job(job):
+    cache.set(_job_key(job['id']), job, timeout=JOB_TTL)
+
+
+def create_distribution_job(offers, supplier_obj, single_subscriber=None):
+    """
+    يسجّل مهمة توزيع جديدة بحالة queued ويُرجع رقمها.
+    التنفيذ الفعلي يبدأ عند استدعاء start_distribution_job (عادة داخل transaction.on_commit).
+    """
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': 'queued',
+        'offer_ids': [offer.pk for offer in offers],
+        'supplier_id': supplier_obj.pk,
+        'subscriber_id': single_subscriber.pk if single_subscriber else None,
+        'total': None,
+        'processed': 0,
+        'sent': 0,
+        'failed': 0,
+        'error': None,
+        'created_at': timezone.now().isoformat(),
+        'finished_at': None,
+    }
+    _save_job(job)
+    return job['id']
+
+
+def start_distribution_job(job_id):
+    _executor.submit(_run_distribution_job, job_id)
+
+
+def run_in_background(func, *args):
+    """ينفّذ func(*args) في نفس خيوط الخلفية، بدون حجز الطلب الحالي (مثل إعادة حساب الأسعار)."""
+    _executor.submit(_run_background_task, func, args)
+
+
+def _run_background_task(func, args):
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Background task %s failed", getattr(func, '__name__', func))
+    finally:
+        connections.close_all()
+
+
+def _run_distribution_job(job_id):
+    close_old_connections()
+    job = get_job(job_id)
+    if job is None:
+        return
+    job['status'] = 'running'
+    _save_job(job)
+    try:
+        offers_by_id = Offer.objects.select_related('brand').in_bulk(job['offer_ids'])
+        offers = [offers_by_id[pk] for pk in job['offer_ids'] if pk in offers_by_id]
+        supplier_obj = Supplier.objects.get(pk=job['supplier_id'])
+        single_subscriber = Subscriber.objects.get(pk=job['subscriber_id']) if job['subscriber_id'] else None
+
+        def progress(processed, total, sent, failed):
+            job.update(processed=processed, total=total, sent=sent, failed=failed)
+            if processed == total or processed % PROGRESS_EVERY == 0:
+                _save_job(job)
+
+        sent, failed = DistributionEngine.distribute(
+            offers, supplier_obj, single_subscriber=single_subscriber, progress=progress, batch_key=job_id
+        )
+        job.update(status='done', sent=sent, failed=failed)
+    except Exception as e:
+        logger.exception("Distribution job %s failed", job_id)
+        job.update(status='failed', error=str(e))
+    finally:
+        job['finished_at'] = timezone.now().isoformat()
+        _save_job(job)
+        connections.close_all()
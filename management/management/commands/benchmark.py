@@ -0,0 +1,223 @@
+# management/management/commands/benchmark.py
+"""
+قياسات أداء مسار التسعير والتوزيع على بيانات اصطناعية.
+كل البيانات تُنشأ داخل معاملة (transaction) يتم التراجع عنها في النهاية،
+ما عدا render الذي يعمل على كائنات في الذاكرة فقط.
+
+مثال:
+    python manage.py benchmark pricing-queries --offers 200 --subscribers 50
+    python manage.py benchmark render --offers 1000 --subscribers 10000
+    python manage.py benchmark distribution --offers 10 --subscribers 2000 --latency 150
+"""
+import statistics
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from management import ultramsg
+from management.engine import DistributionEngine, NotificationEngine, OfferFragment, PriceBreakdown, PricingEngine
+from management.fees import device_fee_matchers
+from management.models import Brand, CurrencyRate, Offer, Subscriber, SubscriberDeviceFee, Supplier
+from management.rates import currency_rates
+from management.routing import compiled_preferences, routing_index
+from management.ultramsg_standin import make_server
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Runs pricing/distribution benchmarks against synthetic data (rolled back afterwards)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=['pricing-queries', 'batch-pricing', 'render', 'distribution'])
+        parser.add_argument('--offers', type=int, default=200)
+        parser.add_argument('--subscribers', type=int, default=50)
+        parser.add_argument('--offers-per-subscriber', type=int, default=50, help="render: offers in each message.")
+        parser.add_argument('--base-url', help="distribution: UltraMsg endpoint (default: an in-process stand-in).")
+        parser.add_argument('--latency', type=float, default=100.0, help="distribution: stand-in latency in ms.")
+        parser.add_argument('--jitter', type=float, default=50.0, help="distribution: stand-in extra random latency in ms.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="distribution: stand-in error rate.")
+        parser.add_argument('--rate-limit', type=int, default=0, help="distribution: stand-in requests per second.")
+
+    def handle(self, *args, **options):
+        if options['scenario'] == 'render':
+            return self._run_render(options['offers'], options['subscribers'], options['offers_per_subscriber'])
+        try:
+            with transaction.atomic():
+                offers, subscribers = self._create_fixture(options['offers'], options['subscribers'])
+                if options['scenario'] == 'distribution':
+                    self._run_distribution(offers, subscribers, options)
+                else:
+                    getattr(self, '_run_' + options['scenario'].replace('-', '_'))(offers, subscribers)
+                raise _Rollback()
+        except _Rollback:
+            pass
+        # البيانات الاصطناعية حُذفت، لذلك نُبطل الكاشات المحمّلة منها
+        currency_rates.invalidate()
+        device_fee_matchers.invalidate()
+        compiled_preferences.invalidate()
+        routing_index.invalidate()
+
+    def _create_fixture(self, n_offers, n_subscribers):
+        for from_currency, to_currency, rate in [('USD', 'SAR', '3.75'), ('AED', 'SAR', '1.02'), ('USD', 'AED', '3.6725')]:
+            CurrencyRate.objects.update_or_create(
+                from_currency=from_currency, to_currency=to_currency, defaults={'rate': Decimal(rate)}
+            )
+        supplier = Supplier.objects.create(name=f"BENCH-SUPPLIER-{time.time_ns()}")
+        offers = [
+            Offer.objects.create(
+                supplier=supplier, name=f"Bench Phone {i} 256GB", price=Decimal('500') + i, currency='USD',
+                shipping_cost=Decimal('25'), shipping_currency='AED',
+            )
+            for i in range(n_offers)
+        ]
+        subscribers = []
+        for i in range(n_subscribers):
+            subscriber = Subscriber.objects.create(
+                name=f"Bench Subscriber {i}", whatsapp_number=f"BENCH{time.time_ns()}{i}"[-20:],
+                target_currency='SAR' if i % 2 else 'AED',
+            )
+            SubscriberDeviceFee.objects.create(subscriber=subscriber, device_keyword='Bench Phone', fee=Decimal('15'), currency='AED')
+            subscribers.append(subscriber)
+        subscribers = list(Subscriber.objects.filter(pk__in=[s.pk for s in subscribers]).prefetch_related('device_fees'))
+        return offers, subscribers
+
+    def _run_pricing_queries(self, offers, subscribers):
+        """عدد الاستعلامات والزمن لحساب كل الأسعار (عرض × مشترك) عبر calculate_final_price."""
+        currency_rates.invalidate()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            for subscriber in subscribers:
+                for offer in offers:
+                    PricingEngine.calculate_final_price(offer, subscriber)
+            elapsed = time.perf_counter() - started
+        pairs = len(offers) * len(subscribers)
+        self.stdout.write(
+            f"pricing-queries: {pairs} pairs, {len(captured)} queries "
+            f"({len(captured) / max(pairs, 1):.4f} per pair), {elapsed:.3f}s"
+        )
+
+    def _run_batch_pricing(self, offers, subscribers):
+        """مقارنة زمن calculate_batch بالحساب زوجاً بزوج، مع التحقق من تطابق النتائج."""
+        started = time.perf_counter()
+        per_pair = [[PricingEngine.calculate_final_price(offer, subscriber) for offer in offers] for subscriber in subscribers]
+        per_pair_elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        batch = PricingEngine.calculate_batch(offers, subscribers)
+        batch_elapsed = time.perf_counter() - started
+        identical = all(
+            a.as_dict() == b.as_dict() for row_a, row_b in zip(per_pair, batch) for a, b in zip(row_a, row_b)
+        )
+        self.stdout.write(
+            f"batch-pricing: {len(offers) * len(subscribers)} pairs, per-pair {per_pair_elapsed:.3f}s, "
+            f"batch {batch_elapsed:.3f}s, identical={identical}"
+        )
+
+    def _run_render(self, n_offers, n_subscribers, per_subscriber):
+        """
+        زمن بناء الرسائل: إعادة بناء كتلة كل عرض لكل مشترك، مقابل أجزاء (OfferFragment) تُبنى مرة واحدة.
+        كل مشترك يستلم per_subscriber عرضاً مختلفاً من القائمة، والأسعار جاهزة مسبقاً.
+        """
+        supplier = Supplier(pk=1, name="BENCH", code="SUP-0001")
+        brands = [Brand(pk=i + 1, name=f"Brand {i}") for i in range(10)]
+        regions = ["USA", "Japan", "HONG KONG", "UAE", "Europe", "unknown"]
+        offers = [
+            Offer(
+                pk=i + 1, supplier=supplier, brand=brands[i % len(brands)], name=f"Bench Phone {i}",
+                storage="256GB", color="Black" if i % 3 else "", spec_region=regions[i % len(regions)],
+                quantity=i % 7, code=f"OFF-{i + 1:05d}", price=Decimal('500') + i, currency='USD',
+            )
+            for i in range(n_offers)
+        ]
+        subscribers = [Subscriber(pk=i + 1, name=f"Bench Subscriber {i}") for i in range(n_subscribers)]
+        per_subscriber = min(per_subscriber, n_offers)
+        prices = {offer.pk: PriceBreakdown('SAR', subtotal=offer.price * Decimal('3.75')) for offer in offers}
+        selections = [
+            [offers[(i * 7 + k) % n_offers] for k in range(per_subscriber)] for i in range(n_subscribers)
+        ]
+
+        started = time.perf_counter()
+        legacy = [
+            NotificationEngine.build_offer_message(subscriber, selected, supplier, prices=prices)
+            for subscriber, selected in zip(subscribers, selections)
+        ]
+        legacy_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        fragments = {offer.pk: OfferFragment.render(offer) for offer in offers}
+        rendered = [
+            NotificationEngine.build_offer_message(subscriber, selected, supplier, prices=prices, fragments=fragments)
+            for subscriber, selected in zip(subscribers, selections)
+        ]
+        fragments_elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"render: {n_subscribers} messages x {per_subscriber} offers ({n_offers} offers), "
+            f"per-message rendering {legacy_elapsed:.3f}s, fragments {fragments_elapsed:.3f}s, "
+            f"identical={legacy == rendered}"
+        )
+
+    def _run_distribution(self, offers, subscribers, options):
+        """
+        إنتاجية DistributionEngine.distribute كاملاً (تسعير + بناء + صندوق الرسائل + إرسال)
+        إلى المشتركين الاصطناعيين فقط، عبر الخادم البديل لـ UltraMsg.
+        """
+        server = None
+        base_url = options['base_url']
+        if not base_url:
+            server = make_server(
+                latency=options['latency'], jitter=options['jitter'],
+                error_rate=options['error_rate'], rate_limit=options['rate_limit'],
+            ).start()
+            base_url = server.base_url
+
+        # المشتركون الحقيقيون يُستبعدون (التعديل يُلغى مع التراجع عن المعاملة)
+        Subscriber.objects.exclude(pk__in=[s.pk for s in subscribers]).update(is_active=False)
+        routing_index.invalidate()
+        supplier = offers[0].supplier
+
+        latencies = []
+        client = _RecordingClient(
+            'bench', 'bench', base_url=base_url, latencies=latencies,
+            max_concurrency=getattr(settings, 'ULTRAMSG_MAX_CONCURRENCY', 8),
+            timeout=getattr(settings, 'ULTRAMSG_TIMEOUT', 20),
+        )
+        previous_client, ultramsg._client = ultramsg._client, client
+        try:
+            started = time.perf_counter()
+            sent, failed = DistributionEngine.distribute(offers, supplier)
+            elapsed = time.perf_counter() - started
+        finally:
+            ultramsg._client = previous_client
+            client.close()
+            if server:
+                server.shutdown()
+                server.server_close()
+
+        latencies.sort()
+        p50 = statistics.median(latencies) if latencies else 0
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0
+        self.stdout.write(
+            f"distribution: {sent} sent, {failed} failed in {elapsed:.3f}s "
+            f"({(sent + failed) / max(elapsed, 1e-9):.1f} msg/s, concurrency {client.max_concurrency}), "
+            f"send latency p50 {p50 * 1000:.1f}ms p99 {p99 * 1000:.1f}ms"
+        )
+
+
+class _RecordingClient(ultramsg.UltraMsgClient):
+    """عميل UltraMsg يسجّل زمن كل إرسال."""
+
+    def __init__(self, *args, latencies, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = latencies
+
+    def send(self, recipient_number, message_body):
+        result = super().send(recipient_number, message_body)
+        self.latencies.append(result.latency)
+        return result
@@ -0,0 +1,30 @@
+# management/management/commands/refresh_offer_prices.py
+"""
+يعيد بناء جدول الأسعار المحسوبة (SubscriberOfferPrice) بالكامل أو لعروض محددة.
+مفيد بعد إضافة مشترك جديد أو لملء الجدول لأول مرة.
+
+مثال:
+    python manage.py refresh_offer_prices --supplier 3
+"""
+from django.core.management.base import BaseCommand
+
+from management.models import Offer
+from management.price_store import refresh_offer_prices
+
+
+class Command(BaseCommand):
+    help = "Recomputes materialized subscriber offer prices."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--supplier', type=int, help="Only offers from this supplier id.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Offers priced per batch.")
+
+    def handle(self, *args, **options):
+        offers = Offer.objects.order_by('pk')
+        if options['supplier']:
+            offers = offers.filter(supplier_id=options['supplier'])
+        offer_ids = list(offers.values_list('pk', flat=True))
+        batch_size = options['batch_size']
+        for start in range(0, len(offer_ids), batch_size):
+            refresh_offer_prices(Offer.objects.filter(pk__in=offer_ids[start:start + batch_size]))
+        self.stdout.write(self.style.SUCCESS(f"Refreshed prices for {len(offer_ids)} offers."))
@@ -0,0 +1,47 @@
+# management/management/commands/send_outbox.py
+"""
+عامل صندوق الرسائل الصادرة: يرسل الرسائل المستحقة ويعيد محاولة الفاشل منها،
+ويرسل رسائل التجميع (digest) التي انقضت مدتها.
+يمكن تشغيل أكثر من عامل بالتوازي (كل عامل يحجز دفعات مختلفة).
+
+مثال:
+    python manage.py send_outbox --batch-size 100
+    python manage.py send_outbox --once
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from management.digest import flush_due_digests
+from management.outbox import BATCH_SIZE, drain
+
+
+class Command(BaseCommand):
+    help = "Sends pending NotificationOutbox messages, retrying failures with exponential backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Rows claimed per batch (above the default, set OUTBOX_CLAIM_TIMEOUT explicitly).")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds to sleep when nothing is due.")
+        parser.add_argument('--once', action='store_true', help="Send what is due now and exit.")
+
+    def handle(self, *args, **options):
+        counts = {'sent': 0, 'failed': 0}
+
+        def on_result(result):
+            counts['sent' if result.success else 'failed'] += 1
+
+        try:
+            while True:
+                close_old_connections()
+                attempted = flush_due_digests(on_result=on_result)
+                attempted += drain(batch_size=options['batch_size'], on_result=on_result)
+                if attempted:
+                    self.stdout.write(f"Attempted {attempted}: {counts['sent']} sent, {counts['failed']} failed so far.")
+                if options['once']:
+                    break
+                if not attempted:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Done: {counts['sent']} sent, {counts['failed']} failed."))
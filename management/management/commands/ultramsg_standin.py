@@ -0,0 +1,37 @@
+# management/management/commands/ultramsg_standin.py
+"""
+تشغيل خادم UltraMsg البديل محلياً. وجّه التطبيق إليه عبر:
+    ULTRAMSG_BASE_URL=http://127.0.0.1:8765
+
+مثال:
+    python manage.py ultramsg_standin --port 8765 --latency 150 --jitter 100 --error-rate 0.02 --rate-limit 80
+"""
+from django.core.management.base import BaseCommand
+
+from management.ultramsg_standin import make_server
+
+
+class Command(BaseCommand):
+    help = "Runs a local stand-in for the UltraMsg /messages/chat endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0, help="Base response latency in ms.")
+        parser.add_argument('--jitter', type=float, default=0.0, help="Extra random latency (0..jitter) in ms.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with an error.")
+        parser.add_argument('--rate-limit', type=int, default=0, help="Max requests per second (0 = unlimited); excess gets 429.")
+
+    def handle(self, *args, **options):
+        server = make_server(
+            options['host'], options['port'], latency=options['latency'], jitter=options['jitter'],
+            error_rate=options['error_rate'], rate_limit=options['rate_limit'],
+        )
+        self.stdout.write(f"UltraMsg stand-in listening on {server.base_url} (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        self.stdout.write(f"Stats: {server.stats}")
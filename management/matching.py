@@ -0,0 +1,78 @@
+# management/matching.py
+"""
+مطابقة عدة كلمات مفتاحية دفعة واحدة (خوارزمية Aho-Corasick).
+تُبنى الآلة مرة واحدة لمجموعة كلمات، ثم تجد أطول كلمة موجودة في النص بمرور واحد عليه.
+"""
+from collections import deque
+
+
+class KeywordMatcher:
+    """
+    آلة مطابقة مبنية من أزواج (كلمة مفتاحية، قيمة).
+
+    longest(text) تُرجع قيمة أطول كلمة مفتاحية موجودة داخل النص (بدون تمييز حالة الأحرف)،
+    وعند التساوي في الطول تُرجع الكلمة التي أُضيفت أولاً، تماماً مثل حلقة البحث القديمة:
+        if keyword.lower() in text.lower() and len(keyword) > len(best): best = keyword
+    """
+
+    def __init__(self, entries):
+        self._goto = [{}]
+        self._fail = [0]
+        # أفضل تطابق ينتهي عند كل عقدة: (الطول، -الترتيب، القيمة) أو None
+        self._best = [None]
+        for order, (keyword, value) in enumerate(entries):
+            if keyword is None:
+                continue
+            self._add(keyword.lower(), (len(keyword), -order, value))
+        self._build_links()
+
+    def __bool__(self):
+        return len(self._goto) > 1 or self._best[0] is not None
+
+    def _add(self, pattern, candidate):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            node = next_node
+        self._best[node] = self._better(self._best[node], candidate)
+
+    def _build_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                link = self._goto[fallback].get(char, 0)
+                self._fail[child] = link if link != child else 0
+                # كل عقدة ترث أفضل تطابق من سلسلة روابط الفشل (لاحقة أقصر)
+                self._best[child] = self._better(self._best[child], self._best[self._fail[child]])
+                queue.append(child)
+
+    @staticmethod
+    def _better(current, candidate):
+        if candidate is None:
+            return current
+        if current is None or candidate[:2] > current[:2]:
+            return candidate
+        return current
+
+    def longest(self, text):
+        """قيمة أطول كلمة مفتاحية موجودة في النص، أو None."""
+        goto, fail, best = self._goto, self._fail, self._best
+        result = best[0]
+        node = 0
+        for char in (text or '').lower():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if best[node] is not None:
+                result = self._better(result, best[node])
+        return result[2] if result is not None else None
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-18 02:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0009_alter_shippingrate_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriberOfferPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True, verbose_name='السعر النهائي')),
+                ('currency', models.CharField(blank=True, max_length=3, verbose_name='العملة')),
+                ('no_charge', models.BooleanField(default=False, verbose_name='عند الطلب')),
+                ('error', models.CharField(blank=True, max_length=255, verbose_name='خطأ التسعير')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='آخر تحديث')),
+                ('device_fee', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='management.subscriberdevicefee', verbose_name='رسم الجهاز المطبق')),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subscriber_prices', to='management.offer', verbose_name='العرض')),
+                ('subscriber', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='offer_prices', to='management.subscriber', verbose_name='المشترك')),
+            ],
+            options={
+                'verbose_name': 'سعر عرض لمشترك',
+                'verbose_name_plural': 'أسعار العروض للمشتركين',
+                'unique_together': {('subscriber', 'offer')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.23 on 2026-10-18 02:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0010_subscriberofferprice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('body', models.TextField(verbose_name='نص الرسالة')),
+                ('dedupe_key', models.CharField(max_length=64, unique=True, verbose_name='مفتاح منع التكرار')),
+                ('status', models.CharField(choices=[('pending', 'بانتظار الإرسال'), ('sending', 'قيد الإرسال'), ('sent', 'تم الإرسال'), ('failed', 'فشل نهائياً')], default='pending', max_length=10, verbose_name='الحالة')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='عدد المحاولات')),
+                ('next_attempt_at', models.DateTimeField(verbose_name='موعد المحاولة التالية')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='وقت الحجز')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='وقت الإرسال')),
+                ('last_error', models.TextField(blank=True, verbose_name='آخر خطأ')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+                ('subscriber', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='management.subscriber', verbose_name='المشترك')),
+            ],
+            options={
+                'verbose_name': 'رسالة صادرة',
+                'verbose_name_plural': 'صندوق الرسائل الصادرة',
+                'ordering': ['next_attempt_at', 'pk'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='management__status_77406f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-18 02:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0011_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscriber',
+            name='digest_window_minutes',
+            field=models.PositiveIntegerField(default=0, verbose_name='مدة تجميع العروض (بالدقائق)'),
+        ),
+        migrations.CreateModel(
+            name='PendingDigestOffer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإضافة')),
+                ('offer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='management.offer', verbose_name='العرض')),
+                ('subscriber', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_digest_offers', to='management.subscriber', verbose_name='المشترك')),
+            ],
+            options={
+                'verbose_name': 'عرض مؤجل للتجميع',
+                'verbose_name_plural': 'العروض المؤجلة للتجميع',
+                'unique_together': {('subscriber', 'offer')},
+            },
+        ),
+    ]
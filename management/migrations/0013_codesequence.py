@@ -0,0 +1,41 @@
+# Generated by Django 4.2.23 on 2026-10-18 02:19
+
+from django.db import migrations, models
+
+
+def _next_value(model, prefix):
+    """أكبر من كل pk وكل رقم كود موجود، حتى لا يتكرر أي كود قديم."""
+    highest = model.objects.aggregate(models.Max('pk'))['pk__max'] or 0
+    for code in model.objects.filter(code__startswith=prefix).values_list('code', flat=True).iterator():
+        number = code[len(prefix):]
+        if number.isdigit():
+            highest = max(highest, int(number))
+    return highest + 1
+
+
+def init_sequences(apps, schema_editor):
+    CodeSequence = apps.get_model('management', 'CodeSequence')
+    CodeSequence.objects.create(name='offer', next_value=_next_value(apps.get_model('management', 'Offer'), 'OFF-'))
+    CodeSequence.objects.create(name='supplier', next_value=_next_value(apps.get_model('management', 'Supplier'), 'SUP-'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0012_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeSequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='الاسم')),
+                ('next_value', models.BigIntegerField(default=1, verbose_name='الرقم التالي')),
+            ],
+            options={
+                'verbose_name': 'عدّاد أكواد',
+                'verbose_name_plural': 'عدّادات الأكواد',
+            },
+        ),
+        migrations.RunPython(init_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.23 on 2026-10-18 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0013_codesequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParsedOfferCache',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='بصمة النص')),
+                ('prompt_version', models.CharField(max_length=20, verbose_name='إصدار الـ prompt')),
+                ('offer_groups', models.JSONField(verbose_name='مجموعات العروض')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='تاريخ الانتهاء')),
+            ],
+            options={
+                'verbose_name': 'نتيجة تحليل محفوظة',
+                'verbose_name_plural': 'كاش تحليل العروض',
+            },
+        ),
+    ]
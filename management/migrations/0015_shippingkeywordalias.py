@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-18 02:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0014_parsedoffercache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShippingKeywordAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='اسم المنتج (موحّد)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإضافة')),
+                ('shipping_rate', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='management.shippingrate', verbose_name='سعر الشحن')),
+            ],
+            options={
+                'verbose_name': 'اسم منتج مطابق لسعر شحن',
+                'verbose_name_plural': 'أسماء المنتجات المطابقة لأسعار الشحن',
+                'ordering': ['name'],
+            },
+        ),
+    ]
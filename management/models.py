@@ -1,5 +1,6 @@
 from django.db import models
 from django.core.validators import MinValueValidator
+from .codes import offer_codes, supplier_codes
 
 # ==========================================================================
 # 1. النماذج الأساسية (Core Data Models)
@@ -41,13 +42,10 @@ class Supplier(models.Model):
         return self.name
 
     def save(self, *args, **kwargs):
-        # يتم إنشاء الكود فقط عند إنشاء المورد لأول مرة
-        if not self.pk:
-            super().save(*args, **kwargs) # نحفظ أولاً للحصول على ID
-            self.code = f"SUP-{self.pk:04d}"
-            super().save(update_fields=['code']) # نحفظ مرة أخرى لتحديث الكود
-        else:
-            super().save(*args, **kwargs)
+        # يتم إنشاء الكود فقط عند إنشاء المورد لأول مرة (من عدّاد الأكواد، بدون حفظ ثانٍ)
+        if not self.pk and not self.code:
+            self.code = supplier_codes.next()
+        super().save(*args, **kwargs)
 
 
 # ==========================================================================
@@ -102,6 +100,24 @@ class ShippingRate(models.Model):
         return f"Shipping for '{self.product_keyword_en or self.product_keyword_ar}': {self.cost} {self.currency}"
 
 
+class ShippingKeywordAlias(models.Model):
+    """
+    نتيجة محفوظة لمطابقة اسم منتج مع سعر شحن بالذكاء الاصطناعي (عندما لا توجد كلمة مفتاحية في الاسم)،
+    حتى لا يُسأل الـ AI عن نفس المنتج مرة أخرى. shipping_rate فارغ = الـ AI لم يجد أي تطابق.
+    """
+    name = models.CharField(max_length=255, unique=True, verbose_name="اسم المنتج (موحّد)")
+    shipping_rate = models.ForeignKey(ShippingRate, on_delete=models.CASCADE, null=True, blank=True, related_name="aliases", verbose_name="سعر الشحن")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الإضافة")
+
+    class Meta:
+        verbose_name = "اسم منتج مطابق لسعر شحن"
+        verbose_name_plural = "أسماء المنتجات المطابقة لأسعار الشحن"
+        ordering = ['name']
+
+    def __str__(self):
+        return f"{self.name} -> {self.shipping_rate.product_keyword_en if self.shipping_rate else '-'}"
+
+
 # ==========================================================================
 # 3. نماذج المشتركين وتفضيلاتهم (Subscriber & Preference Models)
 # ==========================================================================
@@ -117,6 +133,8 @@ class Subscriber(models.Model):
     subscriber_type = models.CharField(max_length=10, choices=SubscriberType.choices, default=SubscriberType.EXTERNAL, verbose_name="نوع المشترك")
     is_active = models.BooleanField(default=True, verbose_name="نشط؟")
     target_currency = models.CharField(max_length=3, default="SAR", verbose_name="عملة التسعير النهائية")
+    # 0 = إرسال كل دفعة عروض فوراً. غير ذلك: تُجمع العروض الواردة خلال هذه المدة في رسالة واحدة
+    digest_window_minutes = models.PositiveIntegerField(default=0, verbose_name="مدة تجميع العروض (بالدقائق)")
 
     class Meta:
         verbose_name = "مشترك"
@@ -230,9 +248,140 @@ class Offer(models.Model):
         return f"{self.name} من {self.supplier.name}"
 
     def save(self, *args, **kwargs):
-        if not self.pk:
-            super().save(*args, **kwargs)
-            self.code = f"OFF-{self.pk:05d}"
-            super().save(update_fields=['code'])
-        else:
-            super().save(*args, **kwargs)
\ No newline at end of file
+        if not self.pk and not self.code:
+            self.code = offer_codes.next()
+        super().save(*args, **kwargs)
+
+# ==========================================================================
+# 5. الأسعار المحسوبة مسبقاً (Materialized Prices)
+# ==========================================================================
+
+class SubscriberOfferPrice(models.Model):
+    """
+    السعر النهائي لعرض معين لمشترك معين، محسوب مسبقاً بواسطة PricingEngine.
+    يُملأ عند حفظ العروض وتوزيعها، ويُعاد حساب الصفوف المتأثرة فقط عند تغيّر
+    أسعار الصرف أو رسوم الأجهزة أو عملة/نوع المشترك (انظر price_store.py).
+    """
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE, related_name="offer_prices", verbose_name="المشترك")
+    offer = models.ForeignKey(Offer, on_delete=models.CASCADE, related_name="subscriber_prices", verbose_name="العرض")
+    device_fee = models.ForeignKey(SubscriberDeviceFee, on_delete=models.SET_NULL, null=True, blank=True, related_name="+", verbose_name="رسم الجهاز المطبق")
+    price = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True, verbose_name="السعر النهائي")
+    currency = models.CharField(max_length=3, blank=True, verbose_name="العملة")
+    no_charge = models.BooleanField(default=False, verbose_name="عند الطلب")
+    error = models.CharField(max_length=255, blank=True, verbose_name="خطأ التسعير")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="آخر تحديث")
+
+    class Meta:
+        unique_together = ('subscriber', 'offer')
+        verbose_name = "سعر عرض لمشترك"
+        verbose_name_plural = "أسعار العروض للمشتركين"
+
+    def __str__(self):
+        return f"{self.offer_id} -> {self.subscriber_id}: {self.price} {self.currency}"
+
+
+# ==========================================================================
+# 6. صندوق الرسائل الصادرة (Notification Outbox)
+# ==========================================================================
+
+class NotificationOutbox(models.Model):
+    """
+    رسالة واتساب واحدة بانتظار الإرسال (صف لكل مشترك ورسالة).
+    تُكتب الرسائل هنا أولاً ثم يرسلها العامل (manage.py send_outbox) أو التوزيع نفسه،
+    مع إعادة المحاولة بتأخير متزايد، فلا يضيع شيء إذا فشل الإرسال أو توقفت العملية (انظر outbox.py).
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'بانتظار الإرسال'),
+        (STATUS_SENDING, 'قيد الإرسال'),
+        (STATUS_SENT, 'تم الإرسال'),
+        (STATUS_FAILED, 'فشل نهائياً'),
+    ]
+
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE, related_name="outbox", verbose_name="المشترك")
+    body = models.TextField(verbose_name="نص الرسالة")
+    dedupe_key = models.CharField(max_length=64, unique=True, verbose_name="مفتاح منع التكرار")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="الحالة")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="عدد المحاولات")
+    next_attempt_at = models.DateTimeField(verbose_name="موعد المحاولة التالية")
+    claimed_at = models.DateTimeField(null=True, blank=True, verbose_name="وقت الحجز")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="وقت الإرسال")
+    last_error = models.TextField(blank=True, verbose_name="آخر خطأ")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الإنشاء")
+
+    class Meta:
+        ordering = ['next_attempt_at', 'pk']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+        verbose_name = "رسالة صادرة"
+        verbose_name_plural = "صندوق الرسائل الصادرة"
+
+    def __str__(self):
+        return f"{self.subscriber_id} [{self.status}] #{self.attempts}"
+
+
+# ==========================================================================
+# 7. العروض المؤجلة لرسالة التجميع (Digest)
+# ==========================================================================
+
+class PendingDigestOffer(models.Model):
+    """
+    عرض بانتظار إرساله ضمن رسالة التجميع لمشترك فعّل digest_window_minutes.
+    تُرسل كل العروض المؤجلة للمشترك (من كل الموردين) في رسالة واحدة بعد انقضاء المدة
+    من أقدم عرض مؤجل (انظر digest.py).
+    """
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE, related_name="pending_digest_offers", verbose_name="المشترك")
+    offer = models.ForeignKey(Offer, on_delete=models.CASCADE, related_name="+", verbose_name="العرض")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الإضافة")
+
+    class Meta:
+        unique_together = ('subscriber', 'offer')
+        verbose_name = "عرض مؤجل للتجميع"
+        verbose_name_plural = "العروض المؤجلة للتجميع"
+
+    def __str__(self):
+        return f"{self.offer_id} -> {self.subscriber_id}"
+
+
+# ==========================================================================
+# 8. عدّادات الأكواد (Code Sequences)
+# ==========================================================================
+
+class CodeSequence(models.Model):
+    """
+    الرقم التالي المتاح لكل نوع كود (offer / supplier). تُحجز منه كتل أرقام (انظر codes.py).
+    """
+    name = models.CharField(max_length=50, primary_key=True, verbose_name="الاسم")
+    next_value = models.BigIntegerField(default=1, verbose_name="الرقم التالي")
+
+    class Meta:
+        verbose_name = "عدّاد أكواد"
+        verbose_name_plural = "عدّادات الأكواد"
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+# ==========================================================================
+# 9. كاش نتائج تحليل النصوص بالذكاء الاصطناعي (Parse Cache)
+# ==========================================================================
+
+class ParsedOfferCache(models.Model):
+    """
+    نتيجة parse_with_ai لنص مورد، بمفتاح هو بصمة النص (بعد توحيد المسافات) مع إصدار الـ prompt.
+    إعادة لصق نفس الرسالة تُرجع المجموعات المحفوظة بدل طلب جديد إلى Gemini (انظر parse_cache.py).
+    """
+    key = models.CharField(max_length=64, primary_key=True, verbose_name="بصمة النص")
+    prompt_version = models.CharField(max_length=20, verbose_name="إصدار الـ prompt")
+    offer_groups = models.JSONField(verbose_name="مجموعات العروض")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاريخ الإنشاء")
+    expires_at = models.DateTimeField(db_index=True, verbose_name="تاريخ الانتهاء")
+
+    class Meta:
+        verbose_name = "نتيجة تحليل محفوظة"
+        verbose_name_plural = "كاش تحليل العروض"
+
+    def __str__(self):
+        return f"{self.key[:12]} ({self.prompt_version})"
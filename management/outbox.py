@@ -0,0 +1,144 @@
+# management/outbox.py
+"""
+صندوق الرسائل الصادرة (NotificationOutbox).
+
+- enqueue: يكتب الرسائل كصفوف pending (مع مفتاح يمنع تكرار نفس الرسالة لنفس المشترك في نفس الدفعة).
+- claim_batch: يحجز دفعة صفوف مستحقة بـ select_for_update(skip_locked=True)، فيمكن تشغيل عدة عمال بالتوازي.
+- deliver: يرسل الدفعة المحجوزة ويحدّث حالتها بكتابة واحدة (bulk_update)،
+  والفاشل يُعاد جدولته بتأخير متزايد (exponential backoff) حتى OUTBOX_MAX_ATTEMPTS.
+
+الصف المحجوز (sending) الذي توقفت عمليته يعود متاحاً بعد claim_timeout().
+"""
+import hashlib
+import logging
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import NotificationOutbox
+from .ultramsg import get_client
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+# هامش إضافي (ثوانٍ) فوق أسوأ زمن للإرسال قبل اعتبار الحجز متروكاً
+CLAIM_MARGIN = 60
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def backoff_delay(attempts):
+    """التأخير قبل المحاولة التالية: BASE * 2^(المحاولات-1) ثانية، بحد أقصى OUTBOX_BACKOFF_MAX."""
+    base = _setting('OUTBOX_BACKOFF_BASE', 30)
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), _setting('OUTBOX_BACKOFF_MAX', 3600)))
+
+
+def claim_timeout():
+    """
+    مدة حجز الصف قبل أن يُعتبر متروكاً ويُحجز مرة ثانية. يجب أن تتجاوز أسوأ زمن لإرسال دفعة محجوزة،
+    وإلا قد تُرسل الدفعة البطيئة مرتين. كل دفعات العملية (حتى DISTRIBUTION_WORKERS دفعة بحجم BATCH_SIZE)
+    تتشارك ULTRAMSG_MAX_CONCURRENCY إرسالاً، وكل إرسال قد يستغرق مهلة الاتصال ثم مهلة القراءة (2 × ULTRAMSG_TIMEOUT).
+    OUTBOX_CLAIM_TIMEOUT (إن لم تكن 0) تتجاوز هذا الحساب، ويجب ضبطها عند استخدام دفعات أكبر من BATCH_SIZE.
+    """
+    configured = _setting('OUTBOX_CLAIM_TIMEOUT', 0)
+    if configured:
+        return timedelta(seconds=configured)
+    in_flight = _setting('DISTRIBUTION_WORKERS', 4) * BATCH_SIZE
+    rounds = math.ceil(in_flight / max(1, _setting('ULTRAMSG_MAX_CONCURRENCY', 8)))
+    return timedelta(seconds=rounds * 2 * _setting('ULTRAMSG_TIMEOUT', 20) + CLAIM_MARGIN)
+
+
+def make_dedupe_key(subscriber_id, batch_key, body):
+    return hashlib.sha256(f"{subscriber_id}:{batch_key}:{body}".encode()).hexdigest()
+
+
+def enqueue(messages, batch_key):
+    """
+    messages: قائمة (subscriber, body). batch_key يميّز الدفعة (مثلاً رقم مهمة التوزيع)،
+    فإعادة تشغيل نفس الدفعة لا تُنشئ صفوفاً مكررة.
+    تُرجع أرقام الصفوف (الموجودة مسبقاً أو الجديدة) بنفس ترتيب الرسائل.
+    """
+    now = timezone.now()
+    rows = [
+        NotificationOutbox(
+            subscriber_id=subscriber.pk, body=body, next_attempt_at=now,
+            dedupe_key=make_dedupe_key(subscriber.pk, batch_key, body),
+        )
+        for subscriber, body in messages
+    ]
+    NotificationOutbox.objects.bulk_create(rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    ids = dict(
+        NotificationOutbox.objects.filter(dedupe_key__in=[row.dedupe_key for row in rows]).values_list('dedupe_key', 'pk')
+    )
+    return [ids[row.dedupe_key] for row in rows]
+
+
+def claim_batch(limit=BATCH_SIZE, ids=None):
+    """يحجز حتى limit صفاً مستحقاً (بتحويلها إلى sending) ويُرجعها مع مشتركيها."""
+    now = timezone.now()
+    stale = now - claim_timeout()
+    due = NotificationOutbox.objects.filter(
+        Q(status=NotificationOutbox.STATUS_PENDING, next_attempt_at__lte=now)
+        | Q(status=NotificationOutbox.STATUS_SENDING, claimed_at__lt=stale)
+    )
+    if ids is not None:
+        due = due.filter(pk__in=ids)
+    with transaction.atomic():
+        claimed = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+        if not claimed:
+            return []
+        NotificationOutbox.objects.filter(pk__in=claimed).update(status=NotificationOutbox.STATUS_SENDING, claimed_at=now)
+    return list(NotificationOutbox.objects.filter(pk__in=claimed).select_related('subscriber'))
+
+
+def deliver(rows, on_result=None):
+    """
+    يرسل الصفوف المحجوزة بالتوازي ثم يحفظ نتائجها دفعة واحدة.
+    on_result (اختياري) تُستدعى لكل SendResult فور انتهائه.
+    """
+    if not rows:
+        return []
+    max_attempts = _setting('OUTBOX_MAX_ATTEMPTS', 5)
+    results = get_client().send_many([(row.subscriber.whatsapp_number, row.body) for row in rows], on_result=on_result)
+
+    now = timezone.now()
+    for row, result in zip(rows, results):
+        row.attempts += 1
+        row.claimed_at = None
+        if result.success:
+            row.status = NotificationOutbox.STATUS_SENT
+            row.sent_at = now
+            row.last_error = ''
+        else:
+            row.last_error = str(result.detail)
+            if row.attempts >= max_attempts:
+                row.status = NotificationOutbox.STATUS_FAILED
+                logger.error("Outbox message %s failed permanently after %s attempts: %s", row.pk, row.attempts, row.last_error)
+            else:
+                row.status = NotificationOutbox.STATUS_PENDING
+                row.next_attempt_at = now + backoff_delay(row.attempts)
+    NotificationOutbox.objects.bulk_update(
+        rows, ['status', 'attempts', 'claimed_at', 'sent_at', 'last_error', 'next_attempt_at'], batch_size=BATCH_SIZE
+    )
+    return results
+
+
+def drain(ids=None, batch_size=BATCH_SIZE, on_result=None):
+    """
+    يرسل كل الصفوف المستحقة الآن (أو المحددة في ids فقط) دفعة بعد دفعة.
+    الفاشل يُجدول لوقت لاحق، فكل صف يُحاول مرة واحدة على الأكثر في كل استدعاء.
+    تُرجع عدد الصفوف التي تمت محاولتها.
+    """
+    attempted = 0
+    while True:
+        rows = claim_batch(batch_size, ids=ids)
+        if not rows:
+            return attempted
+        deliver(rows, on_result=on_result)
+        attempted += len(rows)
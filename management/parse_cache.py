@@ -0,0 +1,140 @@
+# management/parse_cache.py
+"""
+كاش نتائج parse_with_ai.
+
+المفتاح = sha256 للنص بعد توحيد المسافات والأسطر الفارغة + إصدار الـ prompt،
+فإعادة لصق نفس رسالة المورد (حتى مع اختلاف المسافات) لا تكلف طلباً جديداً إلى Gemini،
+وتغيير الـ prompt (PROMPT_VERSION) يُبطل كل النتائج القديمة تلقائياً.
+
+طبقتان:
+- LRU محدود الحجم داخل العملية (PARSE_CACHE_MAX_ENTRIES).
+- جدول ParsedOfferCache المشترك بين العمليات، مع مدة صلاحية (PARSE_CACHE_TTL بالثواني).
+تُحفظ النتائج الناجحة فقط، وعدادات الإصابة/الإخفاق متاحة عبر stats().
+"""
+import copy
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .models import ParsedOfferCache
+
+logger = logging.getLogger(__name__)
+
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """يوحّد المسافات داخل كل سطر ويحذف الأسطر الفارغة (مع الإبقاء على حالة الأحرف)."""
+    lines = (_SPACES.sub(' ', line).strip() for line in (text or '').splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def cache_key(text, prompt_version):
+    return hashlib.sha256(f"{prompt_version}\n{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+
+class ParseCache:
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, offer_groups)
+        self._lock = threading.Lock()
+        self.memory_hits = self.db_hits = self.misses = 0
+
+    def _max_entries(self):
+        return self.max_entries or getattr(settings, 'PARSE_CACHE_MAX_ENTRIES', 256)
+
+    def _ttl(self):
+        return self.ttl or getattr(settings, 'PARSE_CACHE_TTL', 7 * 24 * 3600)
+
+    def _remember(self, key, expires_at, offer_groups):
+        with self._lock:
+            self._entries[key] = (expires_at, offer_groups)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries():
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """نسخة من المجموعات المحفوظة، أو None."""
+        now = timezone.now()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return copy.deepcopy(entry[1])
+                del self._entries[key]
+
+        row = ParsedOfferCache.objects.filter(key=key, expires_at__gt=now).values_list('expires_at', 'offer_groups').first()
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        self._remember(key, *row)
+        with self._lock:
+            self.db_hits += 1
+        return copy.deepcopy(row[1])
+
+    def set(self, key, prompt_version, offer_groups):
+        expires_at = timezone.now() + timedelta(seconds=self._ttl())
+        self._remember(key, expires_at, copy.deepcopy(offer_groups))
+        # الحفظ يحدث بعد طلب AI يستغرق ثوانٍ، فحذف الصفوف المنتهية هنا لا يُلاحظ
+        self.purge_expired()
+        ParsedOfferCache.objects.update_or_create(
+            key=key, defaults={'prompt_version': prompt_version, 'offer_groups': offer_groups, 'expires_at': expires_at},
+        )
+
+    def get_or_parse(self, text, prompt_version, parse):
+        """
+        يُرجع نتيجة parse(text) من الكاش إن وُجدت، وإلا يستدعيها ويحفظ النتيجة إذا نجحت
+        (قائمة مجموعات بدون عنصر {"error": ...}).
+        """
+        key = cache_key(text, prompt_version)
+        offer_groups = self.get(key)
+        if offer_groups is not None:
+            return offer_groups
+        offer_groups = parse(text)
+        if isinstance(offer_groups, list) and not any(isinstance(group, dict) and 'error' in group for group in offer_groups):
+            try:
+                self.set(key, prompt_version, offer_groups)
+            except DatabaseError as e:
+                # فشل الحفظ في الكاش لا يُضيّع نتيجة تحليل ناجحة
+                logger.warning("Could not store parse result in cache: %s", e)
+        return offer_groups
+
+    def purge_expired(self):
+        """يحذف الصفوف المنتهية من الجدول، ويُرجع عددها."""
+        deleted, _ = ParsedOfferCache.objects.filter(expires_at__lte=timezone.now()).delete()
+        return deleted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """عدادات هذه العملية (منذ بدء تشغيلها)، وعدد النتائج الصالحة في الجدول."""
+        with self._lock:
+            hits = self.memory_hits + self.db_hits
+            lookups = hits + self.misses
+            stats = {
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'hits': hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else None,
+                'memory_entries': len(self._entries),
+                'memory_max_entries': self._max_entries(),
+            }
+        stats['stored_entries'] = ParsedOfferCache.objects.filter(expires_at__gt=timezone.now()).count()
+        return stats
+
+
+parse_cache = ParseCache()
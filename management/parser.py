@@ -1,18 +1,30 @@
 # management/parser.py
-import os
+import re
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import google.generativeai as genai
+from django.conf import settings
+from django.db import connections
+
+from .gemini import get_backend as get_gemini_backend
+from .parse_cache import parse_cache
+
+# يجب تغييره مع أي تعديل على الـ prompt أدناه، حتى لا تُستخدم نتائج محفوظة من الـ prompt القديم
+PROMPT_VERSION = "v3.0"
 
 def parse_with_ai(text):
     """
     Parses raw text into a list of OFFER GROUPS, with an enhanced prompt for region extraction.
+    Results are cached by normalized text + PROMPT_VERSION (see parse_cache.py).
     """
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        return [{"error": "Google API key is not configured."}]
+    return parse_cache.get_or_parse(text, PROMPT_VERSION, _parse_with_gemini)
 
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
+def _parse_with_gemini(text):
+    backend = get_gemini_backend()
+    if not backend.configured:
+        return [{"error": "Google API key is not configured."}]
 
     # --- MASTER PROMPT v3.0 (Enhanced for Region Detection) ---
     prompt = f"""
@@ -53,15 +65,372 @@ def parse_with_ai(text):
     """
     try:
         generation_config = genai.GenerationConfig(response_mime_type="application/json")
-        response = model.generate_content(prompt, generation_config=generation_config)
+        response = backend.generate(prompt, generation_config=generation_config)
         parsed_json = json.loads(response.text)
         return parsed_json.get("offer_groups", [])
     except Exception as e:
         print(f"An error occurred with the API: {e}")
-        return [{"error": f"Failed to parse with AI. Details: {str(e)}"}]
+        # أخطاء الطلب نفسه (الشبكة، الخدمة، رد غير صالح) قد تنجح عند إعادة المحاولة
+        return [{"error": f"Failed to parse with AI. Details: {str(e)}", "retryable": True}]
+
+# ==========================================================================
+# التحليل المحلي (بدون AI) للأسطر ذات الصيغ المعروفة
+# ==========================================================================
+# معظم أسطر الموردين بصيغة مثل "S24 Ultra 256GB Black 50pcs $820": موديل معروف + سعر واحد،
+# ومعها (اختيارياً) السعة واللون والكمية والمنطقة والحالة. هذه الأسطر تُحلَّل هنا مباشرة،
+# وما لا يمكن تحليله بثقة يُرسل وحده إلى parse_with_ai ثم تُدمج النتيجتان.
+
+_NUMBER = r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?"
+_CURRENCIES = {
+    '$': 'USD', 'usd': 'USD', 'dollar': 'USD', 'aed': 'AED', 'dhs': 'AED', 'dirham': 'AED',
+    'sar': 'SAR', 'sr': 'SAR', 'riyal': 'SAR', 'eur': 'EUR', '€': 'EUR', 'gbp': 'GBP', '£': 'GBP',
+}
+_CURRENCY = r"\$|€|£|usd|aed|dhs|dirham|sar|sr|riyal|eur|gbp|dollar"
+_PRICE_PATTERNS = [
+    re.compile(rf"(?<![a-z])(?P<currency>{_CURRENCY})\s*(?P<price>{_NUMBER})(?![\w.])", re.I),
+    re.compile(rf"(?<![\w.])(?P<price>{_NUMBER})\s*(?P<currency>{_CURRENCY})(?!\w)", re.I),
+    re.compile(rf"@\s*(?P<price>{_NUMBER})(?![\w.])", re.I),
+]
+_QUANTITY_PATTERNS = [
+    re.compile(r"(?<![\w.])(?P<quantity>\d+)\s*(?:pcs|pc|pieces|units?|x|حبة|حبه)(?!\w)", re.I),
+    re.compile(r"\b(?:qty\s*:?|x)\s*(?P<quantity>\d+)(?!\w)", re.I),
+]
+_STORAGE = re.compile(r"(?<![\w.])(?P<storage>(?:\d{1,2}\s*/\s*)?\d+\s*(?:gb|tb))(?!\w)", re.I)
+_REGIONS = {
+    'usa': 'USA', 'us': 'USA', 'japan': 'Japan', 'jp': 'Japan', 'international': 'International',
+    'intl': 'International', 'global': 'Global', 'middle east': 'Middle East', 'me': 'Middle East',
+    'ksa': 'KSA', 'uae': 'UAE', 'vietnam': 'Vietnam', 'vn': 'Vietnam', 'hong kong': 'Hong Kong', 'hk': 'Hong Kong',
+    'china': 'China', 'cn': 'China', 'india': 'India', 'europe': 'Europe', 'eu': 'Europe', 'uk': 'UK',
+    'canada': 'Canada', 'korea': 'Korea', 'singapore': 'Singapore', 'australia': 'Australia',
+}
+_REGION = re.compile(
+    r"\b(?P<region>" + "|".join(sorted(map(re.escape, _REGIONS), key=len, reverse=True)) + r")"
+    r"(?:\s*(?:spec|specs|version|ver|variant))?\b",
+    re.I,
+)
+_CONDITIONS = {
+    'new': 'New', 'brand new': 'New', 'used': 'Used', 'refurbished': 'Refurbished', 'refurb': 'Refurbished',
+    'open box': 'Open Box', 'cpo': 'CPO', 'activated': 'Activated', 'like new': 'Like New',
+}
+_CONDITION = re.compile(
+    r"\b(?P<condition>" + "|".join(sorted(map(re.escape, _CONDITIONS), key=len, reverse=True)) + r")\b", re.I
+)
+_COLORS = [
+    'natural titanium', 'black titanium', 'white titanium', 'desert titanium', 'blue titanium',
+    'titanium black', 'titanium gray', 'titanium grey', 'titanium violet', 'titanium yellow', 'titanium blue',
+    'titanium green', 'titanium silver', 'titanium silverblue', 'titanium jetblack', 'titanium whitesilver',
+    'space gray', 'space grey', 'space black', 'deep purple', 'sierra blue', 'alpine green', 'pacific blue',
+    'rose gold', 'jet black', 'onyx black', 'marble gray', 'marble grey', 'cobalt violet', 'amber yellow',
+    'silver shadow', 'crafted black', 'mint green', 'icy blue', 'sky blue', 'light blue', 'dark blue', 'phantom black',
+    'black', 'white', 'blue', 'red', 'green', 'pink', 'purple', 'yellow', 'gold', 'silver', 'gray', 'grey',
+    'graphite', 'midnight', 'starlight', 'ultramarine', 'teal', 'lavender', 'mint', 'cream', 'violet',
+    'obsidian', 'porcelain', 'hazel', 'titanium', 'natural', 'desert', 'orange', 'coral', 'navy',
+]
+_COLOR = re.compile(r"\b(?P<color>" + "|".join(sorted(map(re.escape, _COLORS), key=len, reverse=True)) + r")\b", re.I)
+_NOISE = re.compile(r"[^\w\s+.]|(?<!\d)\.|\.(?!\d)|_")
+_SPACE = re.compile(r"\s+")
+
+# (الموديل، الماركة، الفئة، اسم السلسلة): يجب أن يطابق الموديل كل ما يتبقى من السطر بعد استخراج باقي الحقول
+_MODEL_FAMILIES = [
+    (r"(?:apple\s+)?iphone\s*(?:\d{1,2}|se|xs|xr|x)(?:\s*(?:pro\s*max|pro|plus|mini|max|e))?", 'Apple', 'Phones', None),
+    (r"(?:apple\s+)?ipad(?:\s*(?:pro|air|mini))?(?:\s*(?:\d{1,2}(?:\.\d)?|m\d|\d{1,2}(?:th)?\s*gen|wifi|wi\s*fi|cellular|5g|lte))*", 'Apple', 'Tablets', None),
+    (r"(?:apple\s+)?macbook\s*(?:air|pro)(?:\s*(?:\d{2}|m\d(?:\s*(?:pro|max))?))*", 'Apple', 'Laptops', None),
+    (r"(?:apple\s+)?watch\s*(?:series\s*\d{1,2}|ultra\s*\d?|se)(?:\s*(?:\d{2}\s*mm|gps|cellular|lte))*", 'Apple', 'Watches', None),
+    (r"(?:apple\s+)?airpods(?:\s*(?:pro|max|\d))*", 'Apple', 'Accessories', None),
+    (r"(?:samsung\s+)?(?:galaxy\s+)?tab\s*(?:s\d{1,2}|a\d{1,2})(?:\s*(?:fe|ultra|plus|\+|wifi|5g|lte))*", 'Samsung', 'Tablets', 'Galaxy'),
+    (r"(?:samsung\s+)?(?:galaxy\s+)?(?:s\d{2}(?:\s*(?:fe|ultra|plus|\+))?|z\s*(?:fold|flip)\s*\d(?:\s*fe)?|a\d{2})(?:\s*5g)?", 'Samsung', 'Phones', 'Galaxy'),
+    (r"(?:google\s+)?pixel\s*\d{1,2}a?(?:\s*(?:pro\s*xl|pro\s*fold|pro|xl))?", 'Google', 'Phones', None),
+    (r"(?:xiaomi\s+)?(?:redmi\s*note\s*\d{1,2}|redmi\s*\d{1,2}c?|poco\s*[xfm]\d)(?:\s*(?:pro\s*\+|pro|ultra|lite|5g|t))*", 'Xiaomi', 'Phones', None),
+    (r"xiaomi\s*\d{1,2}t?(?:\s*(?:pro|ultra|lite|5g))*", 'Xiaomi', 'Phones', None),
+]
+_MODEL_FAMILIES = [(re.compile(pattern, re.I), *details) for pattern, *details in _MODEL_FAMILIES]
+_MODEL_HINT = re.compile(r"\b(?:iphone|ipad|macbook|airpods|apple|watch|galaxy|samsung|tab|s\d{2}|z\s*(?:fold|flip)|pixel|redmi|poco|xiaomi)", re.I)
+_WORD_CASING = {
+    'iphone': 'iPhone', 'ipad': 'iPad', 'macbook': 'MacBook', 'airpods': 'AirPods', 'se': 'SE', 'xs': 'XS',
+    'xr': 'XR', 'x': 'X', 'fe': 'FE', 'xl': 'XL', '5g': '5G', 'lte': 'LTE', 'gps': 'GPS', 'wifi': 'WiFi',
+}
+
+
+def _take(pattern, line):
+    """أول تطابق للنمط في السطر: (التطابق، السطر بعد حذفه)، أو (None، السطر)."""
+    match = pattern.search(line)
+    if match is None:
+        return None, line
+    return match, f"{line[:match.start()]} {line[match.end():]}"
+
+
+def _model_of(rest):
+    """(الاسم الموحّد، الماركة، الفئة) إذا كان الباقي موديلاً معروفاً بالكامل، وإلا None."""
+    rest = _SPACE.sub(' ', _NOISE.sub(' ', rest)).strip()
+    for pattern, brand, category, series in _MODEL_FAMILIES:
+        if pattern.fullmatch(rest):
+            words = [_WORD_CASING.get(word.lower(), word.capitalize()) for word in rest.split()]
+            if words[0].lower() == brand.lower():
+                words = words[1:]
+            # "S24 Ultra" و "Galaxy S24 Ultra" نفس المجموعة
+            if series and words[0] != series:
+                words.insert(0, series)
+            return f"{brand} {' '.join(words)}", brand, category
+    return None
+
+
+def parse_offer_line(line, context_region=''):
+    """
+    يحلل سطر عرض واحد بالقواعد المحلية. يُرجع (grouping_name, brand, category, variant)
+    أو None إذا لم يكن السطر بصيغة معروفة بثقة (موديل معروف + سعر واحد بالضبط).
+    """
+    prices = {match.span(): match for pattern in _PRICE_PATTERNS for match in pattern.finditer(line)}
+    if len(prices) != 1:
+        return None
+    price_match = next(iter(prices.values()))
+    rest = f"{line[:price_match.start()]} {line[price_match.end():]}"
+    currency = price_match.groupdict().get('currency')
+    quantity = None
+    for pattern in _QUANTITY_PATTERNS:
+        match, rest = _take(pattern, rest)
+        if match:
+            quantity = int(match.group('quantity'))
+            break
+    storage, rest = _take(_STORAGE, rest)
+    region, rest = _take(_REGION, rest)
+    condition, rest = _take(_CONDITION, rest)
+    color, rest = _take(_COLOR, rest)
+
+    model = _model_of(rest)
+    if model is None:
+        return None
+    grouping_name, brand, category = model
+    storage = _SPACE.sub('', storage.group('storage')).upper() if storage else ''
+    color = color.group('color').title() if color else ''
+    spec_region = _REGIONS[region.group('region').lower()] if region else context_region
+    variant = {
+        "name": ' '.join(part for part in (storage, color) if part) or spec_region,
+        "quantity": quantity if quantity is not None else 0,
+        "price": float(price_match.group('price').replace(',', '')),
+        "currency": _CURRENCIES[currency.lower()] if currency else 'USD',
+        "storage": storage,
+        "color": color,
+        "condition": _CONDITIONS[condition.group('condition').lower()] if condition else 'New',
+        "spec_region": spec_region,
+    }
+    return grouping_name, brand, category, variant
+
+
+# الكلمات المسموح بها مع المنطقة في سطر العنوان، مثل "Arabic Vietnam" أو "Region: USA spec"
+_HEADER_WORDS = {'arabic', 'english', 'region', 'spec', 'specs', 'version', 'ver', 'variant'}
+
+
+def _region_header(line):
+    """
+    المنطقة إذا كان السطر عنواناً عاماً (مثل "Arabic Vietnam") وليس عرضاً، وإلا None.
+    السطر كله يجب أن يكون المنطقة (مع _HEADER_WORDS فقط)، حتى لا تُقرأ "us" في "let us know"
+    أو "me" في "contact me" كمنطقة.
+    """
+    match = _REGION.search(line)
+    if match is None or _MODEL_HINT.search(line) or re.search(r"\d", line):
+        return None
+    rest = _NOISE.sub(' ', _REGION.sub(' ', line)).lower().split()
+    if any(word not in _HEADER_WORDS for word in rest):
+        return None
+    return _REGIONS[match.group('region').lower()]
+
+
+# أسطر لا تغيّر معنى العروض حولها فتُتجاهل: فواصل (بدون حروف أو أرقام) وتحيات قصيرة معروفة
+_FILLER = re.compile(
+    r"[\W_]*(?:(?:hi|hello|hey|dear\s+(?:all|customers?|friends?)|good\s+(?:morning|afternoon|evening|day)"
+    r"|thanks?(?:\s+you)?|السلام\s+عليكم(?:\s+ورحمة\s+الله(?:\s+وبركاته)?)?|مرحبا|صباح\s+الخير|مساء\s+الخير|شكرا)"
+    r"(?:\s+(?:all|everyone|guys|friends|team))?[\W_]*)?",
+    re.I,
+)
+
+
+def _blocks(text):
+    """أسطر النص (بدون مسافات الأطراف) مقسمة إلى كتل عند الأسطر الفارغة."""
+    blocks, block = [], []
+    for raw_line in (text or '').splitlines():
+        line = raw_line.strip()
+        if line:
+            block.append(line)
+        elif block:
+            blocks.append(block)
+            block = []
+    if block:
+        blocks.append(block)
+    return blocks
+
+
+def pre_parse(text):
+    """
+    يحلل ما يمكن من النص محلياً. يُرجع (offer_groups, unparsed_text):
+    unparsed_text يحتوي فقط الأسطر التي تحتاج AI، مع سطر عنوان المنطقة الذي ينطبق عليها.
+
+    السطر الذي ليس عرضاً ولا عنواناً ولا فاصلاً/تحية معروفة (مثل "Used stock" أو "Colors: Natural, Blue")
+    قد يغيّر معنى العروض حوله، فتُرسل كتلته (الأسطر بين سطرين فارغين) كاملة إلى الـ AI.
+    والكتلة المكوّنة من هذه الأسطر وحدها تنطبق على ما بعدها، فيُرسل كل ما يليها إلى الـ AI أيضاً.
+    """
+    groups = {}
+    unparsed = []
+    header_line, region, emitted_header = None, '', None
+    notes_above = False
+    for block in _blocks(text):
+        lines = []  # (عنوان المنطقة، السطر، نتيجة التحليل المحلي أو None، هل هو ملاحظة)
+        for line in block:
+            header = _region_header(line)
+            if header:
+                header_line, region = line, header
+                continue
+            if _FILLER.fullmatch(line):
+                continue
+            parsed = parse_offer_line(line, region)
+            is_note = parsed is None and not (re.search(r"\d", line) or _MODEL_HINT.search(line))
+            lines.append((header_line, line, parsed, is_note))
+
+        whole_block = notes_above or any(is_note for *_, is_note in lines)
+        forward = []
+        for line_header, line, parsed, _ in lines:
+            if parsed is None or whole_block:
+                forward.append((line_header, line))
+                continue
+            grouping_name, brand, category, variant = parsed
+            group = groups.setdefault(grouping_name.lower(), {
+                "grouping_name": grouping_name, "brand_name": brand, "category_name": category, "variants": [],
+            })
+            group["variants"].append(variant)
+        if lines and all(is_note for *_, is_note in lines):
+            notes_above = True
+
+        if forward and unparsed:
+            # الأسطر الفارغة حدود مجموعات يستخدمها split_into_chunks
+            unparsed.append('')
+        for line_header, line in forward:
+            if line_header and line_header != emitted_header:
+                unparsed.append(line_header)
+                emitted_header = line_header
+            unparsed.append(line)
+    return list(groups.values()), '\n'.join(unparsed)
+
+
+def merge_offer_groups(*group_lists):
+    """يدمج قوائم مجموعات العروض، مع ضم متغيرات المجموعات التي لها نفس grouping_name."""
+    merged = {}
+    for offer_groups in group_lists:
+        for group in offer_groups:
+            key = (group.get('grouping_name') or '').strip().lower()
+            if key in merged:
+                merged[key]['variants'].extend(group.get('variants') or [])
+            else:
+                merged[key] = {**group, 'variants': list(group.get('variants') or [])}
+    return list(merged.values())
+
+
+def _is_error(offer_groups):
+    return isinstance(offer_groups, list) and bool(offer_groups) and isinstance(offer_groups[0], dict) and 'error' in offer_groups[0]
+
+
+def _split_block(lines, max_lines):
+    """يقسم كتلة أطول من max_lines عند أسطر أسماء الموديلات (بداية مجموعة جديدة) قدر الإمكان."""
+    pieces = []
+    while len(lines) > max_lines:
+        cut = max((i for i in range(1, max_lines + 1) if _MODEL_HINT.search(lines[i])), default=max_lines)
+        pieces.append(lines[:cut])
+        lines = lines[cut:]
+    return pieces + [lines]
+
+
+def split_into_chunks(text, max_lines=None):
+    """
+    يقسم النص إلى أجزاء لا تتجاوز max_lines سطراً عند حدود المجموعات (سطر فارغ، عنوان منطقة،
+    أو سطر اسم موديل). كل جزء يبدأ بآخر عنوان منطقة قبله (مثل "Arabic Vietnam" في أول الرسالة)
+    حتى يُطبَّق على عروضه كما لو حُلّل النص كاملاً.
+    """
+    max_lines = max_lines or getattr(settings, 'PARSE_CHUNK_LINES', 40)
+    blocks = []  # (عنوان المنطقة، الأسطر)
+    header, lines = None, []
+    for raw_line in (text or '').splitlines():
+        line = raw_line.strip()
+        is_header = bool(line) and _region_header(line) is not None
+        if (not line or is_header) and lines:
+            blocks.extend((header, piece) for piece in _split_block(lines, max_lines))
+            lines = []
+        if is_header:
+            header = line
+        elif line:
+            lines.append(line)
+    if lines:
+        blocks.extend((header, piece) for piece in _split_block(lines, max_lines))
+
+    chunks = []
+    for header, lines in blocks:
+        if chunks and chunks[-1][0] == header and len(chunks[-1][1]) + len(lines) <= max_lines:
+            chunks[-1][1].extend(lines)
+        else:
+            chunks.append((header, list(lines)))
+    return ['\n'.join(([header] if header else []) + lines) for header, lines in chunks]
+
+
+def _parse_chunk(chunk):
+    """
+    parse_with_ai لجزء واحد، مع إعادة المحاولة لهذا الجزء فقط عند فشل الطلب.
+    الأخطاء الدائمة (مثل عدم ضبط مفتاح API) تُرجع فوراً بدون إعادة محاولة.
+    """
+    retries = getattr(settings, 'PARSE_CHUNK_RETRIES', 2)
+    for attempt in range(retries + 1):
+        offer_groups = parse_with_ai(chunk)
+        if not _is_error(offer_groups) or not offer_groups[0].get('retryable'):
+            break
+        if attempt < retries:
+            time.sleep(2 ** attempt)
+    return offer_groups
+
+
+def _parse_chunk_in_thread(chunk):
+    try:
+        return _parse_chunk(chunk)
+    finally:
+        # الكاش يستخدم قاعدة البيانات، واتصالات هذا الخيط لن تُستخدم بعد انتهائه
+        connections.close_all()
+
+
+def parse_with_ai_in_chunks(text):
+    """
+    مثل parse_with_ai، لكن النصوص الطويلة تُقسَّم (split_into_chunks) وتُحلَّل الأجزاء بالتوازي
+    ثم تُدمج النتائج بنفس ترتيب النص. الأجزاء الناجحة تُحفظ في الكاش، فإذا فشل جزء نهائياً
+    فإن إعادة المحاولة لاحقاً تُرسل هذا الجزء وحده.
+    """
+    chunks = split_into_chunks(text)
+    if len(chunks) <= 1:
+        return _parse_chunk(text)
+    workers = min(getattr(settings, 'PARSE_MAX_CONCURRENCY', 4), len(chunks))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='parse-chunk') as executor:
+        results = list(executor.map(_parse_chunk_in_thread, chunks))
+    for number, offer_groups in enumerate(results, start=1):
+        if _is_error(offer_groups):
+            return [{"error": f"Part {number} of {len(chunks)} failed: {offer_groups[0]['error']}"}]
+    return merge_offer_groups(*results)
+
+
+def parse_offer_text(text):
+    """
+    تحليل نص المورد: القواعد المحلية أولاً، ثم parse_with_ai للأسطر المتبقية فقط.
+    بنفس شكل نتيجة parse_with_ai (قائمة offer groups، أو [{"error": ...}] إذا فشل الـ AI).
+    """
+    offer_groups, unparsed_text = pre_parse(text)
+    if not unparsed_text:
+        return offer_groups
+    if not offer_groups:
+        # لا شيء بصيغة معروفة: النص كاملاً كما هو (ويستفيد من الكاش بنفس المفتاح القديم)
+        return parse_with_ai_in_chunks(text)
+    ai_groups = parse_with_ai_in_chunks(unparsed_text)
+    if _is_error(ai_groups):
+        return ai_groups
+    return merge_offer_groups(offer_groups, ai_groups)
+
 
 def find_best_shipping_keyword_with_ai(product_name, shipping_rates_list):
-    """Uses AI to find the best matching shipping keyword."""
+    """
+    Uses AI to find the best matching shipping keyword.
+    Returns the keyword, "" if the AI answered "None" (nothing matches), or None if there was no usable answer.
+    """
     if not shipping_rates_list: return None
     
     keywords = [rate.product_keyword_en for rate in shipping_rates_list if rate.product_keyword_en]
@@ -74,23 +443,31 @@ def find_best_shipping_keyword_with_ai(product_name, shipping_rates_list):
     Respond with ONLY the single best-matching keyword string. If no good match, respond with "None".
     """
     try:
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key: return None
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
-        response = model.generate_content(prompt)
-        best_keyword = response.text.strip()
-        return best_keyword if best_keyword in keywords else None
+        backend = get_gemini_backend()
+        if not backend.configured: return None
+        response = backend.generate(prompt)
+        return _match_shipping_answer(response.text, keywords)
     except Exception as e:
         print(f"AI Shipping search failed: {e}")
         return None
 
+def _match_shipping_answer(answer, keywords):
+    """
+    يطابق جواب الـ AI مع الكلمات المفتاحية بعد حذف المسافات وعلامات التنصيص والنقطة، وبدون تمييز حالة الأحرف.
+    "None" الحرفية فقط تعني لا يوجد تطابق (""); أي جواب آخر غير معروف لا يُعتبر جواباً (None).
+    """
+    cleaned = (answer or '').strip(' \t\r\n\'"`*.').lower()
+    if cleaned == 'none':
+        return ""
+    for keyword in keywords:
+        if keyword.strip().lower() == cleaned:
+            return keyword
+    return None
+
 def parse_document_with_ai(file_content_base64, mime_type):
     """Analyzes an image or PDF file content (a shipping price list)."""
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key: return {"error": "Google API key is not configured."}
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
+    backend = get_gemini_backend()
+    if not backend.configured: return {"error": "Google API key is not configured."}
     prompt = """
     You are a data extraction expert. Analyze the provided document.
     Your task is to extract the data into a structured JSON object.
@@ -104,7 +481,7 @@ def parse_document_with_ai(file_content_base64, mime_type):
     """
     image_part = {"mime_type": mime_type, "data": file_content_base64}
     try:
-        response = model.generate_content([prompt, image_part])
+        response = backend.generate([prompt, image_part])
         json_text = response.text.strip().replace('```json', '').replace('```', '')
         parsed_json = json.loads(json_text)
         return parsed_json.get("shipping_rates", [])
@@ -0,0 +1,162 @@
+# management/price_store.py
+"""
+جدول الأسعار المُجسَّد (SubscriberOfferPrice).
+
+- refresh_offer_prices: يحسب أسعار مجموعة عروض لمجموعة مشتركين ويحفظها (upsert).
+- get_price_matrix: يقرأ الأسعار المحفوظة، ويحسب الناقص منها فقط.
+- دوال on_*_changed: تعيد حساب الصفوف المتأثرة فقط عند تغيّر البيانات التي يعتمد عليها السعر.
+"""
+from django.db.models import Q
+
+from .engine import PriceBreakdown, PricingEngine
+from .models import CurrencyRate, Offer, Subscriber, SubscriberOfferPrice
+from .rates import CurrencyRateTable
+
+BATCH_SIZE = 1000
+
+
+def _row_from_breakdown(subscriber, offer, breakdown):
+    return SubscriberOfferPrice(
+        subscriber_id=subscriber.pk,
+        offer_id=offer.pk,
+        device_fee_id=breakdown.fee_id,
+        price=None if breakdown.error else breakdown.final,
+        currency=breakdown.currency or '',
+        no_charge=breakdown.no_charge,
+        error=breakdown.error or '',
+    )
+
+
+def to_breakdown(row):
+    """يحوّل صفاً محفوظاً إلى PriceBreakdown (بدون التفاصيل الوسيطة)."""
+    if row.error:
+        return PriceBreakdown(error=row.error)
+    if row.no_charge:
+        return PriceBreakdown(row.currency, no_charge=True)
+    return PriceBreakdown(row.currency, fee_id=row.device_fee_id, subtotal=row.price)
+
+
+def store_price_matrix(offers, subscribers, matrix, pairs=None):
+    """يحفظ مصفوفة calculate_batch (كلها، أو الأزواج (subscriber_id, offer_id) المحددة فقط)."""
+    rows = [
+        _row_from_breakdown(subscriber, offer, breakdown)
+        for subscriber, price_row in zip(subscribers, matrix)
+        for offer, breakdown in zip(offers, price_row)
+        if pairs is None or (subscriber.pk, offer.pk) in pairs
+    ]
+    SubscriberOfferPrice.objects.bulk_create(
+        rows,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['subscriber', 'offer'],
+        update_fields=['device_fee', 'price', 'currency', 'no_charge', 'error', 'updated_at'],
+    )
+
+
+def refresh_offer_prices(offers, subscribers=None):
+    """يحسب ويحفظ أسعار العروض (للمشتركين النشطين افتراضياً) ويُرجع المصفوفة المحسوبة."""
+    offers = list(offers)
+    if subscribers is None:
+        subscribers = Subscriber.objects.filter(is_active=True).prefetch_related('device_fees')
+    subscribers = list(subscribers)
+    matrix = PricingEngine.calculate_batch(offers, subscribers)
+    store_price_matrix(offers, subscribers, matrix)
+    return matrix
+
+
+def get_price_matrix(offers, subscribers):
+    """
+    قراءة الأسعار المحفوظة كمصفوفة matrix[i][j] مثل calculate_batch.
+    المشتركون الذين تنقصهم بعض الأسعار فقط يُعاد حسابهم وحفظهم.
+    """
+    offers = list(offers)
+    subscribers = list(subscribers)
+    stored = {
+        (row.subscriber_id, row.offer_id): to_breakdown(row)
+        for row in SubscriberOfferPrice.objects.filter(
+            offer_id__in=[offer.pk for offer in offers],
+            subscriber_id__in=[subscriber.pk for subscriber in subscribers],
+        )
+    }
+    incomplete = [s for s in subscribers if any((s.pk, o.pk) not in stored for o in offers)]
+    if incomplete:
+        for subscriber, price_row in zip(incomplete, refresh_offer_prices(offers, incomplete)):
+            for offer, breakdown in zip(offers, price_row):
+                stored[(subscriber.pk, offer.pk)] = breakdown
+    return [[stored[(s.pk, o.pk)] for o in offers] for s in subscribers]
+
+
+def recompute_rows(queryset):
+    """يعيد حساب الصفوف المحددة فقط (queryset من SubscriberOfferPrice)."""
+    pairs = set(queryset.values_list('subscriber_id', 'offer_id'))
+    if not pairs:
+        return 0
+    subscribers = list(Subscriber.objects.filter(pk__in={s for s, _ in pairs}).prefetch_related('device_fees'))
+    offers = list(Offer.objects.filter(pk__in={o for _, o in pairs}))
+    store_price_matrix(offers, subscribers, PricingEngine.calculate_batch(offers, subscribers), pairs)
+    return len(pairs)
+
+
+def _currency_q(field, currencies):
+    q = Q()
+    for currency in currencies:
+        q |= Q(**{f"{field}__iexact": currency})
+    return q
+
+
+def on_currency_rates_changed(old_table, new_table):
+    """
+    يقارن مصفوفتي التحويل القديمة والجديدة، ويعيد حساب الصفوف التي تستخدم زوجاً تغيّر معامله فقط:
+    (عملة العرض أو عملة الشحن أو عملة رسم المشترك) -> عملة المشترك.
+    """
+    currencies = set(new_table.index) | set(old_table.index)
+    changed_from, changed_to = set(), set()
+    for from_currency in currencies:
+        for to_currency in currencies:
+            if from_currency == to_currency:
+                continue
+            if old_table.get_rate(from_currency, to_currency) != new_table.get_rate(from_currency, to_currency):
+                changed_from.add(from_currency)
+                changed_to.add(to_currency)
+    if not changed_from:
+        return 0
+    return recompute_rows(
+        SubscriberOfferPrice.objects.filter(_currency_q('subscriber__target_currency', changed_to)).filter(
+            _currency_q('offer__currency', changed_from)
+            | _currency_q('offer__shipping_currency', changed_from)
+            | _currency_q('subscriber__device_fees__currency', changed_from)
+        )
+    )
+
+
+def on_currency_rate_changed(rate_id, previous):
+    """
+    تعديل/إضافة/حذف سعر تحويل واحد (rate_id) بعد تثبيته. previous هي قيمته قبل التعديل
+    (from_currency, to_currency, rate)، أو None إذا كان جديداً.
+    المصفوفة القديمة تُبنى من الجدول الحالي مع إرجاع هذا الصف لقيمته السابقة، فالمقارنة
+    لا تعتمد على ما هو محمّل في كاش العملية.
+    """
+    rows = {pk: (from_currency, to_currency, rate) for pk, from_currency, to_currency, rate in (
+        CurrencyRate.objects.order_by('pk').values_list('pk', 'from_currency', 'to_currency', 'rate')
+    )}
+    old_rows = dict(rows)
+    old_rows.pop(rate_id, None)
+    if previous is not None:
+        old_rows[rate_id] = previous
+    old_table = CurrencyRateTable.build(row for _, row in sorted(old_rows.items()))
+    new_table = CurrencyRateTable.build(rows.values())
+    return on_currency_rates_changed(old_table, new_table)
+
+
+def on_device_fee_changed(subscriber_id, fee_id, device_keyword):
+    """الصفوف التي كانت تستخدم هذا الرسم، أو التي يحتوي اسم عرضها على كلمته المفتاحية."""
+    return recompute_rows(
+        SubscriberOfferPrice.objects.filter(subscriber_id=subscriber_id).filter(
+            Q(device_fee_id=fee_id) | Q(offer__name__icontains=device_keyword)
+        )
+    )
+
+
+def on_subscriber_pricing_changed(subscriber_id):
+    """تغيّرت عملة المشترك أو نوعه: كل صفوفه متأثرة."""
+    return recompute_rows(SubscriberOfferPrice.objects.filter(subscriber_id=subscriber_id))
@@ -0,0 +1,73 @@
+# management/rates.py
+"""
+مصفوفة أسعار التحويل المحسوبة مسبقاً لكل أزواج العملات.
+تُبنى من CurrencyRate مرة واحدة لكل عملية، وتُبطَل عبر الإشارات عند أي تعديل.
+"""
+from collections import deque
+from decimal import Decimal
+
+from .caching import ProcessCache
+from .models import CurrencyRate
+
+
+class CurrencyRateTable:
+    """
+    لقطة ثابتة لكل أسعار التحويل على شكل مصفوفة: matrix[index[FROM]][index[TO]].
+
+    الزوج المباشر له الأولوية ثم معكوسه، وإذا لم يوجد أي منهما نستخدم أقصر
+    مسار عبر عملات وسيطة (مثلاً USD -> AED -> SAR) ونضرب معاملاته.
+    """
+
+    def __init__(self, index, matrix):
+        self.index = index
+        self.matrix = matrix
+
+    @classmethod
+    def load(cls):
+        return cls.build(CurrencyRate.objects.values_list('from_currency', 'to_currency', 'rate'))
+
+    @classmethod
+    def build(cls, rows):
+        edges = {}
+        for from_currency, to_currency, rate in rows:
+            edges.setdefault((from_currency.upper(), to_currency.upper()), Decimal(rate))
+        for (from_currency, to_currency), rate in list(edges.items()):
+            if rate and (to_currency, from_currency) not in edges:
+                edges[(to_currency, from_currency)] = Decimal(1) / rate
+
+        currencies = sorted({currency for pair in edges for currency in pair})
+        index = {currency: i for i, currency in enumerate(currencies)}
+        neighbours = [[] for _ in currencies]
+        for (from_currency, to_currency), rate in sorted(edges.items()):
+            if rate:
+                neighbours[index[from_currency]].append((index[to_currency], rate))
+
+        matrix = [cls._shortest_paths(source, neighbours, len(currencies)) for source in range(len(currencies))]
+        # الأسعار المباشرة (حتى الصفرية) تبقى كما أدخلها المستخدم
+        for (from_currency, to_currency), rate in edges.items():
+            matrix[index[from_currency]][index[to_currency]] = rate
+        return cls(index, matrix)
+
+    @staticmethod
+    def _shortest_paths(source, neighbours, size):
+        """بحث بالعرض (BFS): أقل عدد من التحويلات من العملة source إلى كل عملة."""
+        row = [None] * size
+        row[source] = Decimal(1)
+        queue = deque([source])
+        while queue:
+            current = queue.popleft()
+            for target, rate in neighbours[current]:
+                if row[target] is None:
+                    row[target] = row[current] * rate
+                    queue.append(target)
+        return row
+
+    def get_rate(self, from_currency, to_currency):
+        i = self.index.get(from_currency.upper())
+        j = self.index.get(to_currency.upper())
+        if i is None or j is None:
+            return None
+        return self.matrix[i][j]
+
+
+currency_rates = ProcessCache('currency_rates', CurrencyRateTable.load)
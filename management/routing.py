@@ -0,0 +1,171 @@
+# management/routing.py
+"""
+توجيه العروض للمشتركين حسب تفضيلاتهم.
+كل ملف تفضيلات يُترجم مرة واحدة إلى مجموعات أرقام (IDs) ثابتة، ويُحفظ لكل مشترك
+حتى تتغيّر تفضيلاته (m2m_changed)، فتصبح التصفية مجرد فحص عضوية في مجموعات.
+
+الفهرس العكسي RoutingIndex يربط كل مورد/ماركة/فئة بالمشتركين المهتمين بها،
+فيُحسب مستلمو كل عرض بتقاطع بضع مجموعات بدلاً من فحص كل مشترك.
+"""
+import logging
+from collections import defaultdict
+
+from .caching import KeyedProcessCache, ProcessCache
+from .models import Preference, Subscriber
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledPreference:
+    """
+    تفضيلات مشترك على شكل مجموعات IDs ثابتة (frozenset).
+    المجموعة الفارغة تعني "الكل" كما في نموذج Preference.
+    """
+    __slots__ = ('supplier_ids', 'brand_ids', 'category_ids')
+
+    def __init__(self, supplier_ids=(), brand_ids=(), category_ids=()):
+        self.supplier_ids = frozenset(supplier_ids)
+        self.brand_ids = frozenset(brand_ids)
+        self.category_ids = frozenset(category_ids)
+
+    @classmethod
+    def from_preference(cls, preferences):
+        return cls(
+            (supplier.pk for supplier in preferences.allowed_suppliers.all()),
+            (brand.pk for brand in preferences.interested_brands.all()),
+            (category.pk for category in preferences.interested_categories.all()),
+        )
+
+    @property
+    def accepts_all(self):
+        return not (self.supplier_ids or self.brand_ids or self.category_ids)
+
+    def accepts(self, offer):
+        if self.supplier_ids and offer.supplier_id not in self.supplier_ids:
+            return False
+        if self.brand_ids and offer.brand_id not in self.brand_ids:
+            return False
+        if self.category_ids and offer.category_id not in self.category_ids:
+            return False
+        return True
+
+    def filter(self, offers):
+        if self.accepts_all:
+            return offers
+        return [offer for offer in offers if self.accepts(offer)]
+
+
+def _compile(preferences, subscriber_name):
+    if preferences is None:
+        # إذا لم يكن للمشترك ملف تفضيلات، فإنه يرى كل شيء (لا يتم تطبيق أي فلتر)
+        logger.warning("No preference profile for %s. Sending all offers.", subscriber_name)
+        return CompiledPreference()
+    return CompiledPreference.from_preference(preferences)
+
+
+def _load_by_subscriber_id(subscriber_id):
+    preferences = Preference.objects.filter(subscriber_id=subscriber_id).select_related('subscriber').first()
+    return _compile(preferences, preferences.subscriber.name if preferences else subscriber_id)
+
+
+def _preferences_of(subscriber):
+    try:
+        return subscriber.preferences
+    except Preference.DoesNotExist:
+        return None
+
+
+compiled_preferences = KeyedProcessCache('compiled_preferences', _load_by_subscriber_id)
+
+
+def get_compiled_preference(subscriber):
+    """تفضيلات المشترك المترجمة (تُبنى من البيانات المجلوبة مسبقاً prefetch إن وجدت)."""
+    return compiled_preferences.get(subscriber.pk, lambda: _compile(_preferences_of(subscriber), subscriber.name))
+
+
+class RoutingIndex:
+    """
+    فهرس عكسي: ID المورد/الماركة/الفئة -> مجموعة IDs المشتركين النشطين المهتمين به.
+    المشتركون الذين تركوا بُعداً فارغاً ("الكل") يوضعون في دلو wildcard لذلك البُعد.
+    """
+
+    DIMENSIONS = (
+        ('supplier_ids', 'supplier_id'),
+        ('brand_ids', 'brand_id'),
+        ('category_ids', 'category_id'),
+    )
+
+    def __init__(self):
+        self.buckets = {name: defaultdict(set) for name, _ in self.DIMENSIONS}
+        self.wildcards = {name: set() for name, _ in self.DIMENSIONS}
+        self.compiled = {}
+
+    @classmethod
+    def load(cls):
+        index = cls()
+        subscribers = Subscriber.objects.filter(is_active=True).prefetch_related(
+            'preferences__allowed_suppliers',
+            'preferences__interested_brands',
+            'preferences__interested_categories',
+        )
+        for subscriber in subscribers:
+            index.add(subscriber.pk, get_compiled_preference(subscriber))
+        return index
+
+    def add(self, subscriber_id, compiled):
+        self.remove(subscriber_id)
+        self.compiled[subscriber_id] = compiled
+        for name, _ in self.DIMENSIONS:
+            ids = getattr(compiled, name)
+            if not ids:
+                self.wildcards[name].add(subscriber_id)
+            for object_id in ids:
+                self.buckets[name][object_id].add(subscriber_id)
+
+    def remove(self, subscriber_id):
+        compiled = self.compiled.pop(subscriber_id, None)
+        if compiled is None:
+            return
+        for name, _ in self.DIMENSIONS:
+            self.wildcards[name].discard(subscriber_id)
+            for object_id in getattr(compiled, name):
+                self.buckets[name][object_id].discard(subscriber_id)
+
+    def recipients(self, offer):
+        """IDs المشتركين النشطين الذين يقبلون هذا العرض."""
+        result = None
+        for name, attribute in self.DIMENSIONS:
+            matching = self.buckets[name].get(getattr(offer, attribute), ())
+            candidates = self.wildcards[name].union(matching)
+            result = candidates if result is None else result & candidates
+            if not result:
+                break
+        return result
+
+    def route(self, offers):
+        """{subscriber_id: [العروض المقبولة بنفس ترتيبها]} لدفعة كاملة من العروض."""
+        routed = defaultdict(list)
+        by_key = {}
+        for offer in offers:
+            key = (offer.supplier_id, offer.brand_id, offer.category_id)
+            if key not in by_key:
+                by_key[key] = self.recipients(offer)
+            for subscriber_id in by_key[key]:
+                routed[subscriber_id].append(offer)
+        return routed
+
+
+routing_index = ProcessCache('routing_index', RoutingIndex.load)
+
+
+def refresh_routing_for(subscriber_id):
+    """تحديث تزايدي لمشترك واحد في الفهرس (بعد تغيّر تفضيلاته أو حالته)."""
+    subscriber = Subscriber.objects.filter(pk=subscriber_id, is_active=True).first()
+    compiled = get_compiled_preference(subscriber) if subscriber else None
+
+    def apply(index):
+        if compiled is None:
+            index.remove(subscriber_id)
+        else:
+            index.add(subscriber_id, compiled)
+    routing_index.update(apply)
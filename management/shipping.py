@@ -0,0 +1,81 @@
+# management/shipping.py
+"""
+مطابقة أسماء المنتجات مع قائمة أسعار الشحن.
+الكلمات المفتاحية (الإنجليزية والعربية) تُجمّع في آلة مطابقة واحدة محفوظة لكل عملية،
+وتُبطَل عند تعديل أي ShippingRate.
+
+عندما لا توجد كلمة مفتاحية في الاسم يُسأل الذكاء الاصطناعي مرة واحدة فقط لكل منتج:
+الجواب يُحفظ في ShippingKeywordAlias (ومعه في نفس الكاش)، ويُستخدم قبل أي طلب AI لاحق.
+"""
+from django.db import transaction
+
+from .caching import ProcessCache
+from .matching import KeywordMatcher
+from .models import ShippingKeywordAlias, ShippingRate
+from .parser import find_best_shipping_keyword_with_ai
+
+
+def normalize_product_name(product_name):
+    return ' '.join((product_name or '').lower().split())
+
+
+class ShippingIndex:
+    """لقطة من كل أسعار الشحن مع آلة مطابقة لكلماتها المفتاحية، وأجوبة الـ AI المحفوظة لكل منتج."""
+
+    def __init__(self, rates, aliases=()):
+        self.rates = rates
+        self.matcher = KeywordMatcher(
+            (keyword, rate)
+            for rate in rates
+            for keyword in (rate.product_keyword_en, rate.product_keyword_ar)
+            if keyword
+        )
+        self.by_keyword_en = {rate.product_keyword_en: rate for rate in rates if rate.product_keyword_en}
+        by_id = {rate.pk: rate for rate in rates}
+        # الاسم الموحّد -> ShippingRate (أو None: الـ AI لم يجد تطابقاً)
+        self.aliases = {name: by_id.get(rate_id) for name, rate_id in aliases}
+
+    @classmethod
+    def load(cls):
+        return cls(list(ShippingRate.objects.all()), ShippingKeywordAlias.objects.values_list('name', 'shipping_rate_id'))
+
+    def find(self, product_name):
+        """
+        أطول كلمة مفتاحية (إنجليزية أو عربية) موجودة في اسم المنتج، ثم جواب AI محفوظ لنفس المنتج،
+        ثم الذكاء الاصطناعي كحل أخير (ويُحفظ جوابه).
+        """
+        if not product_name:
+            return None
+        rate = self.matcher.longest(product_name)
+        if rate is not None:
+            return rate
+        name = normalize_product_name(product_name)
+        if name in self.aliases:
+            return self.aliases[name]
+        best_keyword = find_best_shipping_keyword_with_ai(product_name, self.rates)
+        if best_keyword is None:
+            # لا يوجد جواب صالح (خطأ، جواب غير معروف، أو لا توجد كلمات مفتاحية): لا نحفظ شيئاً ونحاول في المرة القادمة
+            return None
+        rate = self.by_keyword_en.get(best_keyword)
+        remember_alias(name, rate)
+        return rate
+
+
+def remember_alias(name, rate):
+    """يحفظ جواب الـ AI لاسم المنتج (أول جواب يبقى إذا سبقتنا عملية أخرى)."""
+    ShippingKeywordAlias.objects.bulk_create([ShippingKeywordAlias(name=name, shipping_rate=rate)], ignore_conflicts=True)
+    transaction.on_commit(lambda: shipping_index.update(lambda index: index.aliases.setdefault(name, rate)))
+
+
+shipping_index = ProcessCache('shipping_index', ShippingIndex.load)
+
+
+def apply_shipping_to_offer_groups(offer_groups):
+    """يضيف تكلفة وعملة الشحن لكل متغيّر في مجموعات العروض الناتجة عن التحليل."""
+    index = shipping_index.get()
+    for group in offer_groups:
+        best_match_rate = index.find(group.get('grouping_name', '').lower())
+        for variant in group.get('variants', []):
+            variant['shipping_cost'] = best_match_rate.cost if best_match_rate else 0.00
+            variant['shipping_currency'] = best_match_rate.currency if best_match_rate else 'N/A'
+    return offer_groups
@@ -0,0 +1,159 @@
+# management/signals.py
+"""
+إشارات إبطال الكاشات المحلية عند تعديل البيانات التي تعتمد عليها.
+الإبطال يتم بعد نجاح المعاملة (on_commit) حتى لا تُحمَّل بيانات قد يتم التراجع عنها.
+"""
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .dimensions import brand_index, category_index
+from .fees import device_fee_matchers
+from .jobs import run_in_background
+from . import price_store
+from .models import (
+    Brand, Category, CurrencyRate, Preference, ShippingKeywordAlias, ShippingRate, Subscriber, SubscriberDeviceFee, Supplier,
+)
+from .rates import currency_rates
+from .routing import compiled_preferences, refresh_routing_for, routing_index
+from .shipping import shipping_index
+
+
+@receiver(pre_save, sender=CurrencyRate)
+def remember_currency_rate(sender, instance, **kwargs):
+    # نحفظ قيمة السعر قبل التعديل لإعادة حساب الأسعار المتأثرة به فقط
+    instance._previous_rate = None
+    if instance.pk:
+        instance._previous_rate = (
+            CurrencyRate.objects.filter(pk=instance.pk).values_list('from_currency', 'to_currency', 'rate').first()
+        )
+
+
+@receiver(post_save, sender=CurrencyRate)
+def currency_rate_saved(sender, instance, **kwargs):
+    _currency_rate_changed(instance.pk, getattr(instance, '_previous_rate', None))
+
+
+@receiver(post_delete, sender=CurrencyRate)
+def currency_rate_deleted(sender, instance, **kwargs):
+    _currency_rate_changed(instance.pk, (instance.from_currency, instance.to_currency, instance.rate))
+
+
+def _currency_rate_changed(rate_id, previous):
+    def rates_changed():
+        currency_rates.invalidate()
+        # إعادة الحساب قد تمس آلاف الصفوف، فلا تُنفَّذ داخل طلب تعديل السعر
+        run_in_background(price_store.on_currency_rate_changed, rate_id, previous)
+    transaction.on_commit(rates_changed)
+
+
+@receiver([post_save, post_delete], sender=SubscriberDeviceFee)
+def invalidate_device_fee_matcher(sender, instance, **kwargs):
+    # نلتقط القيم الآن: بعد الحذف يصبح instance.pk = None
+    subscriber_id, fee_id, keyword = instance.subscriber_id, instance.pk, instance.device_keyword
+
+    def fee_changed():
+        device_fee_matchers.invalidate(subscriber_id)
+        run_in_background(price_store.on_device_fee_changed, subscriber_id, fee_id, keyword)
+    transaction.on_commit(fee_changed)
+
+
+@receiver([post_save, post_delete], sender=ShippingRate)
+def invalidate_shipping_index(sender, **kwargs):
+    transaction.on_commit(shipping_index.invalidate)
+
+
+@receiver(pre_save, sender=ShippingRate)
+def remember_shipping_keyword(sender, instance, **kwargs):
+    instance._previous_keyword_en = None
+    if instance.pk:
+        instance._previous_keyword_en = (
+            ShippingRate.objects.filter(pk=instance.pk).values_list('product_keyword_en', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=ShippingRate)
+def invalidate_shipping_aliases(sender, instance, created, **kwargs):
+    """
+    أجوبة الـ AI المحفوظة مبنية على الكلمات المفتاحية الإنجليزية: إذا تغيّرت كلمة سعر ما تُحذف الأجوبة
+    التي تشير إليه، وإذا أُضيف سعر جديد أو تغيّرت كلمة تُحذف أجوبة "لا يوجد تطابق" (قد يوجد الآن).
+    تعديل التكلفة أو العملة لا يمس الأجوبة لأنها تشير إلى نفس الصف. الحذف يحذف أجوبته (CASCADE).
+    """
+    keyword_changed = not created and getattr(instance, '_previous_keyword_en', None) != instance.product_keyword_en
+    if keyword_changed:
+        ShippingKeywordAlias.objects.filter(shipping_rate=instance).delete()
+    if created or keyword_changed:
+        ShippingKeywordAlias.objects.filter(shipping_rate__isnull=True).delete()
+
+
+@receiver(pre_save, sender=Subscriber)
+def remember_subscriber_pricing_state(sender, instance, **kwargs):
+    # نحفظ العملة والنوع قبل التعديل لمعرفة هل تغيّرت أسعار هذا المشترك
+    instance._previous_pricing_state = None
+    if instance.pk:
+        instance._previous_pricing_state = (
+            Subscriber.objects.filter(pk=instance.pk).values_list('target_currency', 'subscriber_type').first()
+        )
+
+
+@receiver(post_save, sender=Subscriber)
+def refresh_subscriber_prices(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_pricing_state', None)
+    if not created and previous and previous != (instance.target_currency, instance.subscriber_type):
+        subscriber_id = instance.pk
+        transaction.on_commit(lambda: run_in_background(price_store.on_subscriber_pricing_changed, subscriber_id))
+
+
+def _subscriber_preferences_changed(subscriber_id):
+    compiled_preferences.invalidate(subscriber_id)
+    refresh_routing_for(subscriber_id)
+
+
+def _all_preferences_changed():
+    compiled_preferences.invalidate()
+    routing_index.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Preference)
+def preference_changed(sender, instance, **kwargs):
+    subscriber_id = instance.subscriber_id
+    transaction.on_commit(lambda: _subscriber_preferences_changed(subscriber_id))
+
+
+@receiver(m2m_changed, sender=Preference.allowed_suppliers.through)
+@receiver(m2m_changed, sender=Preference.interested_brands.through)
+@receiver(m2m_changed, sender=Preference.interested_categories.through)
+def preference_filters_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # التعديل تم من جهة المورد/الماركة/الفئة: قد يمس عدة مشتركين
+        transaction.on_commit(_all_preferences_changed)
+    else:
+        subscriber_id = instance.subscriber_id
+        transaction.on_commit(lambda: _subscriber_preferences_changed(subscriber_id))
+
+
+@receiver(post_delete, sender=Supplier)
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Category)
+def dimension_deleted(sender, **kwargs):
+    # الحذف يُزيل صفوف الربط (M2M) بدون إرسال m2m_changed
+    transaction.on_commit(_all_preferences_changed)
+
+
+@receiver([post_save, post_delete], sender=Brand)
+def invalidate_brand_index(sender, **kwargs):
+    transaction.on_commit(brand_index.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_index(sender, **kwargs):
+    transaction.on_commit(category_index.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Subscriber)
+def subscriber_routing_changed(sender, instance, **kwargs):
+    # إضافة/إزالة المشترك من فهرس التوجيه حسب حالته (is_active)
+    subscriber_id = instance.pk
+    transaction.on_commit(lambda: refresh_routing_for(subscriber_id))
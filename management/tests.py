@@ -1,3 +1,839 @@
-from django.test import TestCase
+import json
+import random
+import re
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import digest, outbox, price_store, signals
+from .caching import KeyedProcessCache, ProcessCache
+from .codes import CodeAllocator
+from .engine import NotificationEngine, OfferFragment, PriceBreakdown, PricingEngine
+from .fees import device_fee_matchers
+from .matching import KeywordMatcher
+from .parse_cache import ParseCache, parse_cache
+from .models import (
+    Brand, Category, CodeSequence, CurrencyRate, NotificationOutbox, Offer, ParsedOfferCache, PendingDigestOffer, Preference, ShippingKeywordAlias, ShippingRate, Subscriber, SubscriberDeviceFee, SubscriberOfferPrice, Supplier,
+)
+from . import parser, shipping
+from .parser import parse_offer_line, pre_parse, split_into_chunks
+from .rates import CurrencyRateTable, currency_rates
+from .routing import RoutingIndex, compiled_preferences, routing_index
+from .ultramsg import SendResult, UltraMsgClient
+
+
+class CurrencyRateRepricingTests(TestCase):
+    def setUp(self):
+        self.usd_sar = CurrencyRate.objects.create(from_currency='USD', to_currency='SAR', rate=Decimal('3.75'))
+        self.eur_gbp = CurrencyRate.objects.create(from_currency='EUR', to_currency='GBP', rate=Decimal('0.85'))
+        currency_rates.invalidate()
+        supplier = Supplier.objects.create(name="Supplier")
+        self.offers = [Offer.objects.create(supplier=supplier, name=f"Phone {i}", price=100, currency='USD') for i in range(3)]
+        self.subscribers = [
+            Subscriber.objects.create(name=f"Subscriber {i}", whatsapp_number=f"50000{i}", target_currency='SAR')
+            for i in range(2)
+        ]
+        price_store.refresh_offer_prices(self.offers, self.subscribers)
+
+    def tearDown(self):
+        # الكاشات المحلية لا تعلم بتراجع معاملة الاختبار
+        currency_rates.invalidate()
+        device_fee_matchers.invalidate()
+
+    def _edit(self, rate, value):
+        previous = (rate.from_currency, rate.to_currency, rate.rate)
+        rate.rate = Decimal(value)
+        rate.save()
+        currency_rates.invalidate()
+        return price_store.on_currency_rate_changed(rate.pk, previous)
+
+    def test_unrelated_pair_recomputes_nothing(self):
+        self.assertEqual(self._edit(self.eur_gbp, '0.9'), 0)
+
+    def test_used_pair_recomputes_its_rows(self):
+        self.assertEqual(self._edit(self.usd_sar, '3.8'), 6)
+        self.assertEqual(set(SubscriberOfferPrice.objects.values_list('price', flat=True)), {Decimal('380.00')})
+
+    def test_deleted_pair_recomputes_its_rows(self):
+        previous = (self.usd_sar.from_currency, self.usd_sar.to_currency, self.usd_sar.rate)
+        rate_id = self.usd_sar.pk
+        self.usd_sar.delete()
+        currency_rates.invalidate()
+        self.assertEqual(price_store.on_currency_rate_changed(rate_id, previous), 6)
+
+    def test_repricing_runs_in_background_after_commit(self):
+        with mock.patch.object(signals, 'run_in_background') as run_in_background:
+            with self.captureOnCommitCallbacks(execute=True):
+                fee = SubscriberDeviceFee.objects.create(
+                    subscriber=self.subscribers[0], device_keyword='Phone', fee=10, currency='SAR',
+                )
+                subscriber = self.subscribers[1]
+                subscriber.target_currency = 'USD'
+                subscriber.save()
+                self.assertFalse(run_in_background.called)
+        run_in_background.assert_has_calls([
+            mock.call(price_store.on_device_fee_changed, self.subscribers[0].pk, fee.pk, 'Phone'),
+            mock.call(price_store.on_subscriber_pricing_changed, subscriber.pk),
+        ], any_order=True)
+
+        # نفس المهام، منفّذة مباشرة
+        self.assertEqual(price_store.on_device_fee_changed(self.subscribers[0].pk, fee.pk, 'Phone'), 3)
+        self.assertEqual(price_store.on_subscriber_pricing_changed(subscriber.pk), 3)
+        self.assertEqual(
+            set(SubscriberOfferPrice.objects.filter(subscriber=subscriber).values_list('price', flat=True)), {Decimal('100.00')}
+        )
+
+
+class OfferPreParserTests(SimpleTestCase):
+    def test_sample_formats(self):
+        cases = {
+            "S24 Ultra 256GB Black 50pcs $820": (
+                "Samsung Galaxy S24 Ultra", "Samsung", "Phones",
+                {"name": "256GB Black", "quantity": 50, "price": 820.0, "currency": "USD", "storage": "256GB", "color": "Black"},
+            ),
+            "iPhone 15 Pro Max 256GB Natural Titanium x10 @1,050": (
+                "Apple iPhone 15 Pro Max", "Apple", "Phones",
+                {"name": "256GB Natural Titanium", "quantity": 10, "price": 1050.0, "currency": "USD"},
+            ),
+            "iphone 15 pro max 512gb blue titanium 5 pcs 1250 aed Japan spec": (
+                "Apple iPhone 15 Pro Max", "Apple", "Phones",
+                {"storage": "512GB", "quantity": 5, "price": 1250.0, "currency": "AED", "spec_region": "Japan"},
+            ),
+            "Redmi Note 13 Pro 8/256GB Black 100pcs 190$": (
+                "Xiaomi Redmi Note 13 Pro", "Xiaomi", "Phones", {"storage": "8/256GB", "quantity": 100, "price": 190.0},
+            ),
+            "AirPods Pro 2 200pcs $175": ("Apple AirPods Pro 2", "Apple", "Accessories", {"quantity": 200, "condition": "New"}),
+        }
+        for line, (grouping_name, brand, category, expected) in cases.items():
+            with self.subTest(line=line):
+                parsed = parse_offer_line(line)
+                self.assertIsNotNone(parsed)
+                self.assertEqual(parsed[:3], (grouping_name, brand, category))
+                self.assertEqual({key: parsed[3][key] for key in expected}, expected)
+
+    def test_unconfident_lines_are_not_parsed(self):
+        for line in ["S24 Ultra 256GB $820 / $850 for 512GB", "Some weird item 30 pcs $10", "S24 Ultra 256GB Black 50pcs"]:
+            with self.subTest(line=line):
+                self.assertIsNone(parse_offer_line(line))
+
+    def test_region_header_applies_to_following_offers(self):
+        groups, unparsed = pre_parse("Arabic Vietnam\nS24 Ultra 256GB Black 50pcs $820\n\nUSA spec\nS24 Ultra 512GB Black 5pcs $900")
+        self.assertEqual(unparsed, '')
+        self.assertEqual([v['spec_region'] for v in groups[0]['variants']], ['Vietnam', 'USA'])
+
+    def test_greeting_lines_are_not_region_headers(self):
+        for greeting in ["Good morning, please let us know your orders", "Contact me for more", "Dear customers, text me", "HK stock arriving, ask us"]:
+            with self.subTest(greeting=greeting):
+                self.assertIsNone(parser._region_header(greeting))
+                # ليست تحية معروفة، فتذهب مع عروض كتلتها إلى الـ AI بدلاً من تطبيق منطقة منها
+                text = f"{greeting}\nS24 Ultra 256GB Black 50pcs $820"
+                self.assertEqual(pre_parse(text), ([], text))
+
+    def test_known_greetings_and_separators_are_dropped(self):
+        for line in ["Good morning", "Hello all!", "السلام عليكم ورحمة الله", "------------", "🔥🔥🔥", "Thank you"]:
+            with self.subTest(line=line):
+                groups, unparsed = pre_parse(f"{line}\nS24 Ultra 256GB Black 50pcs $820\n{line}")
+                self.assertEqual(len(groups[0]['variants']), 1)
+                self.assertEqual(unparsed, '')
+
+    def test_context_lines_send_their_block_to_ai(self):
+        for note in ["Used stock", "Colors: Natural, Blue"]:
+            with self.subTest(note=note):
+                text = (
+                    "Arabic Vietnam\n"
+                    f"iPhone 15 Pro Max 256GB 10pcs $1,050\n{note}\niPhone 15 Pro 128GB 5pcs $900\n\n"
+                    "USA spec\nS24 Ultra 256GB Black 50pcs $820"
+                )
+                groups, unparsed = pre_parse(text)
+                # الكتلة الأخرى لا تتأثر بالملاحظة وتُحلل محلياً
+                self.assertEqual([group['grouping_name'] for group in groups], ["Samsung Galaxy S24 Ultra"])
+                self.assertEqual(groups[0]['variants'][0]['spec_region'], 'USA')
+                self.assertEqual(
+                    unparsed, f"Arabic Vietnam\niPhone 15 Pro Max 256GB 10pcs $1,050\n{note}\niPhone 15 Pro 128GB 5pcs $900",
+                )
+
+    def test_note_block_applies_to_what_follows(self):
+        later = "Used stock\n\nS24 Ultra 512GB Black 5pcs $900\n\nS24 Ultra 1TB Black 2pcs $1,100"
+        groups, unparsed = pre_parse(f"S24 Ultra 256GB Black 50pcs $820\n\n{later}")
+        self.assertEqual([variant['storage'] for variant in groups[0]['variants']], ['256GB'])
+        self.assertEqual(unparsed, later)
+
+
+class ChunkedParsingTests(SimpleTestCase):
+    def _message(self, first_line):
+        lines = [first_line, '']
+        for group in range(6):
+            lines.append(f"Phone Model {group}")
+            lines.extend(f"variant {variant} call for price {variant}" for variant in range(9))
+            lines.append('')
+        return '\n'.join(lines)
+
+    def test_region_header_is_carried_into_every_chunk(self):
+        chunks = split_into_chunks(self._message("Arabic Vietnam"), max_lines=20)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertEqual(chunk.splitlines()[0], "Arabic Vietnam")
+            self.assertLessEqual(len(chunk.splitlines()), 21)
+
+    def test_greeting_is_not_carried_into_chunks(self):
+        chunks = split_into_chunks(self._message("Dear customers, text me"), max_lines=20)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(sum("Dear customers" in chunk for chunk in chunks), 1)
+
+    @mock.patch.object(parser.time, 'sleep')
+    def test_only_request_failures_are_retried(self, sleep):
+        with mock.patch.object(parser, 'parse_with_ai', return_value=[{"error": "Google API key is not configured."}]) as parse:
+            parser._parse_chunk("S24")
+        self.assertEqual(parse.call_count, 1)
+        with mock.patch.object(parser, 'parse_with_ai', return_value=[{"error": "timeout", "retryable": True}]) as parse:
+            parser._parse_chunk("S24")
+        self.assertEqual(parse.call_count, 3)
+
+
+class ShippingKeywordAliasTests(TestCase):
+    def setUp(self):
+        self.tablet = ShippingRate.objects.create(product_keyword_en='Tablet', cost=Decimal('30'), currency='AED')
+        shipping.shipping_index.invalidate()
+
+    def tearDown(self):
+        shipping.shipping_index.invalidate()
+
+    def test_answer_matching(self):
+        keywords = ['Tablet', 'Laptop']
+        for answer, expected in [
+            ('Tablet', 'Tablet'), ('"tablet"', 'Tablet'), (' Tablet.\n', 'Tablet'), ('`LAPTOP`', 'Laptop'),
+            ('None', ''), ('"none".', ''), ('Phone', None), ('I think Tablet', None), ('', None),
+        ]:
+            with self.subTest(answer=answer):
+                self.assertEqual(parser._match_shipping_answer(answer, keywords), expected)
+
+    def _find(self, name, answer):
+        with mock.patch.object(shipping, 'find_best_shipping_keyword_with_ai', return_value=answer) as ask, \
+                self.captureOnCommitCallbacks(execute=True):
+            rate = shipping.shipping_index.get().find(name)
+        return rate, ask.call_count
+
+    def test_answers_are_remembered(self):
+        self.assertEqual(self._find('apple ipad air', 'Tablet'), (self.tablet, 1))
+        self.assertEqual(self._find('Apple  iPad Air', 'Tablet'), (self.tablet, 0))
+        self.assertEqual(self._find('weird gadget', ''), (None, 1))
+        self.assertEqual(self._find('weird gadget', ''), (None, 0))
+
+    def test_missing_answers_are_not_remembered(self):
+        self.assertEqual(self._find('weird gadget', None), (None, 1))
+        self.assertEqual(self._find('weird gadget', None), (None, 1))
+        self.assertFalse(ShippingKeywordAlias.objects.exists())
+
+
+class BatchPricingTests(TestCase):
+    def setUp(self):
+        for from_currency, to_currency, rate in [('USD', 'SAR', '3.75'), ('AED', 'SAR', '1.02'), ('USD', 'AED', '3.6725')]:
+            CurrencyRate.objects.create(from_currency=from_currency, to_currency=to_currency, rate=Decimal(rate))
+        currency_rates.invalidate()
+        supplier = Supplier.objects.create(name="Supplier")
+        self.offers = [
+            Offer.objects.create(supplier=supplier, name="iPhone 15 Pro Max 256GB", price=Decimal('1000'), currency='USD',
+                                 shipping_cost=Decimal('25'), shipping_currency='AED'),
+            Offer.objects.create(supplier=supplier, name="iPhone 15 128GB", price=Decimal('700.50'), currency='usd'),
+            Offer.objects.create(supplier=supplier, name="Galaxy S24", price=Decimal('0'), currency='USD'),
+            Offer.objects.create(supplier=supplier, name="Pixel 9", price=Decimal('500'), currency='EUR'),
+            Offer.objects.create(supplier=supplier, name="iPad Air", price=Decimal('600'), currency='USD',
+                                 shipping_cost=Decimal('10'), shipping_currency='GBP'),
+        ]
+        external = Subscriber.objects.create(name="External", whatsapp_number="1", target_currency='SAR')
+        SubscriberDeviceFee.objects.create(subscriber=external, device_keyword='iPhone 15', fee=Decimal('20'), currency='AED')
+        SubscriberDeviceFee.objects.create(subscriber=external, device_keyword='iphone 15 pro max', fee=Decimal('35'), currency='AED')
+        SubscriberDeviceFee.objects.create(subscriber=external, device_keyword='iPad', fee=Decimal('5'), currency='EUR')
+        internal = Subscriber.objects.create(name="Internal", whatsapp_number="2", target_currency='SAR',
+                                             subscriber_type=Subscriber.SubscriberType.INTERNAL)
+        SubscriberDeviceFee.objects.create(subscriber=internal, device_keyword='iPhone', fee=Decimal('50'), currency='AED')
+        self.subscribers = [
+            external, internal,
+            Subscriber.objects.create(name="AED", whatsapp_number="3", target_currency='AED'),
+            Subscriber.objects.create(name="No currency", whatsapp_number="4", target_currency=''),
+        ]
+
+    def tearDown(self):
+        currency_rates.invalidate()
+
+    def test_batch_matches_per_pair_pricing(self):
+        batch = PricingEngine.calculate_batch(self.offers, self.subscribers)
+        for subscriber, row in zip(self.subscribers, batch):
+            for offer, breakdown in zip(self.offers, row):
+                with self.subTest(subscriber=subscriber.name, offer=offer.name):
+                    self.assertEqual(breakdown.as_dict(), PricingEngine.calculate_final_price(offer, subscriber).as_dict())
+
+
+class KeywordMatcherTests(SimpleTestCase):
+    @staticmethod
+    def _old_longest(entries, text):
+        """حلقة البحث القديمة (رسوم الأجهزة) التي يجب أن تطابقها KeywordMatcher."""
+        best = None
+        for keyword, value in entries:
+            if keyword.lower() in text.lower() and (best is None or len(keyword) > len(best[0])):
+                best = (keyword, value)
+        return best[1] if best else None
+
+    def test_examples(self):
+        matcher = KeywordMatcher([('iPhone 15', 'a'), ('iphone 15 pro max', 'b'), ('IPHONE 15', 'c'), ('pro', 'd')])
+        self.assertEqual(matcher.longest("Apple iPhone 15 Pro Max 256GB"), 'b')
+        self.assertEqual(matcher.longest("Apple iPhone 15 128GB"), 'a')
+        self.assertEqual(matcher.longest("MacBook Pro"), 'd')
+        self.assertIsNone(matcher.longest("Galaxy S24"))
+        self.assertIsNone(KeywordMatcher([]).longest("anything"))
+
+    def test_matches_old_loop(self):
+        rng = random.Random(4)
+        for _ in range(300):
+            entries = [(''.join(rng.choice('abAB ') for _ in range(rng.randint(0, 5))), index) for index in range(rng.randint(0, 8))]
+            matcher = KeywordMatcher(entries)
+            for _ in range(10):
+                text = ''.join(rng.choice('abcAB ') for _ in range(rng.randint(0, 20)))
+                self.assertEqual(matcher.longest(text), self._old_longest(entries, text), (entries, text))
+
+
+@override_settings(OUTBOX_BACKOFF_BASE=30, OUTBOX_BACKOFF_MAX=3600, OUTBOX_MAX_ATTEMPTS=3, OUTBOX_CLAIM_TIMEOUT=300)
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.subscribers = [
+            Subscriber.objects.create(name=f"Subscriber {i}", whatsapp_number=f"50000{i}", target_currency='SAR')
+            for i in range(4)
+        ]
+
+    def _client(self, failing=()):
+        """عميل وهمي ينجح في الإرسال لكل الأرقام ما عدا failing."""
+        client = mock.Mock()
+        client.send_many.side_effect = lambda messages, on_result=None: [
+            SendResult(number, number not in failing, 'error' if number in failing else 'ok', 0.0) for number, _ in messages
+        ]
+        return mock.patch.object(outbox, 'get_client', return_value=client)
+
+    def test_backoff_delay(self):
+        self.assertEqual(outbox.backoff_delay(0), timedelta(seconds=30))
+        self.assertEqual(outbox.backoff_delay(1), timedelta(seconds=30))
+        self.assertEqual(outbox.backoff_delay(3), timedelta(seconds=120))
+        self.assertEqual(outbox.backoff_delay(20), timedelta(seconds=3600))
+
+    def test_enqueue_is_idempotent(self):
+        messages = [(subscriber, "hello") for subscriber in self.subscribers]
+        ids = outbox.enqueue(messages, 'batch-1')
+        self.assertEqual(outbox.enqueue(messages, 'batch-1'), ids)
+        self.assertEqual(NotificationOutbox.objects.count(), 4)
+
+    def test_claim_batch_takes_due_and_stale_rows(self):
+        now = timezone.now()
+        due, future, stale, fresh = outbox.enqueue([(subscriber, "hello") for subscriber in self.subscribers], 'batch-1')
+        NotificationOutbox.objects.filter(pk=future).update(next_attempt_at=now + timedelta(minutes=5))
+        NotificationOutbox.objects.filter(pk=stale).update(status=NotificationOutbox.STATUS_SENDING, claimed_at=now - timedelta(minutes=10))
+        NotificationOutbox.objects.filter(pk=fresh).update(status=NotificationOutbox.STATUS_SENDING, claimed_at=now - timedelta(minutes=1))
+
+        claimed = outbox.claim_batch()
+        self.assertEqual(sorted(row.pk for row in claimed), sorted([due, stale]))
+        self.assertTrue(all(row.status == NotificationOutbox.STATUS_SENDING for row in claimed))
+        # الصفوف المحجوزة للتو لا تُحجز مرة ثانية
+        self.assertEqual(outbox.claim_batch(), [])
+
+    @override_settings(OUTBOX_CLAIM_TIMEOUT=0, DISTRIBUTION_WORKERS=4, ULTRAMSG_MAX_CONCURRENCY=8, ULTRAMSG_TIMEOUT=20)
+    def test_claim_timeout_outlasts_slow_batches(self):
+        # 4 دفعات × 100 رسالة على 8 إرسالات متزامنة = 50 جولة، كل جولة حتى 40 ثانية
+        self.assertEqual(outbox.claim_timeout(), timedelta(seconds=50 * 40 + outbox.CLAIM_MARGIN))
+        [row_id] = outbox.enqueue([(self.subscribers[0], "hello")], 'batch-1')
+        NotificationOutbox.objects.filter(pk=row_id).update(
+            status=NotificationOutbox.STATUS_SENDING, claimed_at=timezone.now() - timedelta(minutes=10),
+        )
+        self.assertEqual(outbox.claim_batch(), [])
+        with override_settings(OUTBOX_CLAIM_TIMEOUT=300):
+            self.assertEqual([row.pk for row in outbox.claim_batch()], [row_id])
+
+    def test_claim_batch_respects_ids_and_limit(self):
+        ids = outbox.enqueue([(subscriber, "hello") for subscriber in self.subscribers], 'batch-1')
+        self.assertEqual([row.pk for row in outbox.claim_batch(ids=ids[2:])], ids[2:])
+        self.assertEqual(len(outbox.claim_batch(limit=1)), 1)
+
+    def test_deliver_updates_status_and_backoff(self):
+        ids = outbox.enqueue([(subscriber, "hello") for subscriber in self.subscribers[:2]], 'batch-1')
+        failing = self.subscribers[1].whatsapp_number
+        with self._client(failing={failing}):
+            before = timezone.now()
+            outbox.deliver(outbox.claim_batch())
+
+        sent, retry = NotificationOutbox.objects.filter(pk__in=ids).order_by('pk')
+        self.assertEqual((sent.status, sent.attempts, sent.last_error), (NotificationOutbox.STATUS_SENT, 1, ''))
+        self.assertIsNotNone(sent.sent_at)
+        self.assertEqual((retry.status, retry.attempts, retry.last_error), (NotificationOutbox.STATUS_PENDING, 1, 'error'))
+        self.assertIsNone(retry.claimed_at)
+        self.assertGreaterEqual(retry.next_attempt_at, before + timedelta(seconds=30))
+        # لم يحن موعد المحاولة التالية بعد
+        self.assertEqual(outbox.claim_batch(), [])
+
+    def test_deliver_fails_permanently_after_max_attempts(self):
+        [row_id] = outbox.enqueue([(self.subscribers[0], "hello")], 'batch-1')
+        NotificationOutbox.objects.filter(pk=row_id).update(attempts=2)
+        with self._client(failing={self.subscribers[0].whatsapp_number}), self.assertLogs(outbox.logger, 'ERROR'):
+            self.assertEqual(outbox.drain(), 1)
+        row = NotificationOutbox.objects.get(pk=row_id)
+        self.assertEqual((row.status, row.attempts), (NotificationOutbox.STATUS_FAILED, 3))
+        self.assertEqual(outbox.claim_batch(), [])
+
+
+class CodeAllocatorTests(TestCase):
+    # كل اختبار يعمل داخل معاملة، فهذا هو مسار SQLite داخل معاملة الحفظ (حجز بالعدد المطلوب فقط)
+
+    def test_codes_are_sequential(self):
+        codes = CodeAllocator('test', 'T-{:03d}', block_size=50)
+        self.assertEqual(codes.allocate(3), ['T-001', 'T-002', 'T-003'])
+        self.assertEqual(codes.next(), 'T-004')
+        self.assertEqual(codes.allocate(0), [])
+
+    def test_reserves_exactly_what_is_needed_inside_transaction(self):
+        codes = CodeAllocator('test', 'T-{:03d}', block_size=50)
+        codes.allocate(3)
+        self.assertEqual(CodeSequence.objects.get(name='test').next_value, 4)
+        codes.next()
+        self.assertEqual(CodeSequence.objects.get(name='test').next_value, 5)
+
+    def test_rolled_back_allocation_is_reused(self):
+        codes = CodeAllocator('test', 'T-{:03d}', block_size=50)
+        first = codes.allocate(2)
+        try:
+            with transaction.atomic():
+                codes.allocate(5)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(CodeSequence.objects.get(name='test').next_value, 3)
+        after = codes.allocate(2)
+        self.assertEqual(after, ['T-003', 'T-004'])
+        self.assertFalse(set(first) & set(after))
+
+    def test_allocators_share_the_counter(self):
+        first, second = CodeAllocator('test', 'T-{:03d}'), CodeAllocator('test', 'T-{:03d}')
+        codes = first.allocate(2) + second.allocate(2) + first.allocate(1)
+        self.assertEqual(len(set(codes)), 5)
+
+
+@override_settings(PROCESS_CACHE_CHECK_INTERVAL=0)
+class ProcessCacheTests(SimpleTestCase):
+    """نسختان من نفس الكاش تمثّلان عمليتين (workers) تتشاركان الختم في كاش Django."""
+
+    def setUp(self):
+        self.data = {1: 'v1', 2: 'v1'}
+        self.name = f"test-{self.id()}"
+
+    def test_update_reloads_a_stale_copy(self):
+        worker_a = ProcessCache(self.name, lambda: dict(self.data))
+        worker_b = ProcessCache(self.name, lambda: dict(self.data))
+        self.assertEqual(worker_a.get(), worker_b.get())
+
+        self.data[1] = 'v2'
+        worker_a.update(lambda value: value.__setitem__(1, 'v2'))
+        # B لم يلاحظ تغيير A بعد، فلا يطبّق تحديثه على نسخته القديمة
+        self.data[2] = 'v2'
+        worker_b.update(lambda value: value.__setitem__(2, 'v2'))
+
+        self.assertEqual(worker_b.get(), {1: 'v2', 2: 'v2'})
+        self.assertEqual(worker_a.get(), {1: 'v2', 2: 'v2'})
+
+    def test_update_applies_to_a_current_copy(self):
+        loads = []
+        worker = ProcessCache(self.name, lambda: loads.append(1) or dict(self.data))
+        worker.get()
+        worker.update(lambda value: value.__setitem__(1, 'local'))
+        self.assertEqual((worker.get(), len(loads)), ({1: 'local', 2: 'v1'}, 1))
+
+    def test_keyed_invalidate_drops_keys_changed_elsewhere(self):
+        worker_a = KeyedProcessCache(self.name, self.data.get)
+        worker_b = KeyedProcessCache(self.name, self.data.get)
+        self.assertEqual((worker_a.get(1), worker_a.get(2)), ('v1', 'v1'))
+        self.assertEqual((worker_b.get(1), worker_b.get(2)), ('v1', 'v1'))
+
+        self.data[1] = 'v2'
+        worker_a.invalidate(1)
+        # العامل B يغيّر مفتاحاً آخر قبل أن يلاحظ تغيير A
+        self.data[2] = 'v2'
+        worker_b.invalidate(2)
+
+        self.assertEqual((worker_b.get(1), worker_b.get(2)), ('v2', 'v2'))
+        self.assertEqual((worker_a.get(1), worker_a.get(2)), ('v2', 'v2'))
+
+    def test_keyed_invalidate_keeps_other_keys_when_current(self):
+        worker = KeyedProcessCache(self.name, self.data.get)
+        worker.get(1)
+        self.data[1] = 'v2'
+        worker.get(2)
+        self.data[2] = 'v2'
+        worker.invalidate(2)
+        self.assertEqual((worker.get(1), worker.get(2)), ('v1', 'v2'))
+
+
+class CurrencyRateTableTests(SimpleTestCase):
+    def test_direct_and_inverse_rates(self):
+        table = CurrencyRateTable.build([('usd', 'SAR', Decimal('3.75'))])
+        self.assertEqual(table.get_rate('USD', 'sar'), Decimal('3.75'))
+        self.assertEqual(table.get_rate('SAR', 'USD'), Decimal(1) / Decimal('3.75'))
+
+    def test_two_hop_path(self):
+        table = CurrencyRateTable.build([('USD', 'AED', Decimal('3.6725')), ('AED', 'SAR', Decimal('1.02'))])
+        self.assertEqual(table.get_rate('USD', 'SAR'), Decimal('3.6725') * Decimal('1.02'))
+        self.assertEqual(table.get_rate('SAR', 'USD'), (Decimal(1) / Decimal('1.02')) * (Decimal(1) / Decimal('3.6725')))
+
+    def test_direct_rate_wins_over_longer_path(self):
+        table = CurrencyRateTable.build([
+            ('USD', 'AED', Decimal('3.6725')), ('AED', 'SAR', Decimal('1.02')), ('USD', 'SAR', Decimal('3.75')),
+        ])
+        self.assertEqual(table.get_rate('USD', 'SAR'), Decimal('3.75'))
+        # المعكوس المخزّن مباشرة يتقدّم على معكوس الزوج الآخر
+        table = CurrencyRateTable.build([('USD', 'SAR', Decimal('3.75')), ('SAR', 'USD', Decimal('0.27'))])
+        self.assertEqual(table.get_rate('SAR', 'USD'), Decimal('0.27'))
+
+    def test_zero_rates_are_not_used(self):
+        table = CurrencyRateTable.build([('USD', 'SAR', Decimal('0')), ('USD', 'AED', Decimal('3.6725'))])
+        # السعر الصفري المباشر يبقى كما أدخله المستخدم (كما في البحث القديم)، لكن بلا معكوس ولا مسارات عبره
+        self.assertEqual(table.get_rate('USD', 'SAR'), Decimal('0'))
+        self.assertIsNone(table.get_rate('SAR', 'USD'))
+        self.assertIsNone(table.get_rate('SAR', 'AED'))
+
+    def test_unreachable_pair(self):
+        table = CurrencyRateTable.build([('USD', 'SAR', Decimal('3.75')), ('EUR', 'GBP', Decimal('0.85'))])
+        self.assertIsNone(table.get_rate('USD', 'GBP'))
+        self.assertIsNone(table.get_rate('USD', 'JPY'))
+        with mock.patch.object(currency_rates, 'get', return_value=table):
+            self.assertIsNone(PricingEngine.get_conversion_rate('USD', 'GBP'))
+            self.assertEqual(PricingEngine.get_conversion_rate('usd', 'USD'), Decimal('1.0'))
+
+
+class RoutingIndexTests(TestCase):
+    def setUp(self):
+        rng = random.Random(9)
+        self.suppliers = [Supplier.objects.create(name=f"Supplier {i}") for i in range(3)]
+        self.brands = [Brand.objects.create(name=f"Brand {i}") for i in range(3)]
+        self.categories = [Category.objects.create(name=f"Category {i}") for i in range(3)]
+        self.offers = [
+            Offer.objects.create(supplier=supplier, brand=brand, category=category, name="Phone")
+            for supplier in self.suppliers for brand in self.brands + [None] for category in self.categories + [None]
+        ]
+        self.brand_only = self._subscriber("Brand only", brands=self.brands[:1])
+        self.category_only = self._subscriber("Category only", categories=self.categories[1:])
+        self.wildcard = self._subscriber("Wildcard")
+        self.no_profile = Subscriber.objects.create(name="No profile", whatsapp_number="5999", target_currency='SAR')
+        self.inactive = self._subscriber("Inactive", brands=self.brands[:1], is_active=False)
+        for i in range(15):
+            self._subscriber(
+                f"Random {i}", is_active=rng.random() > 0.2,
+                suppliers=rng.sample(self.suppliers, rng.randint(0, 2)),
+                brands=rng.sample(self.brands, rng.randint(0, 2)),
+                categories=rng.sample(self.categories, rng.randint(0, 2)),
+            )
+        compiled_preferences.invalidate()
+        routing_index.invalidate()
+
+    def tearDown(self):
+        compiled_preferences.invalidate()
+        routing_index.invalidate()
+
+    def _subscriber(self, name, suppliers=(), brands=(), categories=(), is_active=True):
+        subscriber = Subscriber.objects.create(
+            name=name, whatsapp_number=f"5{Subscriber.objects.count():04d}", target_currency='SAR', is_active=is_active,
+        )
+        preferences = Preference.objects.create(subscriber=subscriber)
+        preferences.allowed_suppliers.set(suppliers)
+        preferences.interested_brands.set(brands)
+        preferences.interested_categories.set(categories)
+        return subscriber
+
+    @staticmethod
+    def _old_filter(offers, subscriber):
+        """التصفية القديمة لكل مشترك (DistributionEngine._filter_offers_for_subscriber قبل الفهرس)."""
+        try:
+            preferences = subscriber.preferences
+        except Preference.DoesNotExist:
+            return offers
+        suppliers = list(preferences.allowed_suppliers.all())
+        brands = list(preferences.interested_brands.all())
+        categories = list(preferences.interested_categories.all())
+        return [
+            offer for offer in offers
+            if (not suppliers or offer.supplier in suppliers)
+            and (not brands or offer.brand in brands)
+            and (not categories or offer.category in categories)
+        ]
+
+    def _expected(self):
+        expected = {}
+        for subscriber in Subscriber.objects.filter(is_active=True):
+            offers = self._old_filter(self.offers, subscriber)
+            if offers:
+                expected[subscriber.pk] = [offer.pk for offer in offers]
+        return expected
+
+    def _routed(self, index):
+        return {subscriber_id: [offer.pk for offer in offers] for subscriber_id, offers in index.route(self.offers).items()}
+
+    def test_matches_old_filter(self):
+        routed = self._routed(RoutingIndex.load())
+        self.assertEqual(routed, self._expected())
+        self.assertEqual(len(routed[self.brand_only.pk]), 3 * 4)
+        self.assertEqual(len(routed[self.category_only.pk]), 3 * 4 * 2)
+        self.assertEqual(len(routed[self.wildcard.pk]), len(self.offers))
+        self.assertEqual(len(routed[self.no_profile.pk]), len(self.offers))
+        self.assertNotIn(self.inactive.pk, routed)
+
+    def test_incremental_updates_match_old_filter(self):
+        routing_index.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.brand_only.preferences.interested_categories.add(self.categories[0])
+            self.wildcard.preferences.allowed_suppliers.add(self.suppliers[2])
+            self.inactive.is_active = True
+            self.inactive.save()
+            self.category_only.is_active = False
+            self.category_only.save()
+        self.assertEqual(self._routed(routing_index.get()), self._expected())
+        self.assertEqual(self._routed(RoutingIndex.load()), self._expected())
+
+
+class UltraMsgClientTests(SimpleTestCase):
+    def test_concurrency_limit_covers_all_calls(self):
+        client = UltraMsgClient('instance', 'token', max_concurrency=3)
+        lock = threading.Lock()
+        active, peak = [0], [0]
+
+        def post(url, data, timeout):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+            return mock.Mock(**{'json.return_value': {'sent': 'true'}})
+
+        with mock.patch.object(client.session, 'post', side_effect=post):
+            # عدة مهام توزيع في نفس الوقت، كل منها بـ max_concurrency خيطاً
+            results = []
+            jobs = [
+                threading.Thread(target=lambda: results.extend(client.send_many([('0500000001', 'hi')] * 6)))
+                for _ in range(4)
+            ]
+            for job in jobs:
+                job.start()
+            for job in jobs:
+                job.join()
+        self.assertEqual(len(results), 24)
+        self.assertTrue(all(result.success for result in results))
+        self.assertLessEqual(peak[0], 3)
+
+
+class DigestTests(TestCase):
+    def setUp(self):
+        suppliers = [Supplier.objects.create(name=f"Supplier {i}") for i in range(3)]
+        self.offers = [
+            Offer.objects.create(supplier=supplier, name=f"Phone {i}", storage="256GB", price=100 + i, currency='SAR')
+            for supplier in suppliers for i in range(4)
+        ]
+        self.subscriber = Subscriber.objects.create(name="Digest", whatsapp_number="5001", target_currency='SAR')
+
+    def _block(self, offer):
+        return OfferFragment.render(offer).with_price(NotificationEngine.format_price(self.prices[offer.pk]))
+
+    @staticmethod
+    def _codes(message):
+        return re.findall(r"OFF-\d+", message)
+
+    def test_digest_split_keeps_offer_blocks_whole(self):
+        self.prices = {offer.pk: PriceBreakdown('SAR', subtotal=offer.price) for offer in self.offers}
+        [single] = NotificationEngine.build_digest_messages(self.subscriber, self.offers, self.prices, max_length=100000)
+
+        max_length = len(self._block(self.offers[0])) * 3
+        messages = NotificationEngine.build_digest_messages(self.subscriber, self.offers, self.prices, max_length=max_length)
+        self.assertGreater(len(messages), 2)
+        for message in messages:
+            self.assertLessEqual(len(message), max_length)
+        for message in messages[1:]:
+            # كل رسالة تالية تبدأ بعنوان المورد
+            self.assertTrue(message.startswith("=" * 40 + "\nمن SUP-"), message[:60])
+        self.assertTrue(messages[-1].endswith("للاستفسار أو الطلب، راسلنا على هذا الرقم"))
+        for offer in self.offers:
+            self.assertEqual(sum(self._block(offer) in message for message in messages), 1, offer.name)
+        # نفس العروض بنفس الترتيب كما في الرسالة الواحدة
+        codes = [self._codes(message) for message in messages]
+        self.assertEqual(sum(codes, []), self._codes(single))
+        self.assertEqual(self._codes(single), [offer.code for offer in self.offers])
+
+    def test_flush_sends_only_due_digests(self):
+        now = timezone.now()
+        late = Subscriber.objects.create(name="Late", whatsapp_number="5002", target_currency='SAR', digest_window_minutes=60)
+        inactive = Subscriber.objects.create(name="Inactive", whatsapp_number="5003", target_currency='SAR', is_active=False)
+        for subscriber in (self.subscriber, inactive, late):
+            subscriber.digest_window_minutes = subscriber.digest_window_minutes or 10
+            subscriber.save()
+            PendingDigestOffer.objects.bulk_create([PendingDigestOffer(subscriber=subscriber, offer=offer) for offer in self.offers[:5]])
+        PendingDigestOffer.objects.update(created_at=now - timedelta(minutes=20))
+
+        get_price_matrix = digest.get_price_matrix
+
+        def price_matrix_with_new_offer(offers, subscribers):
+            # عرض يُؤجَّل أثناء بناء التجميع: لم يُرسل، فيجب أن يبقى للتجميع التالي
+            PendingDigestOffer.objects.create(subscriber=self.subscriber, offer=self.offers[-1])
+            return get_price_matrix(offers, subscribers)
+
+        client = mock.Mock()
+        client.send_many.side_effect = lambda messages, on_result=None: [
+            SendResult(number, True, 'ok', 0.0) for number, _ in messages
+        ]
+        with mock.patch.object(outbox, 'get_client', return_value=client), \
+                mock.patch.object(digest, 'get_price_matrix', side_effect=price_matrix_with_new_offer):
+            self.assertEqual(digest.flush_due_digests(now=now), 1)
+
+        [(sent,), _] = client.send_many.call_args
+        self.assertEqual([number for number, _ in sent], [self.subscriber.whatsapp_number])
+        for offer in self.offers[:5]:
+            self.assertIn(offer.code, sent[0][1])
+        self.assertEqual(
+            list(PendingDigestOffer.objects.filter(subscriber=self.subscriber).values_list('offer_id', flat=True)),
+            [self.offers[-1].pk],
+        )
+        # غير النشط تُحذف عروضه بدون إرسال، والذي لم تنقضِ مدته تبقى عروضه
+        self.assertFalse(PendingDigestOffer.objects.filter(subscriber=inactive).exists())
+        self.assertEqual(PendingDigestOffer.objects.filter(subscriber=late).count(), 5)
+        self.assertEqual(NotificationOutbox.objects.get().status, NotificationOutbox.STATUS_SENT)
+
+
+class OfferBatchApiTests(TestCase):
+    def setUp(self):
+        self.supplier = Supplier.objects.create(name="Supplier")
+        self.subscriber = Subscriber.objects.create(name="Customer", whatsapp_number="5001", target_currency='SAR')
+
+    def _post(self, document):
+        return self.client.post(reverse('offer-batch-api'), json.dumps(document), content_type='application/json')
+
+    def _batch(self, grouping_name="iPhone 15 Pro", variants=None):
+        variants = variants if variants is not None else [
+            {"name": "256GB Blue", "storage": "256GB", "price": "900", "currency": "USD"},
+            {"name": "512GB Natural", "storage": "512GB", "price": "1100", "currency": "USD"},
+        ]
+        group = {"grouping_name": grouping_name, "brand_name": "Apple", "category_name": "Phones", "variants": variants}
+        return {"supplier_id": self.supplier.pk, "offer_groups": [group]}
+
+    def test_saves_offers_and_starts_job(self):
+        SubscriberDeviceFee.objects.create(subscriber=self.subscriber, device_keyword="iPhone 15 Pro", fee=10, currency='SAR')
+        with mock.patch('management.views.start_distribution_job') as start_job:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self._post(self._batch())
+        self.assertEqual(response.status_code, 201, response.content)
+        data = response.json()
+        self.assertEqual(data['saved'], 2)
+        start_job.assert_called_once_with(data['job_id'])
+        self.assertEqual(
+            sorted(Offer.objects.values_list('name', 'price', 'brand__name')),
+            [("iPhone 15 Pro - 256GB Blue", Decimal('900.00'), "Apple"), ("iPhone 15 Pro - 512GB Natural", Decimal('1100.00'), "Apple")],
+        )
+
+    def test_field_errors(self):
+        response = self._post({"supplier_id": 0, "offer_groups": [{"grouping_name": "X", "variants": [{"price": "abc"}, "bad"]}]})
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(set(errors), {'supplier_id', 'offer_groups.0.variants.0.price', 'offer_groups.0.variants.1'})
+        self.assertEqual(self.client.post(reverse('offer-batch-api'), "{", content_type='application/json').status_code, 400)
+        self.assertFalse(Offer.objects.exists())
+
+    def test_combined_name_length(self):
+        # كل جزء صالح وحده، لكن "المجموعة - المتغير" أطول من Offer.name
+        batch = self._batch("G" * 200, [{"name": "V" * 50}, {"name": "V" * 53}])
+        response = self._post({**batch, "subscriber_id": self.subscriber.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['errors']), ['offer_groups.0.variants.1.name'])
+        self.assertFalse(Offer.objects.exists())
+
+    def test_missing_fees(self):
+        response = self._post(self._batch())
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['missing_fees'], [{
+            "subscriber_id": self.subscriber.pk, "subscriber_name": "Customer", "missing_devices": ["iPhone 15 Pro"],
+        }])
+        self.assertFalse(Offer.objects.exists())
+        # الإرسال لمشترك واحد لا يتطلب الرسوم
+        response = self._post({**self._batch(), "subscriber_id": self.subscriber.pk})
+        self.assertEqual(response.status_code, 201, response.content)
+
+
+class ParseCacheTests(TestCase):
+    TEXT = "iPhone 15 Pro\n256GB   Blue 900$\n"
+
+    def setUp(self):
+        self.calls = []
+        parse_cache.clear()
+
+    def tearDown(self):
+        parse_cache.clear()
+
+    def _parse(self, text):
+        self.calls.append(text)
+        return [{"grouping_name": "iPhone 15 Pro", "variants": [{"name": "256GB Blue", "price": 900, "shipping_cost": None}]}]
+
+    def test_whitespace_normalized_hit(self):
+        cache = ParseCache(max_entries=10, ttl=60)
+        first = cache.get_or_parse(self.TEXT, 'v1', self._parse)
+        again = cache.get_or_parse("  iPhone 15   Pro\n\n256GB Blue 900$", 'v1', self._parse)
+        self.assertEqual(again, first)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(cache.memory_hits, 1)
+        # عملية أخرى (ذاكرة فارغة) تجد النتيجة في الجدول
+        other = ParseCache(max_entries=10, ttl=60)
+        self.assertEqual(other.get_or_parse(self.TEXT + "\n", 'v1', self._parse), first)
+        self.assertEqual((other.db_hits, len(self.calls)), (1, 1))
+
+    def test_prompt_version_bump_misses(self):
+        with mock.patch.object(parser, '_parse_with_gemini', side_effect=self._parse):
+            parser.parse_with_ai(self.TEXT)
+            parser.parse_with_ai(self.TEXT)
+            with mock.patch.object(parser, 'PROMPT_VERSION', parser.PROMPT_VERSION + '-next'):
+                parser.parse_with_ai(self.TEXT)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(ParsedOfferCache.objects.count(), 2)
+
+    def test_ttl_expiry(self):
+        cache = ParseCache(max_entries=10, ttl=60)
+        cache.get_or_parse(self.TEXT, 'v1', self._parse)
+        later = timezone.now() + timedelta(seconds=61)
+        with mock.patch('management.parse_cache.timezone.now', return_value=later):
+            cache.get_or_parse(self.TEXT, 'v1', self._parse)
+            # الصف المنتهي حُذف عند الحفظ الجديد
+            self.assertEqual(ParsedOfferCache.objects.filter(expires_at__lte=later).count(), 0)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(cache.misses, 2)
+
+    def test_lru_eviction(self):
+        cache = ParseCache(max_entries=2, ttl=60)
+        for text in ("a", "b", "a", "c"):
+            cache.get_or_parse(text, 'v1', self._parse)
+        self.assertEqual(cache.stats()['memory_entries'], 2)
+        ParsedOfferCache.objects.all().delete()
+        # "b" هو الأقدم استخداماً فأُخرج من الذاكرة، و"a" و"c" باقيتان
+        for text in ("a", "c", "b"):
+            cache.get_or_parse(text, 'v1', self._parse)
+        self.assertEqual(self.calls, ["a", "b", "c", "b"])
+
+    def test_failed_parse_is_not_stored(self):
+        cache = ParseCache(max_entries=10, ttl=60)
+        failing = mock.Mock(return_value=[{"error": "Gemini API request failed", "retryable": True}])
+        for _ in range(2):
+            self.assertEqual(cache.get_or_parse(self.TEXT, 'v1', failing)[0]['error'], "Gemini API request failed")
+        self.assertEqual(failing.call_count, 2)
+        self.assertFalse(ParsedOfferCache.objects.exists())
+
+    def test_callers_get_a_copy(self):
+        with mock.patch.object(parser, '_parse_with_gemini', side_effect=self._parse):
+            for _ in range(3):
+                offer_groups = parser.parse_with_ai(self.TEXT)
+                self.assertIsNone(offer_groups[0]['variants'][0]['shipping_cost'])
+                # إضافة الشحن تعدّل المجموعات في مكانها (مثل apply_shipping_to_offer_groups)
+                offer_groups[0]['variants'][0]['shipping_cost'] = 25
+            parse_cache.clear()
+            self.assertIsNone(parser.parse_with_ai(self.TEXT)[0]['variants'][0]['shipping_cost'])
+        self.assertEqual(len(self.calls), 1)
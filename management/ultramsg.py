@@ -0,0 +1,153 @@
+# management/ultramsg.py
+"""
+عميل UltraMsg لإرسال رسائل واتساب.
+
+- جلسة requests.Session واحدة باتصالات مُعاد استخدامها (بدون مصافحة TCP/TLS لكل رسالة).
+- send_many ترسل عدة رسائل بالتوازي، والحد الأقصى للإرسالات المتزامنة (max_concurrency) يشمل
+  كل الاستدعاءات معاً (عدة مهام توزيع تتشارك نفس العميل ونفس مجموعة الاتصالات).
+- كل إرسال يُرجع SendResult يحتوي زمن الإرسال (latency).
+"""
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://api.ultramsg.com"
+
+
+class SendResult(NamedTuple):
+    recipient: str
+    success: bool
+    detail: object  # رد الـ API عند النجاح، أو رسالة الخطأ
+    latency: float  # بالثواني
+
+
+def format_number(recipient_number):
+    """تنظيف الرقم، وإضافة مفتاح الدولة (966 للسعودية) إذا كان ناقصاً."""
+    formatted_number = ''.join(c for c in (recipient_number or '') if c.isdigit())
+    if formatted_number and not formatted_number.startswith('966') and len(formatted_number) < 10:
+        formatted_number = '966' + formatted_number.lstrip('0')
+    return formatted_number
+
+
+class UltraMsgClient:
+    """
+    عميل لحساب (instance) واحد في UltraMsg.
+    base_url قابل للتغيير حتى يمكن تجربة العميل على خادم محلي بديل (انظر ultramsg_standin.py).
+    """
+
+    def __init__(self, instance_id, token, base_url=DEFAULT_BASE_URL, max_concurrency=8, timeout=20):
+        self.instance_id = instance_id
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        # كل الإرسالات في العملية تمر من هنا، فلا تتجاوز الطلبات المتزامنة عدد اتصالات الـ pool
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['content-type'] = 'application/x-www-form-urlencoded'
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.ULTRAMSG_INSTANCE_ID,
+            settings.ULTRAMSG_TOKEN,
+            base_url=getattr(settings, 'ULTRAMSG_BASE_URL', DEFAULT_BASE_URL),
+            max_concurrency=getattr(settings, 'ULTRAMSG_MAX_CONCURRENCY', 8),
+            timeout=getattr(settings, 'ULTRAMSG_TIMEOUT', 20),
+        )
+
+    @property
+    def configured(self):
+        return bool(self.instance_id and self.token)
+
+    @property
+    def url(self):
+        return f"{self.base_url}/{self.instance_id}/messages/chat"
+
+    def send(self, recipient_number, message_body):
+        """يرسل رسالة واحدة ويُرجع SendResult."""
+        started = time.perf_counter()
+        success, detail = self._post(recipient_number, message_body)
+        result = SendResult(recipient_number, success, detail, time.perf_counter() - started)
+        if success:
+            logger.info("WhatsApp message sent to %s in %.3fs", recipient_number, result.latency)
+        else:
+            logger.warning("WhatsApp message to %s failed in %.3fs: %s", recipient_number, result.latency, detail)
+        return result
+
+    def _post(self, recipient_number, message_body):
+        if not self.configured:
+            return False, "WhatsApp credentials not configured"
+        formatted_number = format_number(recipient_number)
+        if not formatted_number:
+            return False, "Invalid phone number"
+
+        payload = {"token": self.token, "to": formatted_number, "body": message_body}
+        try:
+            with self._slots:
+                response = self.session.post(self.url, data=payload, timeout=self.timeout)
+                response.raise_for_status()
+                response_data = response.json()
+        except requests.exceptions.RequestException as e:
+            return False, f"HTTP error: {str(e)}"
+        except json.JSONDecodeError:
+            return False, "Invalid response from WhatsApp API"
+        except Exception as e:
+            return False, f"Unexpected error: {str(e)}"
+
+        if response_data.get('sent') == 'true':
+            return True, response_data
+        return False, response_data.get('error', 'Unknown error')
+
+    def send_many(self, messages, on_result=None):
+        """
+        يرسل قائمة (رقم، نص) بالتوازي (max_concurrency إرسال في نفس الوقت، لكل الاستدعاءات معاً).
+        on_result (اختياري) تُستدعى لكل نتيجة فور انتهائها (من خيوط مختلفة، لكن ليس بالتزامن).
+        تُرجع قائمة SendResult بنفس ترتيب الرسائل.
+        """
+        messages = list(messages)
+        if not messages:
+            return []
+        lock = threading.Lock()
+
+        def send_one(message):
+            result = self.send(*message)
+            if on_result:
+                with lock:
+                    on_result(result)
+            return result
+
+        if len(messages) == 1 or self.max_concurrency == 1:
+            return [send_one(message) for message in messages]
+        workers = min(self.max_concurrency, len(messages))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ultramsg') as executor:
+            return list(executor.map(send_one, messages))
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """عميل مشترك لكل العملية (تُقرأ الإعدادات عند أول استخدام)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = UltraMsgClient.from_settings()
+    return _client
@@ -0,0 +1,101 @@
+# management/ultramsg_standin.py
+"""
+خادم HTTP محلي بديل لـ UltraMsg لاختبارات الحمل (بدون إرسال رسائل حقيقية).
+
+يحاكي POST /<instance>/messages/chat ويرد بنفس شكل رد UltraMsg، مع إمكانية ضبط:
+- latency / jitter: زمن الرد (بالملي ثانية).
+- error_rate: نسبة الطلبات التي ترد بـ {"error": ...}.
+- rate_limit: أقصى عدد طلبات في الثانية، وما زاد عنه يرد بـ 429.
+
+يُشغَّل عبر manage.py ultramsg_standin، أو داخل العملية عبر make_server (انظر أمر benchmark).
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0):
+        super().__init__(address, _Handler)
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.stats = {'requests': 0, 'sent': 0, 'errors': 0, 'rate_limited': 0}
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def admit(self):
+        """نافذة ثابتة مدتها ثانية: False إذا تجاوزنا rate_limit في الثانية الحالية."""
+        with self._lock:
+            self.stats['requests'] += 1
+            if not self.rate_limit:
+                return True
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            if self._window_count > self.rate_limit:
+                self.stats['rate_limited'] += 1
+                return False
+            return True
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def start(self):
+        """تشغيل الخادم في خيط خلفي (للاستخدام داخل العملية)."""
+        threading.Thread(target=self.serve_forever, name='ultramsg-standin', daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive حتى تُعاد استخدام الاتصالات كما مع UltraMsg
+
+    def do_POST(self):
+        server = self.server
+        form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode())
+        if not self.path.rstrip('/').endswith('/messages/chat'):
+            return self._reply(404, {'error': 'Not found'})
+        if not server.admit():
+            return self._reply(429, {'error': 'Too many requests'})
+
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+        if not form.get('token') or not form.get('to'):
+            server.count('errors')
+            return self._reply(200, {'error': 'Missing token or recipient'})
+        if random.random() < server.error_rate:
+            server.count('errors')
+            return self._reply(200, {'error': 'Simulated failure'})
+        server.count('sent')
+        return self._reply(200, {'sent': 'true', 'message': 'ok', 'id': server.stats['sent']})
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host='127.0.0.1', port=0, **options):
+    """port=0 يختار منفذاً متاحاً تلقائياً (انظر server.base_url)."""
+    return StandInServer((host, port), **options)
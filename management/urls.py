@@ -5,9 +5,7 @@ from . import views
 urlpatterns = [
     # --- المسارات الرئيسية ---
     path('', views.analyze_offer_view, name='analyze-offer'),
-    path('save-and-distribute/', views.save_and_distribute_view, name='save-and-distribute'),
     path('send-to-single/', views.send_to_single_view, name='send-to-single'),
-    path('save-and-send-single/', views.save_and_send_to_single_view, name='save-and-send-single'),
 
     # --- واجهات الإدارة ---
     path('offers-dashboard/', views.offers_dashboard_view, name='offers-dashboard'),
@@ -36,6 +34,9 @@ urlpatterns = [
 
     # --- واجهات API ---
     path('api/validate-fees/', views.validate_fees_api, name='validate-fees-api'),
+    path('api/offer-batches/', views.offer_batch_api, name='offer-batch-api'),
+    path('api/parse-cache/stats/', views.parse_cache_stats_api, name='parse-cache-stats-api'),
+    path('api/distribution-jobs/<str:job_id>/', views.distribution_job_api, name='distribution-job-api'),
     # --- بداية الإصلاح ---
     path('api/subscribers/<int:pk>/fees/', views.subscriber_fees_api_view, name='subscriber-fees-api'),
     # --- نهاية الإصلاح ---
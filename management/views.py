@@ -3,22 +3,26 @@
 # --- Imports ---
 import base64
 from django.shortcuts import get_object_or_404, render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.http import JsonResponse
 from django.contrib import messages
 from django.db import transaction
+from django.db.models import OuterRef, Subquery
 from django.conf import settings
-from collections import defaultdict
 from decimal import Decimal
-import re
 import requests
 import json
 import pprint
 
 # --- استيراد النماذج والنماذج (Forms) والمحرك ---
-from .forms import SupplierForm, SubscriberForm, ShippingRateForm, CurrencyRateForm, PreferenceForm
-from .parser import parse_document_with_ai, parse_with_ai, find_best_shipping_keyword_with_ai
-from .engine import DistributionEngine, distribute_offers_to_subscribers
-from .models import Offer, Brand, Category, Supplier, ShippingRate, Subscriber, CurrencyRate, SubscriberDeviceFee, Preference
+from .forms import SupplierForm, SubscriberForm, ShippingRateForm, CurrencyRateForm, PreferenceForm, validate_offer_batch
+from .parser import parse_document_with_ai, parse_offer_text
+from .parse_cache import parse_cache
+from .shipping import apply_shipping_to_offer_groups
+from .fees import find_missing_fees
+from .ingestion import ingest_offer_groups
+from .jobs import create_distribution_job, get_job, start_distribution_job
+from .models import Offer, Supplier, ShippingRate, Subscriber, CurrencyRate, SubscriberDeviceFee, Preference, SubscriberOfferPrice
 
 # ==============================================================================
 # 1. Main Application Views
@@ -33,156 +37,86 @@ def analyze_offer_view(request):
         context['selected_supplier_id'] = selected_supplier_id
         if offer_text and selected_supplier_id:
             try:
-                offer_groups = parse_with_ai(offer_text)
+                offer_groups = parse_offer_text(offer_text)
                 if isinstance(offer_groups, list) and offer_groups and 'error' in offer_groups[0]:
                     context['error_message'] = offer_groups[0]['error']
                 else:
-                    all_shipping_rates = list(ShippingRate.objects.all())
-                    for group in offer_groups:
-                        group_name_for_search = group.get('grouping_name', '').lower()
-                        best_match_rate = None
-                        if group_name_for_search:
-                            # --- بداية الإصلاح ---
-                            for rate in all_shipping_rates:
-                                # استخدام الحقل الصحيح 'product_keyword_en'
-                                keyword = rate.product_keyword_en.lower() if rate.product_keyword_en else ''
-                                if keyword and keyword in group_name_for_search:
-                                    if best_match_rate is None or len(keyword) > len(best_match_rate.product_keyword_en):
-                                        best_match_rate = rate
-                            # --- نهاية الإصلاح ---
-                            if best_match_rate is None:
-                                best_keyword = find_best_shipping_keyword_with_ai(group_name_for_search, all_shipping_rates)
-                                if best_keyword: 
-                                    best_match_rate = next((r for r in all_shipping_rates if r.product_keyword_en == best_keyword), None)
-                        
-                        for variant in group.get('variants', []):
-                            variant['shipping_cost'] = best_match_rate.cost if best_match_rate else 0.00
-                            variant['shipping_currency'] = best_match_rate.currency if best_match_rate else 'N/A'
+                    apply_shipping_to_offer_groups(offer_groups)
                     context['offer_groups'] = offer_groups
             except Exception as e:
                 context['error_message'] = f"An unexpected error occurred: {e}"
     return render(request, 'management/analyze_offer.html', context)
 
-@transaction.atomic
-def save_and_distribute_view(request):
-    """
-    يعالج الحفظ والتوزيع مع منطق تحقق من الرسوم على مرحلتين.
-    """
-    if request.method != 'POST':
-        return HttpResponse("This method is not allowed.", status=405)
-
-    # --- المرحلة 1: إعادة بناء البيانات من النموذج ---
-    reconstructed_data = defaultdict(lambda: {'variants': defaultdict(dict)})
-    device_names_for_validation = set()
-    
-    # استخراج كل البيانات وأسماء الأجهزة للتحقق
-    for key, value in request.POST.items():
-        if key.startswith('group-') and key.endswith('-grouping_name') and value:
-            device_names_for_validation.add(value.strip())
-        
-        variant_match = re.match(r'group-(\d+)-variant-(\d+)-(\w+)', key)
-        group_match = re.match(r'group-(\d+)-(\w+)', key)
-        if variant_match:
-            g_idx, v_idx, f_name = variant_match.groups()
-            if value: reconstructed_data[int(g_idx)]['variants'][int(v_idx)][f_name] = value
-        elif group_match:
-            g_idx, f_name = group_match.groups()
-            if value: reconstructed_data[int(g_idx)][f_name] = value
-            
-    if not reconstructed_data:
-        messages.warning(request, "لم يتم العثور على بيانات صالحة للحفظ.")
-        return redirect('analyze-offer')
-
-    # --- المرحلة 2: التحقق من الرسوم الإجبارية قبل الحفظ ---
-    external_subscribers = Subscriber.objects.filter(is_active=True, subscriber_type='EXTERNAL')
-    missing_fees_data = []
-    if external_subscribers.exists() and device_names_for_validation:
-        for sub in external_subscribers:
-            existing_fees = set(SubscriberDeviceFee.objects.filter(subscriber=sub).values_list('device_keyword', flat=True))
-            missing_for_this_sub = list(device_names_for_validation - existing_fees)
-            if missing_for_this_sub:
-                missing_fees_data.append({
-                    "subscriber_id": sub.id,
-                    "subscriber_name": sub.name,
-                    "missing_devices": missing_for_this_sub
-                })
-
-    # إذا كانت هناك رسوم ناقصة، توقف وأعد عرض الصفحة مع بيانات النافذة المنبثقة
-    if missing_fees_data:
-        messages.warning(request, "تنبيه: توجد رسوم إجبارية ناقصة. يرجى إدخالها للمتابعة.")
-        
-        # إعادة بناء السياق الكامل لإعادة عرض الصفحة بنفس البيانات
-        context = {
-            'suppliers': Supplier.objects.all(),
-            'selected_supplier_id': request.POST.get('supplier_id'),
-            'offer_groups': list(reconstructed_data.values()), # Pass the data back to the template
-            'show_fees_modal': True, # Flag to trigger the modal in JavaScript
-            'missing_fees_data': json.dumps(missing_fees_data) # بيانات الرسوم الناقصة
-        }
-        return render(request, 'management/analyze_offer.html', context)
-
-    # --- المرحلة 3: إذا نجح التحقق، قم بالحفظ والتوزيع ---
-    saved_offers = []
-    try:
-        supplier_id = request.POST.get('supplier_id')
-        if not supplier_id: raise Exception("لم يتم تحديد المورد.")
-        supplier_obj = Supplier.objects.get(id=supplier_id)
-
-        for group_index, group_data in sorted(reconstructed_data.items()):
-            group_name = group_data.get('grouping_name', '').strip()
-            if not group_name: continue
-            brand_obj, _ = Brand.objects.get_or_create(name=group_data.get('brand_name', 'Unknown').strip())
-            category_obj, _ = Category.objects.get_or_create(name=group_data.get('category_name', 'Uncategorized').strip())
-            
-            for variant_index, variant_data in sorted(group_data['variants'].items()):
-                variant_name = variant_data.get('name', '')
-                full_name = f"{group_name} - {variant_name}" if variant_name else group_name
-                new_offer = Offer.objects.create(
-                    supplier=supplier_obj, brand=brand_obj, category=category_obj, name=full_name,
-                    price=Decimal(variant_data.get('price') or '0.0'),
-                    currency=variant_data.get('currency') or 'USD',
-                    quantity=int(variant_data.get('quantity') or 0),
-                    storage=variant_data.get('storage') or '',
-                    condition=variant_data.get('condition') or 'New',
-                    spec_region=variant_data.get('spec_region') or '',
-                    color=variant_data.get('color') or '',
-                    shipping_cost=Decimal(variant_data.get('shipping_cost') or '0.0'),
-                    shipping_currency=variant_data.get('shipping_currency') or 'N/A'
-                )
-                saved_offers.append(new_offer)
-        
-        if saved_offers:
-            transaction.on_commit(lambda: DistributionEngine.distribute(saved_offers, supplier_obj))
-            messages.success(request, f"تم حفظ {len(saved_offers)} عرض بنجاح، وجاري إرسالها للمشتركين.")
-        else:
-            messages.warning(request, "لم يتم العثور على بيانات صالحة للحفظ.")
-    except Exception as e:
-        messages.error(request, f"حدث خطأ فادح: {e}")
-    return redirect('analyze-offer')
-
 
 # ==============================================================================
 # 2. API Views (for JavaScript)
 # ==============================================================================
 
+def offer_batch_api(request):
+    """
+    يحفظ دفعة عروض مرسلة كمستند JSON واحد (بدلاً من حقول النموذج group-N-variant-M-field) ويبدأ توزيعها.
+    - بدون subscriber_id: توزيع على كل المشتركين، بعد التحقق من الرسوم الإجبارية (409 مع missing_fees إن نقصت).
+    - مع subscriber_id: إرسال لهذا المشترك فقط.
+    """
+    if request.method != 'POST': return JsonResponse({'error': 'Invalid request method'}, status=405)
+    try:
+        document = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    batch, errors = validate_offer_batch(document)
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+    supplier_obj, subscriber_obj = batch['supplier'], batch['subscriber']
+
+    if subscriber_obj is None:
+        device_names = {group['grouping_name'].strip() for group in batch['offer_groups'] if group['grouping_name'].strip()}
+        missing_fees_data = find_missing_fees(device_names)
+        if missing_fees_data:
+            return JsonResponse({'missing_fees': missing_fees_data}, status=409)
+
+    with transaction.atomic():
+        saved_offers = ingest_offer_groups(supplier_obj, batch['offer_groups'])
+        if not saved_offers:
+            return JsonResponse({'errors': {'offer_groups': ["لم يتم العثور على بيانات صالحة للحفظ."]}}, status=400)
+        # التوزيع يتم في الخلفية بعد نجاح الحفظ، والطلب يعود فوراً برقم المهمة
+        job_id = create_distribution_job(saved_offers, supplier_obj, single_subscriber=subscriber_obj)
+        transaction.on_commit(lambda: start_distribution_job(job_id))
+
+    progress_url = reverse('distribution-job-api', args=[job_id])
+    target = f"إلى {subscriber_obj.name}" if subscriber_obj else "للمشتركين"
+    messages.success(request, f"تم حفظ {len(saved_offers)} عرض بنجاح، وجاري إرسالها {target}. رقم المهمة: {job_id} (المتابعة: {progress_url})")
+    return JsonResponse({
+        'saved': len(saved_offers),
+        'job_id': job_id,
+        'progress_url': progress_url,
+        'redirect_url': reverse('send-to-single' if subscriber_obj else 'analyze-offer'),
+    }, status=201)
+
+
 def validate_fees_api(request):
     """API to check for missing mandatory fees for external subscribers."""
     if request.method != 'POST': return JsonResponse({'error': 'Invalid request method'}, status=405)
     try:
         data = json.loads(request.body)
-        device_names = set(data.get('device_names', []))
-        if not device_names: return JsonResponse([])
-        external_subscribers = Subscriber.objects.filter(is_active=True, subscriber_type='EXTERNAL')
-        missing_fees_data = []
-        for sub in external_subscribers:
-            existing_fees_for_sub = set(SubscriberDeviceFee.objects.filter(subscriber=sub).values_list('device_keyword', flat=True))
-            missing_for_this_sub = list(device_names - existing_fees_for_sub)
-            if missing_for_this_sub:
-                missing_fees_data.append({"subscriber_id": sub.id, "subscriber_name": sub.name, "missing_devices": missing_for_this_sub})
+        missing_fees_data = find_missing_fees(data.get('device_names', []))
         return JsonResponse(missing_fees_data, safe=False)
     except json.JSONDecodeError: return JsonResponse({'error': 'Invalid JSON'}, status=400)
 
 
+def parse_cache_stats_api(request):
+    """عدادات الإصابة/الإخفاق لكاش تحليل النصوص (في هذه العملية)."""
+    return JsonResponse(parse_cache.stats())
+
+
+def distribution_job_api(request, job_id):
+    """API لمتابعة تقدم مهمة توزيع تعمل في الخلفية."""
+    job = get_job(job_id)
+    if job is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    return JsonResponse(job)
+
+
 @transaction.atomic
 def subscriber_fees_api_view(request, pk):
     """API لجلب وحفظ رسوم الأجهزة لمشترك معين."""
@@ -222,7 +156,18 @@ def offers_dashboard_view(request):
     if search_query: queryset = queryset.filter(name__icontains=search_query)
     supplier_filter = request.GET.get('supplier', '')
     if supplier_filter: queryset = queryset.filter(supplier_id=supplier_filter)
-    context = {'offers': queryset, 'suppliers': Supplier.objects.all(), 'search_query': search_query, 'selected_supplier': supplier_filter}
+    # أسعار مشترك معين تُقرأ من جدول الأسعار المحسوبة مسبقاً (بدون تشغيل محرك التسعير)
+    subscriber_filter = request.GET.get('subscriber', '')
+    if subscriber_filter:
+        subscriber_prices = SubscriberOfferPrice.objects.filter(offer=OuterRef('pk'), subscriber_id=subscriber_filter)
+        queryset = queryset.annotate(
+            subscriber_price=Subquery(subscriber_prices.values('price')[:1]),
+            subscriber_currency=Subquery(subscriber_prices.values('currency')[:1]),
+        )
+    context = {
+        'offers': queryset, 'suppliers': Supplier.objects.all(), 'search_query': search_query, 'selected_supplier': supplier_filter,
+        'subscribers': Subscriber.objects.filter(is_active=True).order_by('name'), 'selected_subscriber': subscriber_filter,
+    }
     return render(request, 'management/offers_dashboard.html', context)
 
 # --- Supplier CRUD ---
@@ -407,31 +352,13 @@ def send_to_single_view(request):
             try:
                 # --- بداية الإصلاح ---
                 # استخدام اسم المتغير الصحيح "offer_groups"
-                offer_groups = parse_with_ai(offer_text)
+                offer_groups = parse_offer_text(offer_text)
                 
                 if isinstance(offer_groups, list) and offer_groups and 'error' in offer_groups[0]:
                     context['error_message'] = offer_groups[0]['error']
                 else:
                     # منطق حساب الشحن (يعمل بشكل سليم)
-                    all_shipping_rates = list(ShippingRate.objects.all())
-                    for group in offer_groups:
-                        group_name_for_search = group.get('grouping_name', '').lower()
-                        best_match_rate = None
-                        if group_name_for_search:
-                            for rate in all_shipping_rates:
-                                # استخدام الحقل الصحيح 'product_keyword_en'
-                                keyword = rate.product_keyword_en.lower() if rate.product_keyword_en else ''
-                                if keyword and keyword in group_name_for_search:
-                                    if best_match_rate is None or len(keyword) > len(best_match_rate.product_keyword_en):
-                                        best_match_rate = rate
-                            if best_match_rate is None:
-                                best_keyword = find_best_shipping_keyword_with_ai(group_name_for_search, all_shipping_rates)
-                                if best_keyword:
-                                    best_match_rate = next((r for r in all_shipping_rates if r.product_keyword_en == best_keyword), None)
-                        
-                        for variant in group.get('variants', []):
-                            variant['shipping_cost'] = best_match_rate.cost if best_match_rate else 0.00
-                            variant['shipping_currency'] = best_match_rate.currency if best_match_rate else 'N/A'
+                    apply_shipping_to_offer_groups(offer_groups)
                     
                     # تمرير المتغير بالاسم الصحيح إلى القالب
                     context['offer_groups'] = offer_groups
@@ -443,83 +370,6 @@ def send_to_single_view(request):
     return render(request, 'management/send_to_single.html', context)
 
 
-@transaction.atomic
-def save_and_send_to_single_view(request):
-    """
-    يحفظ العروض ويرسلها إلى مشترك واحد محدد فقط.
-    (النسخة النهائية والمصححة)
-    """
-    if request.method != 'POST':
-        return HttpResponse("This method is not allowed.", status=405)
-    
-    # --- بداية الإصلاح: استخدام نفس منطق إعادة البناء الموثوق ---
-    reconstructed_data = defaultdict(lambda: {'variants': defaultdict(dict)})
-    for key, value in request.POST.items():
-        if key == 'csrfmiddlewaretoken': continue
-        
-        variant_match = re.match(r'group-(\d+)-variant-(\d+)-(\w+)', key)
-        group_match = re.match(r'group-(\d+)-(\w+)', key)
-
-        if variant_match:
-            group_index, variant_index, field_name = variant_match.groups()
-            if value: reconstructed_data[int(group_index)]['variants'][int(variant_index)][field_name] = value
-        elif group_match:
-            group_index, field_name = group_match.groups()
-            if value: reconstructed_data[int(group_index)][field_name] = value
-    # --- نهاية الإصلاح ---
-
-    if not reconstructed_data:
-        messages.warning(request, "لم يتم العثور على بيانات صالحة للحفظ.")
-        return redirect('send-to-single')
-
-    saved_offers = []
-    try:
-        supplier_id = request.POST.get('supplier_id')
-        subscriber_id = request.POST.get('subscriber_id')
-        
-        if not supplier_id or not subscriber_id:
-            raise Exception("لم يتم تحديد المورد أو المشترك.")
-            
-        supplier_obj = Supplier.objects.get(id=supplier_id)
-        subscriber_obj = Subscriber.objects.get(id=subscriber_id)
-
-        for group_index, group_data in sorted(reconstructed_data.items()):
-            group_name = group_data.get('grouping_name', '').strip()
-            if not group_name: continue
-
-            brand_obj, _ = Brand.objects.get_or_create(name=group_data.get('brand_name', 'Unknown').strip())
-            category_obj, _ = Category.objects.get_or_create(name=group_data.get('category_name', 'Uncategorized').strip())
-            
-            for variant_index, variant_data in sorted(group_data['variants'].items()):
-                variant_name = variant_data.get('name', '')
-                full_name = f"{group_name} - {variant_name}" if variant_name else group_name
-                
-                new_offer = Offer.objects.create(
-                    supplier=supplier_obj, brand=brand_obj, category=category_obj, name=full_name,
-                    price=Decimal(variant_data.get('price') or '0.0'),
-                    currency=variant_data.get('currency') or 'USD',
-                    quantity=int(variant_data.get('quantity') or 0),
-                    storage=variant_data.get('storage') or '',
-                    condition=variant_data.get('condition') or 'New',
-                    spec_region=variant_data.get('spec_region') or '',
-                    color=variant_data.get('color') or '',
-                    shipping_cost=Decimal(variant_data.get('shipping_cost') or '0.0'),
-                    shipping_currency=variant_data.get('shipping_currency') or 'N/A'
-                )
-                saved_offers.append(new_offer)
-        
-        if saved_offers:
-            transaction.on_commit(lambda: DistributionEngine.distribute(saved_offers, supplier_obj, single_subscriber=subscriber_obj))
-            messages.success(request, f"تم حفظ {len(saved_offers)} عرض بنجاح، وجاري إرسالها إلى {subscriber_obj.name}.")
-        else:
-            messages.warning(request, "لم يتم العثور على بيانات صالحة للحفظ.")
-            
-    except Exception as e:
-        messages.error(request, f"حدث خطأ فادح: {e}")
-
-    return redirect('send-to-single')
-
-
 def shipping_rate_manager_view(request):
     """Renders the new interactive shipping rate manager page."""
     return render(request, 'management/shipping_rate_manager.html')